@@ -1,7 +1,22 @@
-import os, json, time, logging, io, signal, sys, urllib.request
+import os, io, json, time, logging, signal, sys, math, hashlib, tempfile, threading, urllib.request
+from collections import OrderedDict
+from datetime import datetime
+import resource
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures import TimeoutError as FutureTimeout
 from urllib.parse import unquote_plus
 import boto3
-from PIL import Image
+from boto3.s3.transfer import TransferConfig
+
+import imaging
+from imaging import (FORMATS, DEFAULT_FORMATS, DEFAULT_SIZE_PROFILES, UPSCALE_POLICIES, ImageTooLarge, check_pixels,
+                     decode_memory, header_info, header_size, normalize_formats, parse_size_profiles, profiled,
+                     render_variant, render_variants, target_dims, with_settings)
+from metrics import StageMetrics, mp_bucket
+from counters import ViewAggregator, parse_view_events
+from publisher import EventPublisher, PublishError
 
 # -------- Logging / tunables --------
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -13,30 +28,173 @@ POLL_WAIT_SECONDS   = int(os.getenv("POLL_WAIT_SECONDS", "20"))
 VISIBILITY_TIMEOUT  = int(os.getenv("VISIBILITY_TIMEOUT", "60"))
 HEARTBEAT_EVERY     = int(os.getenv("HEARTBEAT_EVERY", "30"))          # loops
 QUEUE_STATS_EVERY   = int(os.getenv("QUEUE_STATS_EVERY", "60"))        # loops
+RECEIVE_BATCH_SIZE  = int(os.getenv("RECEIVE_BATCH_SIZE", "10"))       # MaxNumberOfMessages per receive (1-10)
+RESIZE_WEIGHT       = int(os.getenv("RESIZE_WEIGHT", "3"))             # share of the in-flight window per queue
+PRIORITY_WEIGHT     = int(os.getenv("PRIORITY_WEIGHT", "6"))           # priority lane (priority_queue_url), if configured
+INGEST_WEIGHT       = int(os.getenv("INGEST_WEIGHT", "1"))
+STARVATION_SECONDS  = float(os.getenv("STARVATION_SECONDS", "5"))      # a message buffered this long is dispatched first ...
+STARVATION_SKIPS    = int(os.getenv("STARVATION_SKIPS", "10"))         # ... once its queue has been passed over this many times
+
+RESIZE_FANOUT       = os.getenv("RESIZE_FANOUT", "batched").lower()  # batched = one resize_all task per image; per_size = one task per size
+
+def _container_cpus():
+    # cgroup v2 / v1 CPU quota first (ECS/Fargate), then the affinity mask
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except Exception:
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, math.ceil(quota / period))
+    except Exception:
+        pass
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except Exception:
+        return max(1, os.cpu_count() or 1)
+
+def _container_memory():
+    # cgroup v2 / v1 memory limit (ECS task or container), then physical memory
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                raw = f.read().strip()
+            if raw.isdigit() and int(raw) < 1 << 60:   # v1 reports "no limit" as a huge number
+                return int(raw)
+        except Exception:
+            pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+WORKER_MODE         = os.getenv("WORKER_MODE", "concurrent").lower()  # concurrent | serial | counters (view-counter consumer)
+IO_THREADS          = int(os.getenv("IO_THREADS", "8"))                # messages handled at once (S3/SQS/DDB I/O)
+CPU_PROCS           = int(os.getenv("CPU_PROCS", "0")) or _container_cpus()  # decode/resize/encode processes
+MAX_INFLIGHT        = int(os.getenv("MAX_INFLIGHT", "20"))             # hard cap on received-but-unfinished messages
+VISIBILITY_SAFETY   = float(os.getenv("VISIBILITY_SAFETY", "0.8"))     # fraction of VISIBILITY_TIMEOUT we plan to use
+
+LEASE_TICK_SECONDS   = float(os.getenv("LEASE_TICK_SECONDS", "1"))
+LEASE_MARGIN_SECONDS = int(os.getenv("LEASE_MARGIN_SECONDS", str(max(5, VISIBILITY_TIMEOUT // 3))))  # extend when less than this is left
+LEASE_MAX_SECONDS    = int(os.getenv("LEASE_MAX_SECONDS", "3600"))    # stop extending (let SQS redeliver) after this long
+DELETE_FLUSH_SECONDS = float(os.getenv("DELETE_FLUSH_SECONDS", "1"))  # max delay before a partial delete batch is sent
+
+PROBE_BYTES          = int(os.getenv("PROBE_BYTES", "65536"))        # first ranged GET when reading an original's header
+PROBE_MAX_BYTES      = int(os.getenv("PROBE_MAX_BYTES", "1048576"))  # give up on ranges (full GET) past this
+
+SPOOL_MAX_BYTES       = int(os.getenv("SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))   # originals above this stream to local disk
+SPOOL_DIR             = os.getenv("SPOOL_DIR") or None                           # default: system temp dir
+DOWNLOAD_CHUNK_BYTES  = int(os.getenv("DOWNLOAD_CHUNK_BYTES", str(1024 * 1024)))
+MULTIPART_THRESHOLD   = int(os.getenv("MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))  # variants above this use multipart upload
+MULTIPART_CHUNK_BYTES = int(os.getenv("MULTIPART_CHUNK_BYTES", str(8 * 1024 * 1024)))
+
+DECODE_MEMORY_MB       = int(os.getenv("DECODE_MEMORY_MB", "0"))            # decoded pixels in flight at once; 0 = a fraction of the task memory
+DECODE_MEMORY_FRACTION = float(os.getenv("DECODE_MEMORY_FRACTION", "0.5"))  # used when DECODE_MEMORY_MB=0
+QUARANTINE_PREFIX      = os.getenv("QUARANTINE_PREFIX", "")                 # move originals over MAX_IMAGE_PIXELS here; empty = leave in place
+
+DEDUP_MODE = os.getenv("DEDUP_MODE", "copy").lower()   # off | copy (S3 copy of the earlier variants) | alias (metadata only)
+
+ORIGINAL_CACHE_DIR       = os.getenv("ORIGINAL_CACHE_DIR", "")                     # empty = cache disabled
+ORIGINAL_CACHE_MAX_BYTES = int(os.getenv("ORIGINAL_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))  # size to the task's ephemeral storage
+
+PUBLISH_MAX_DELAY    = float(os.getenv("PUBLISH_MAX_DELAY", "0.05"))   # seconds an event may wait for its batch to fill
+PUBLISH_MAX_ATTEMPTS = int(os.getenv("PUBLISH_MAX_ATTEMPTS", "4"))
+PUBLISH_TIMEOUT      = float(os.getenv("PUBLISH_TIMEOUT", "30"))       # ingest: max wait for its resize tasks to be accepted
+
+COUNTER_FLUSH_SECONDS = float(os.getenv("COUNTER_FLUSH_SECONDS", "10"))   # WORKER_MODE=counters: max age of an unflushed view
+COUNTER_FLUSH_KEYS    = int(os.getenv("COUNTER_FLUSH_KEYS", "1000"))      # ... or flush once this many (imageId, size) are buffered
+COUNTER_WRITE_THREADS = int(os.getenv("COUNTER_WRITE_THREADS", "8"))      # parallel UpdateItem calls per flush
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9102"))   # Prometheus text on :METRICS_PORT/metrics; 0 = off
+
+SCALE_EVERY_SECONDS     = float(os.getenv("SCALE_EVERY_SECONDS", "60"))    # publish the scaling signal; 0 = off
+SCALE_TARGET_SECONDS    = float(os.getenv("SCALE_TARGET_SECONDS", "120"))  # drain the current backlog within this time
+SCALE_MIN_WORKERS       = int(os.getenv("SCALE_MIN_WORKERS", "1"))
+SCALE_MAX_WORKERS       = int(os.getenv("SCALE_MAX_WORKERS", "20"))
+SCALE_METRICS_NAMESPACE = os.getenv("SCALE_METRICS_NAMESPACE", "ImagePipeline/Resizer")
+ECS_CLUSTER = os.getenv("ECS_CLUSTER", "")   # with ECS_SERVICE: running task count via ecs:DescribeServices
+ECS_SERVICE = os.getenv("ECS_SERVICE", "")
 
 APPCONFIG_RETRIES     = int(os.getenv("APPCONFIG_RETRIES", "0"))       # 0 = no retry (compose wait loop usually handles it)
 APPCONFIG_RETRY_SLEEP = float(os.getenv("APPCONFIG_RETRY_SLEEP", "1"))
+CONFIG_POLL_SECONDS   = float(os.getenv("CONFIG_POLL_SECONDS", "45"))  # re-read AppConfig for live tunables; 0 = never
+
+# AppConfig key -> (global it sets, type, min, max). These are re-applied while the worker runs (see ConfigWatcher);
+# a tunable also set in ENV is pinned to the ENV value.
+_TUNABLES = {
+    "poll_wait_seconds":    ("POLL_WAIT_SECONDS", int, 0, 20),
+    "visibility_timeout":   ("VISIBILITY_TIMEOUT", int, 1, 43200),
+    "receive_batch_size":   ("RECEIVE_BATCH_SIZE", int, 1, 10),
+    "resize_weight":        ("RESIZE_WEIGHT", int, 1, 100),
+    "priority_weight":      ("PRIORITY_WEIGHT", int, 1, 100),
+    "ingest_weight":        ("INGEST_WEIGHT", int, 1, 100),
+    "starvation_seconds":   ("STARVATION_SECONDS", float, 0, 3600),
+    "starvation_skips":     ("STARVATION_SKIPS", int, 1, 10 ** 6),
+    "io_threads":           ("IO_THREADS", int, 1, 256),
+    "max_inflight":         ("MAX_INFLIGHT", int, 1, 10000),
+    "visibility_safety":    ("VISIBILITY_SAFETY", float, 0.05, 1.0),
+    "lease_margin_seconds": ("LEASE_MARGIN_SECONDS", int, 1, 43200),
+    "lease_max_seconds":    ("LEASE_MAX_SECONDS", int, 1, 43200),
+    "delete_flush_seconds": ("DELETE_FLUSH_SECONDS", float, 0, 60),
+    "publish_max_delay":    ("PUBLISH_MAX_DELAY", float, 0, 10),
+    "publish_timeout":      ("PUBLISH_TIMEOUT", float, 1, 600),
+    "counter_flush_seconds": ("COUNTER_FLUSH_SECONDS", float, 0, 3600),
+    "counter_flush_keys":   ("COUNTER_FLUSH_KEYS", int, 1, 10 ** 6),
+    "heartbeat_every":      ("HEARTBEAT_EVERY", int, 0, 10 ** 6),
+    "queue_stats_every":    ("QUEUE_STATS_EVERY", int, 0, 10 ** 6),
+    "scale_every_seconds":  ("SCALE_EVERY_SECONDS", float, 0, 3600),
+    "scale_target_seconds": ("SCALE_TARGET_SECONDS", float, 1, 86400),
+    "scale_min_workers":    ("SCALE_MIN_WORKERS", int, 0, 10000),
+    "scale_max_workers":    ("SCALE_MAX_WORKERS", int, 1, 10000),
+    "probe_bytes":          ("PROBE_BYTES", int, 1024, 64 * 1024 * 1024),
+    "spool_max_bytes":      ("SPOOL_MAX_BYTES", int, 0, 1 << 40),
+    "decode_memory_mb":     ("DECODE_MEMORY_MB", int, 0, 1 << 20),
+    # encoder settings, applied in imaging (and in each pool process before its next task)
+    "fast_resize":          ("FAST_RESIZE", bool, None, None),
+    "reducing_gap":         ("REDUCING_GAP", float, 0, 16),
+    "jpeg_quality":         ("JPEG_QUALITY", int, 1, 100),
+    "max_image_pixels":     ("MAX_IMAGE_PIXELS", int, 1, 10 ** 10),
+}
+_IMAGING_TUNABLES = {"FAST_RESIZE": "fast_resize", "REDUCING_GAP": "reducing_gap", "JPEG_QUALITY": "jpeg_quality",
+                     "MAX_IMAGE_PIXELS": "max_image_pixels"}
+# set once at startup; a changed value is logged and ignored until the worker restarts
+_RESTART_ONLY = ("REGION", "BUCKET_NAME", "DDB_TABLE_METADATA", "DDB_TABLE_COUNTERS", "INGEST_QUEUE_URL",
+                 "RESIZE_QUEUE_URL", "PRIORITY_QUEUE_URL", "KINESIS_STREAM_NAME", "VIEWS_QUEUE_URL",
+                 "VIEWS_STREAM_NAME")
+_APPCONFIG_VERSION = None   # Configuration-Version of the last AppConfig document read
 
 # -------- AppConfig (Lambda extension/Agent endpoint) --------
-def _load_appconfig_extension():
+def _appconfig_url():
     app = os.getenv("APPCONFIG_APPLICATION")
     env = os.getenv("APPCONFIG_ENVIRONMENT")
     profile = os.getenv("APPCONFIG_PROFILE")
     if not (app and env and profile):
+        return None
+    base = os.getenv("APPCONFIG_BASE_URL", "http://localhost:2772")
+    return f"{base}/applications/{app}/environments/{env}/configurations/{profile}"
+
+def _load_appconfig_extension(retries=None, quiet=False):
+    global _APPCONFIG_VERSION
+    url = _appconfig_url()
+    if not url:
         log.info("APPCONFIG_* not set; skipping AppConfig and using ENV only.")
         return {}
 
-    base = os.getenv("APPCONFIG_BASE_URL", "http://localhost:2772")
-    url  = f"{base}/applications/{app}/environments/{env}/configurations/{profile}"
-    attempts = max(1, APPCONFIG_RETRIES or 1)
+    attempts = max(1, (APPCONFIG_RETRIES if retries is None else retries) or 1)
+    level = logging.DEBUG if quiet else logging.INFO
 
     for i in range(1, attempts + 1):
         try:
-            log.info("Loading config from AppConfig: %s (try %d/%d)", url, i, attempts)
+            log.log(level, "Loading config from AppConfig: %s (try %d/%d)", url, i, attempts)
             with urllib.request.urlopen(url, timeout=2.5) as r:
                 txt = r.read().decode("utf-8")
                 cfg = json.loads(txt)
-                log.info("AppConfig loaded with keys: %s", sorted(cfg.keys()))
+                _APPCONFIG_VERSION = r.headers.get("Configuration-Version") or _APPCONFIG_VERSION
+                log.log(level, "AppConfig loaded (version %s) with keys: %s", _APPCONFIG_VERSION, sorted(cfg.keys()))
                 return cfg
         except Exception as e:
             if i == attempts:
@@ -59,11 +217,39 @@ def _normalize(cfg):
     ddb_counters   = val("ddb_table_counters", "DDB_TABLE_COUNTERS", default=os.getenv("DDB_TABLE_COUNTERS", ""))
     ingest_q       = val("ingest_queue_url", "INGEST_QUEUE_URL", default=os.getenv("INGEST_QUEUE_URL"))
     resize_q       = val("resize_queue_url", "RESIZE_QUEUE_URL", default=os.getenv("RESIZE_QUEUE_URL"))
+    priority_q     = val("priority_queue_url", "PRIORITY_QUEUE_URL", default=os.getenv("PRIORITY_QUEUE_URL", ""))
     kinesis_stream = val("kinesis_stream_name", "KINESIS_STREAM_NAME", default=os.getenv("KINESIS_STREAM_NAME", ""))
+    views_q        = val("views_queue_url", "VIEWS_QUEUE_URL", default=os.getenv("VIEWS_QUEUE_URL", ""))
+    views_stream   = val("views_stream_name", "VIEWS_STREAM_NAME", default=os.getenv("VIEWS_STREAM_NAME", ""))
     default_sizes  = val("default_sizes", "DEFAULT_SIZES", default=os.getenv("DEFAULT_SIZES", "thumb,medium,large"))
+    variant_fmts   = val("variant_formats", "VARIANT_FORMATS", default=os.getenv("VARIANT_FORMATS") or {})
+    size_profiles  = val("size_profiles", "SIZE_PROFILES", default=os.getenv("SIZE_PROFILES") or DEFAULT_SIZE_PROFILES)
+    upscale_policy = val("upscale_policy", "UPSCALE_POLICY", default=os.getenv("UPSCALE_POLICY", "copy"))
+    priority_sizes = val("priority_sizes", "PRIORITY_SIZES", default=os.getenv("PRIORITY_SIZES"))
 
     if isinstance(default_sizes, str):
         default_sizes = [s.strip() for s in default_sizes.split(",") if s.strip()]
+    if isinstance(variant_fmts, str):
+        variant_fmts = json.loads(variant_fmts)
+    if isinstance(size_profiles, str):
+        size_profiles = json.loads(size_profiles)
+    try:
+        size_profiles = parse_size_profiles(size_profiles)
+    except ValueError as e:
+        raise RuntimeError(f"Invalid size_profiles: {e}")
+    if upscale_policy not in UPSCALE_POLICIES:
+        raise RuntimeError(f"Invalid upscale_policy {upscale_policy!r}; expected one of {UPSCALE_POLICIES}")
+    unknown = [s for s in default_sizes if s not in size_profiles]
+    if unknown:
+        raise RuntimeError(f"default_sizes {unknown} are not defined in size_profiles {sorted(size_profiles)}")
+    if priority_sizes is None:
+        priority_sizes = [s for s in ("thumb",) if s in size_profiles]
+    else:
+        if isinstance(priority_sizes, str):
+            priority_sizes = [s.strip() for s in priority_sizes.split(",") if s.strip()]
+        unknown = [s for s in priority_sizes if s not in size_profiles]
+        if unknown:
+            raise RuntimeError(f"priority_sizes {unknown} are not defined in size_profiles {sorted(size_profiles)}")
 
     cfg_norm = {
         "REGION": region,
@@ -72,17 +258,56 @@ def _normalize(cfg):
         "DDB_TABLE_COUNTERS": ddb_counters,
         "INGEST_QUEUE_URL": ingest_q,
         "RESIZE_QUEUE_URL": resize_q,
+        "PRIORITY_QUEUE_URL": priority_q,
         "KINESIS_STREAM_NAME": kinesis_stream,
+        "VIEWS_QUEUE_URL": views_q,
+        "VIEWS_STREAM_NAME": views_stream,
         "DEFAULT_SIZES": default_sizes,
+        "VARIANT_FORMATS": variant_fmts,
+        "SIZE_PROFILES": size_profiles,
+        "UPSCALE_POLICY": upscale_policy,
+        "PRIORITY_SIZES": priority_sizes,
     }
 
-    missing = [k for k in ("BUCKET_NAME", "DDB_TABLE_METADATA", "INGEST_QUEUE_URL", "RESIZE_QUEUE_URL") if not cfg_norm.get(k)]
+    if WORKER_MODE == "counters":
+        required = ("DDB_TABLE_METADATA", "DDB_TABLE_COUNTERS")
+        if not (views_q or views_stream):
+            raise RuntimeError("WORKER_MODE=counters needs views_queue_url or views_stream_name")
+    else:
+        required = ("BUCKET_NAME", "DDB_TABLE_METADATA", "INGEST_QUEUE_URL", "RESIZE_QUEUE_URL")
+    missing = [k for k in required if not cfg_norm.get(k)]
     if missing:
         raise RuntimeError(f"Missing required config: {missing}. Provide via AppConfig or ENV.")
+    cfg_norm["TUNABLES"] = _parse_tunables(cfg)
     return cfg_norm
 
-def load_config():
-    cfg = _load_appconfig_extension()
+def _parse_tunables(cfg):
+    """{GLOBAL_NAME: value} for the _TUNABLES keys present in cfg (snake_case or UPPER_CASE), minus ENV-pinned ones.
+
+    Raises RuntimeError if any value has the wrong type or is out of range.
+    """
+    out, bad = {}, []
+    for key, (name, typ, lo, hi) in _TUNABLES.items():
+        raw = cfg.get(key, cfg.get(name))
+        if raw in (None, "") or os.getenv(name) not in (None, ""):
+            continue
+        try:
+            if typ is bool:
+                v = raw if isinstance(raw, bool) else str(raw).lower() not in ("0", "false", "no", "off")
+            else:
+                v = typ(raw)
+                if not lo <= v <= hi:
+                    raise ValueError(f"not within [{lo}, {hi}]")
+        except (TypeError, ValueError) as e:
+            bad.append(f"{key}={raw!r} ({e})")
+            continue
+        out[name] = v
+    if bad:
+        raise RuntimeError(f"Invalid tunables: {', '.join(bad)}")
+    return out
+
+def _effective_config(cfg):
+    cfg = dict(cfg)
 
     # ENV overrides on top of AppConfig
     env_overrides = {
@@ -91,50 +316,127 @@ def load_config():
         "DDB_TABLE_COUNTERS": os.getenv("DDB_TABLE_COUNTERS"),
         "INGEST_QUEUE_URL": os.getenv("INGEST_QUEUE_URL"),
         "RESIZE_QUEUE_URL": os.getenv("RESIZE_QUEUE_URL"),
+        "PRIORITY_QUEUE_URL": os.getenv("PRIORITY_QUEUE_URL"),
         "KINESIS_STREAM_NAME": os.getenv("KINESIS_STREAM_NAME"),
+        "VIEWS_QUEUE_URL": os.getenv("VIEWS_QUEUE_URL"),
+        "VIEWS_STREAM_NAME": os.getenv("VIEWS_STREAM_NAME"),
         "REGION": os.getenv("REGION"),
         "DEFAULT_SIZES": os.getenv("DEFAULT_SIZES"),
+        "VARIANT_FORMATS": os.getenv("VARIANT_FORMATS"),
+        "SIZE_PROFILES": os.getenv("SIZE_PROFILES"),
+        "UPSCALE_POLICY": os.getenv("UPSCALE_POLICY"),
+        "PRIORITY_SIZES": os.getenv("PRIORITY_SIZES"),
     }
     for k, v in env_overrides.items():
         if v not in (None, ""):
             cfg[k] = v
 
-    norm = _normalize(cfg)
-    # Small redacted config log
-    redacted = dict(norm)
-    for k in ("INGEST_QUEUE_URL", "RESIZE_QUEUE_URL"):
+    return _normalize(cfg)
+
+def _redacted(cfg):
+    redacted = dict(cfg)
+    for k in ("INGEST_QUEUE_URL", "RESIZE_QUEUE_URL", "PRIORITY_QUEUE_URL", "VIEWS_QUEUE_URL"):
         if redacted.get(k):
             redacted[k] = redacted[k].rsplit("/", 1)[-1]
-    log.info("Effective config: %s", redacted)
+    return redacted
+
+def load_config():
+    norm = _effective_config(_load_appconfig_extension())
+    # Small redacted config log
+    log.info("Effective config (version %s): %s", _APPCONFIG_VERSION, _redacted(norm))
     return norm
 
 # -------- Load config & clients --------
-_CFG = load_config()
-REGION = _CFG["REGION"]
-BUCKET = _CFG["BUCKET_NAME"]
-DDB_META = _CFG["DDB_TABLE_METADATA"]
-DDB_COUNTERS = _CFG["DDB_TABLE_COUNTERS"]
-INGEST_Q_URL = _CFG["INGEST_QUEUE_URL"]
-RESIZE_Q_URL = _CFG["RESIZE_QUEUE_URL"]
-KINESIS_STREAM_NAME = _CFG["KINESIS_STREAM_NAME"]
-DEFAULT_SIZES = _CFG["DEFAULT_SIZES"]
-
-sqs = boto3.client("sqs", region_name=REGION)
-s3  = boto3.client("s3",  region_name=REGION)
-ddb = boto3.client("dynamodb", region_name=REGION)
-kin = boto3.client("kinesis",  region_name=REGION)
+# Set by init(): importing this module loads no config and creates no clients.
+_CFG = None
+REGION = BUCKET = DDB_META = DDB_COUNTERS = INGEST_Q_URL = RESIZE_Q_URL = KINESIS_STREAM_NAME = None
+VIEWS_Q_URL = VIEWS_STREAM_NAME = PRIORITY_Q_URL = None
+DEFAULT_SIZES = SIZE_PROFILES = UPSCALE_POLICY = VARIANT_FORMATS = PRIORITY_SIZES = None
+sqs = s3 = ddb = kin = ecs = None
+_PUBLISHER = None
+
+def _resolve_formats(spec):
+    # {"default": [...], "<size>": [...]} -> {"<size>": [...], "default": [...]} with unsupported formats dropped
+    out = {}
+    for name, fmts in (spec or {}).items():
+        usable, skipped = normalize_formats(fmts)
+        if skipped:
+            log.warning("Variant formats %s for '%s' are not supported by this Pillow build; skipped", skipped, name)
+        if usable:
+            out[name] = usable
+    out.setdefault("default", list(DEFAULT_FORMATS))
+    return out
+
+def _set_tunables(values):
+    # {GLOBAL_NAME: value} -> module globals / imaging settings
+    enc = {_IMAGING_TUNABLES[k]: v for k, v in values.items() if k in _IMAGING_TUNABLES}
+    if enc:
+        imaging.configure(**enc)
+    globals().update({k: v for k, v in values.items() if k not in _IMAGING_TUNABLES})
+
+# ENV/built-in values, restored when a tunable is removed from AppConfig
+_TUNABLE_DEFAULTS = {name: getattr(imaging, name) if name in _IMAGING_TUNABLES else globals()[name]
+                     for name, _, _, _ in _TUNABLES.values()}
+
+def formats_for(size_name):
+    return VARIANT_FORMATS.get(size_name) or VARIANT_FORMATS["default"]
+
+def init(cfg=None, clients=None):
+    """Load config and create the AWS clients; main_loop() calls it unless it has run already.
+
+    `cfg` is a raw config dict used instead of the AppConfig document (ENV overrides still apply).
+    `clients` maps "sqs", "s3", "dynamodb", "kinesis" and "ecs" to objects used instead of boto3 clients,
+    e.g. the in-process stand-ins of loadtest/.
+    """
+    global _CFG, REGION, BUCKET, DDB_META, DDB_COUNTERS, INGEST_Q_URL, RESIZE_Q_URL, KINESIS_STREAM_NAME
+    global VIEWS_Q_URL, VIEWS_STREAM_NAME, PRIORITY_Q_URL, PRIORITY_SIZES
+    global DEFAULT_SIZES, SIZE_PROFILES, UPSCALE_POLICY, VARIANT_FORMATS, sqs, s3, ddb, kin, ecs, _PUBLISHER, _CONFIG_WATCHER
+    if cfg is None:
+        _CFG = load_config()
+    else:
+        _CFG = _effective_config(cfg)
+        log.info("Effective config (supplied): %s", _redacted(_CFG))
+    REGION = _CFG["REGION"]
+    BUCKET = _CFG["BUCKET_NAME"]
+    DDB_META = _CFG["DDB_TABLE_METADATA"]
+    DDB_COUNTERS = _CFG["DDB_TABLE_COUNTERS"]
+    INGEST_Q_URL = _CFG["INGEST_QUEUE_URL"]
+    RESIZE_Q_URL = _CFG["RESIZE_QUEUE_URL"]
+    PRIORITY_Q_URL = _CFG["PRIORITY_QUEUE_URL"]
+    KINESIS_STREAM_NAME = _CFG["KINESIS_STREAM_NAME"]
+    VIEWS_Q_URL = _CFG["VIEWS_QUEUE_URL"]
+    VIEWS_STREAM_NAME = _CFG["VIEWS_STREAM_NAME"]
+    DEFAULT_SIZES = _CFG["DEFAULT_SIZES"]
+    SIZE_PROFILES = _CFG["SIZE_PROFILES"]
+    UPSCALE_POLICY = _CFG["UPSCALE_POLICY"]
+    PRIORITY_SIZES = _CFG["PRIORITY_SIZES"]
+    VARIANT_FORMATS = _resolve_formats(_CFG["VARIANT_FORMATS"])
+    _set_tunables(_CFG["TUNABLES"])
+
+    clients = clients or {}
+    sqs = clients.get("sqs") or boto3.client("sqs", region_name=REGION)
+    s3  = clients.get("s3") or boto3.client("s3", region_name=REGION)
+    ddb = clients.get("dynamodb") or boto3.client("dynamodb", region_name=REGION)
+    kin = clients.get("kinesis") or boto3.client("kinesis", region_name=REGION)
+    ecs = clients.get("ecs") or (boto3.client("ecs", region_name=REGION) if ECS_SERVICE else None)
+
+    _PUBLISHER = EventPublisher(sqs=sqs, kinesis=kin, max_delay=PUBLISH_MAX_DELAY, max_attempts=PUBLISH_MAX_ATTEMPTS)
+    _CONFIG_WATCHER = ConfigWatcher()
+
+_METRICS = StageMetrics()
 
 # -------- Helpers --------
-def receive(queue_url):
+def receive(queue_url, max_messages=None):
     qname = queue_url.rsplit("/", 1)[-1]
-    log.debug("Polling SQS '%s' (wait=%ss, vis=%ss)", qname, POLL_WAIT_SECONDS, VISIBILITY_TIMEOUT)
+    log.debug("Polling SQS '%s' (max=%s, wait=%ss, vis=%ss)", qname, max_messages, POLL_WAIT_SECONDS, VISIBILITY_TIMEOUT)
     try:
-        resp = sqs.receive_message(
-            QueueUrl=queue_url,
-            MaxNumberOfMessages=5,
-            WaitTimeSeconds=POLL_WAIT_SECONDS,
-            VisibilityTimeout=VISIBILITY_TIMEOUT
-        )
+        with _METRICS.timer("sqs_receive", queue=qname):
+            resp = sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=max(1, min(10, RECEIVE_BATCH_SIZE if max_messages is None else max_messages)),
+                WaitTimeSeconds=POLL_WAIT_SECONDS,
+                VisibilityTimeout=VISIBILITY_TIMEOUT
+            )
         msgs = resp.get("Messages", [])
         if msgs:
             log.info("Received %d message(s) from '%s'", len(msgs), qname)
@@ -153,13 +455,185 @@ def delete(queue_url, receipt):
     except Exception as e:
         log.warning("Delete failed for '%s': %s", qname, e)
 
+# -------- SQS leases (visibility extension + batched deletes) --------
+class LeaseManager:
+    """Keeps received messages invisible while they are being worked on and batches their deletes.
+
+    A background thread extends visibility once less than LEASE_MARGIN_SECONDS is left. The
+    extension grows with the time the message has already run (at least VISIBILITY_TIMEOUT), so
+    slow originals are renewed less often. Finished receipts are grouped per queue into
+    delete_message_batch calls of up to 10, flushed when full or after DELETE_FLUSH_SECONDS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases = {}   # (queue_url, receipt) -> {"id", "received", "expires"}
+        self._done = {}     # queue_url -> [(receipt, finished_at)]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="leases", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=LEASE_TICK_SECONDS * 5)
+            self._thread = None
+        self._flush_deletes(force=True)
+
+    def track(self, queue_url, msg):
+        now = time.monotonic()
+        with self._lock:
+            self._leases[(queue_url, msg["ReceiptHandle"])] = {
+                "id": msg.get("MessageId", ""), "received": now, "expires": now + VISIBILITY_TIMEOUT,
+            }
+
+    def untrack(self, queue_url, receipt):
+        # stop extending without deleting (the message is handed back to the queue)
+        with self._lock:
+            self._leases.pop((queue_url, receipt), None)
+
+    def release(self, queue_url, receipt):
+        with self._lock:
+            self._leases.pop((queue_url, receipt), None)
+            pending = self._done.setdefault(queue_url, [])
+            pending.append((receipt, time.monotonic()))
+            full = len(pending) >= 10
+        if full or self._thread is None:
+            self._flush_deletes(force=self._thread is None)
+
+    def _run(self):
+        while not self._stop.wait(LEASE_TICK_SECONDS):
+            try:
+                self._extend_due()
+                self._flush_deletes()
+            except Exception as e:
+                log.warning("Lease manager tick failed: %s", e)
+
+    def _extend_due(self):
+        now = time.monotonic()
+        due = {}
+        with self._lock:
+            for (qurl, receipt), lease in list(self._leases.items()):
+                if lease["expires"] - now > LEASE_MARGIN_SECONDS:
+                    continue
+                elapsed = now - lease["received"]
+                if elapsed >= LEASE_MAX_SECONDS:
+                    log.warning("Message %s held for %.0fs; no longer extending visibility", lease["id"], elapsed)
+                    del self._leases[(qurl, receipt)]
+                    continue
+                timeout = int(min(max(VISIBILITY_TIMEOUT, elapsed), LEASE_MAX_SECONDS, 43200))
+                due.setdefault(qurl, []).append((receipt, lease, timeout))
+
+        for qurl, items in due.items():
+            for i in range(0, len(items), 10):
+                chunk = items[i:i + 10]
+                entries = [{"Id": str(n), "ReceiptHandle": r, "VisibilityTimeout": t} for n, (r, _, t) in enumerate(chunk)]
+                try:
+                    resp = sqs.change_message_visibility_batch(QueueUrl=qurl, Entries=entries)
+                except Exception as e:
+                    log.warning("Visibility extension failed for '%s': %s", qurl.rsplit("/", 1)[-1], e)
+                    continue
+                failed = {f["Id"] for f in resp.get("Failed", [])}
+                with self._lock:
+                    for n, (receipt, lease, timeout) in enumerate(chunk):
+                        if str(n) in failed:
+                            log.warning("Visibility extension rejected for message %s", lease["id"])
+                        elif (qurl, receipt) in self._leases:
+                            lease["expires"] = now + timeout
+                            log.debug("Extended message %s by %ss", lease["id"], timeout)
+
+    def _flush_deletes(self, force=False):
+        now = time.monotonic()
+        batches = []
+        with self._lock:
+            for qurl, pending in self._done.items():
+                while pending and (force or len(pending) >= 10 or now - pending[0][1] >= DELETE_FLUSH_SECONDS):
+                    batches.append((qurl, [r for r, _ in pending[:10]]))
+                    del pending[:10]
+
+        for qurl, receipts in batches:
+            qname = qurl.rsplit("/", 1)[-1]
+            entries = [{"Id": str(n), "ReceiptHandle": r} for n, r in enumerate(receipts)]
+            try:
+                resp = sqs.delete_message_batch(QueueUrl=qurl, Entries=entries)
+            except Exception as e:
+                log.warning("Batch delete failed for '%s': %s; deleting one by one", qname, e)
+                for r in receipts:
+                    delete(qurl, r)
+                continue
+            for f in resp.get("Failed", []):
+                log.warning("Delete failed for '%s': %s", qname, f.get("Message") or f.get("Code"))
+            log.debug("Deleted %d message(s) from '%s'", len(receipts) - len(resp.get("Failed", [])), qname)
+
+_LEASES = LeaseManager()
+
+def _content_length(resp):
+    # "bytes 0-65535/26214400" -> 26214400; a plain 200 (no Content-Range) carries the whole object
+    rng = resp.get("ContentRange") or ""
+    total = rng.rsplit("/", 1)[-1] if "/" in rng else ""
+    return int(total) if total.isdigit() else int(resp["ContentLength"])
+
+def probe_original(bucket, key):
+    """Return ((width, height), total_bytes, etag) reading only the image header via ranged GETs.
+
+    Starts with PROBE_BYTES and doubles the range (up to PROBE_MAX_BYTES) only when the header
+    is not complete yet, e.g. a JPEG with a large EXIF/ICC block before its SOF marker.
+    """
+    data = b""
+    want = PROBE_BYTES
+    total = None
+    while True:
+        resp = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={len(data)}-{want - 1}")
+        data += resp["Body"].read()
+        total = _content_length(resp)
+        dims = header_size(data)
+        if dims:
+            log.debug("Probed %s with %d of %d bytes", key, len(data), total)
+            return dims, total, resp.get("ETag")
+        if len(data) >= total:
+            raise ValueError(f"Could not read image header of {key}")
+        if want >= PROBE_MAX_BYTES:
+            break
+        want = min(want * 2, PROBE_MAX_BYTES)
+
+    log.info("Header of %s not within %d bytes; reading whole object", key, len(data))
+    resp = s3.get_object(Bucket=bucket, Key=key)
+    data = resp["Body"].read()
+    dims = header_size(data)
+    if not dims:
+        raise ValueError(f"Could not read image header of {key}")
+    return dims, len(data), resp.get("ETag")
+
 def _is_original_key(key: str) -> bool:
     last = key.rsplit('/', 1)[-1]
     return last.startswith("original")
 
+def _event_time(rec):
+    # S3 eventTime ("2026-01-01T12:00:00.123Z") as epoch seconds; now if it is missing or unparsable
+    try:
+        return datetime.fromisoformat(rec["eventTime"].replace("Z", "+00:00")).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+def _lanes(sizes):
+    """[(queue_url, sizes)]: PRIORITY_SIZES go to the priority lane (when one is configured), first."""
+    if not PRIORITY_Q_URL:
+        return [(RESIZE_Q_URL, list(sizes))]
+    first = [sz for sz in sizes if sz in PRIORITY_SIZES]
+    rest = [sz for sz in sizes if sz not in PRIORITY_SIZES]
+    return [(q, group) for q, group in ((PRIORITY_Q_URL, first), (RESIZE_Q_URL, rest)) if group]
+
 # -------- Handlers --------
+class Redeliver(Exception):
+    """Raised by a handler when its message must not be deleted, so SQS delivers it again."""
+
 def handle_s3_ingest(evt):
     log.info("Handling S3 ingest event with %d record(s)", len(evt.get("Records", [])))
+    unsent = []
     for rec in evt["Records"]:
         try:
             b = rec["s3"]["bucket"]["name"]
@@ -177,134 +651,1503 @@ def handle_s3_ingest(evt):
                 log.warning("Could not parse imageId from key %s", key)
                 continue
 
-            head = s3.head_object(Bucket=b, Key=key)
-            size_bytes = head["ContentLength"]
-            obj = s3.get_object(Bucket=b, Key=key)
-            data = obj["Body"].read()
-            im = Image.open(io.BytesIO(data))
-            width, height = im.size
+            (width, height), size_bytes, etag = probe_original(b, key)
             log.info("Original stats id=%s bytes=%s WxH=%sx%s", image_id, size_bytes, width, height)
+            try:
+                check_pixels(width, height)
+            except ImageTooLarge as e:
+                # refused from the header alone: no resize task, nothing decoded
+                _reject(image_id, b, key, "too_many_pixels", e, width=width, height=height, bytes=size_bytes)
+                continue
 
-            ddb.update_item(
+            # requested_sizes comes from the uploader; items created before it stored them get DEFAULT_SIZES
+            attrs = ddb.update_item(
                 TableName=DDB_META,
                 Key={"id": {"S": image_id}},
-                UpdateExpression="SET #st = :u, s3_key = :k, #w = :w, #h = :h, bytes = :b",
-                ExpressionAttributeNames={"#st":"status","#w":"width","#h":"height"},
+                UpdateExpression="SET #st = :u, s3_key = :k, #w = :w, #h = :h, bytes = :b, #rs = if_not_exists(#rs, :rs)",
+                ExpressionAttributeNames={"#st":"status","#w":"width","#h":"height","#rs":"requested_sizes"},
                 ExpressionAttributeValues={
                     ":u":{"S":"UPLOADED"},
                     ":k":{"S": key},
                     ":w":{"N": str(width)},
                     ":h":{"N": str(height)},
-                    ":b":{"N": str(size_bytes)}
-                }
-            )
-            log.info("DDB updated for %s -> status=UPLOADED", image_id)
+                    ":b":{"N": str(size_bytes)},
+                    ":rs":{"L": [{"S": sz} for sz in DEFAULT_SIZES]}
+                },
+                ReturnValues="UPDATED_NEW"
+            ).get("Attributes", {})
+            requested = _requested_sizes(attrs)
+            unknown = [v["S"] for v in attrs.get("requested_sizes", {}).get("L", []) if v["S"] not in SIZE_PROFILES]
+            if unknown:
+                log.warning("Requested sizes %s for %s are not in size_profiles; skipped", unknown, image_id)
+            log.info("DDB updated for %s -> status=UPLOADED sizes=%s", image_id, requested)
 
-            for sz in DEFAULT_SIZES:
-                body = json.dumps({"type":"resize","bucket": b,"key": key,"imageId": image_id,"size": sz})
-                resp = sqs.send_message(QueueUrl=RESIZE_Q_URL, MessageBody=body)
-                log.info("Enqueued resize task %s for %s (MessageId=%s)", sz, image_id, resp.get("MessageId"))
+            # small sizes go to the priority lane; in batched mode each lane gets one resize_all task of its sizes
+            uploaded_at = _event_time(rec)
+            if RESIZE_FANOUT == "per_size":
+                tasks = [(sz, q, {"type":"resize","bucket": b,"key": key,"etag": etag,"imageId": image_id,"size": sz,
+                                  "requested": requested, "uploadedAt": uploaded_at})
+                         for q, group in _lanes(requested) for sz in group]
+            else:
+                tasks = [(group, q, {"type":"resize_all","bucket": b,"key": key,"etag": etag,"imageId": image_id,
+                                     "sizes": group, "requested": requested, "uploadedAt": uploaded_at})
+                         for q, group in _lanes(requested)]
+            pending = [(label, _PUBLISHER.send_message(q, body)) for label, q, body in tasks]
 
             if KINESIS_STREAM_NAME:
+                # fire and forget; failures are retried and logged by the publisher
+                _PUBLISHER.put_record(KINESIS_STREAM_NAME, image_id, {"imageId": image_id, "action":"uploaded"})
+
+            # Resize tasks must be accepted by SQS before the ingest message is deleted.
+            for label, fut in pending:
                 try:
-                    kin.put_record(StreamName=KINESIS_STREAM_NAME, PartitionKey=image_id,
-                                   Data=json.dumps({"imageId": image_id, "action":"uploaded"}))
-                    log.info("Kinesis signaled 'uploaded' for %s", image_id)
-                except Exception as e:
-                    log.warning("Kinesis put failed for %s: %s", image_id, e)
+                    log.info("Enqueued resize task %s for %s (MessageId=%s)", label, image_id,
+                             fut.result(timeout=PUBLISH_TIMEOUT))
+                except (PublishError, FutureTimeout) as e:
+                    log.error("Resize task %s for %s was not enqueued: %s", label, image_id, e or "timed out")
+                    unsent.append(image_id)
         except Exception as e:
             log.exception("Error handling S3 record: %s", e)
+    if unsent:
+        raise Redeliver(f"resize tasks not enqueued for {sorted(set(unsent))}")
 
-def target_dims(size_name, src_w, src_h):
-    targets = {"thumb": 150, "medium": 800, "large": 1600}
-    tw = targets.get(size_name, 800)
-    scale = max(1e-9, tw / float(src_w))
-    return int(tw), int(round(src_h * scale))
+# -------- CPU stage (runs in the process pool when WORKER_MODE=concurrent) --------
+_CPU_POOL = None
 
-def handle_resize_task(task):
-    image_id = task["imageId"]; src_key = task["key"]; size_name = task["size"]
-    log.info("Resizing %s -> %s", image_id, size_name)
-    obj = s3.get_object(Bucket=BUCKET, Key=src_key)
-    data = obj["Body"].read()
-    im = Image.open(io.BytesIO(data)).convert("RGB")
-    w, h = im.size
-    tw, th = target_dims(size_name, w, h)
-    im_resized = im.resize((tw, th), Image.LANCZOS)
-    out = io.BytesIO()
-    im_resized.save(out, format="JPEG", quality=90)
-    out.seek(0)
-    dest_key = f"images/{image_id}/{size_name}.jpg"
-    s3.put_object(Bucket=BUCKET, Key=dest_key, Body=out.getvalue(), ContentType="image/jpeg")
+def _cpu(fn, *args):
+    if _CPU_POOL is None:
+        return fn(*args)
+    # pool processes were forked at startup; carry the current encoder settings with every task
+    return _CPU_POOL.submit(with_settings, imaging.settings(), fn, *args).result()
+
+def _observe_cpu(prof):
+    """Record decode/resize/encode timings from imaging.profiled(); later stages of this message get its megapixels."""
+    _METRICS.label(mp=mp_bucket(prof["pixels"]))
+    for stage, size_name, seconds in prof["stages"]:
+        _METRICS.observe(stage, seconds, size=size_name)
+        _SERVICE_TIMES.add_cpu(seconds)
+
+# -------- Streaming I/O --------
+class _MemoryGauge:
+    """Bytes of originals/variants currently held in worker memory across in-flight messages."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def add(self, n):
+        with self._lock:
+            self.current += n
+            self.peak = max(self.peak, self.current)
+
+    def sub(self, n):
+        with self._lock:
+            self.current -= n
+
+_MEM = _MemoryGauge()
+
+class DecodeBudget:
+    """Admission control for decodes: an image waits until its estimated decode memory fits in the budget.
+
+    The budget (DECODE_MEMORY_MB, or DECODE_MEMORY_FRACTION of the task memory) is shared by every message
+    in flight, so CPU_PROCS and MAX_INFLIGHT can be raised without large originals decoding at the same
+    time and getting the task OOM-killed. An estimate above the whole budget is admitted alone, once
+    nothing else is decoding.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.used = 0
+        self.peak = 0
+        self.waiting = 0
+
+    def limit(self):
+        return DECODE_MEMORY_MB * 1024 * 1024 if DECODE_MEMORY_MB else int(_TASK_MEMORY * DECODE_MEMORY_FRACTION)
+
+    @contextmanager
+    def reserve(self, nbytes):
+        t0 = time.perf_counter()
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.used and self.used + nbytes > self.limit():
+                    self._cond.wait(1.0)   # also picks up a changed decode_memory_mb
+            finally:
+                self.waiting -= 1
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+        _METRICS.observe("decode_wait", time.perf_counter() - t0)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.used -= nbytes
+                self._cond.notify_all()
+
+    def summary(self):
+        return f"{self.used >> 20}/{self.limit() >> 20}MB peak={self.peak >> 20}MB waiting={self.waiting}"
+
+_TASK_MEMORY = _container_memory()
+_DECODE = DecodeBudget()
+_TRANSFER = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNK_BYTES)
+
+def _rss_peak_kib():
+    # ru_maxrss is KiB on Linux; children = the resize process pool
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+# -------- Local cache of originals --------
+class OriginalCache:
+    """On-disk LRU cache of originals keyed by (bucket, key, ETag), bounded by `max_bytes`.
+
+    Entries are written to a temp file in the cache dir and renamed into place, so a reader
+    never sees a partial file. Concurrent misses for the same entry share one download, and
+    entries handed out by get() are pinned until released so eviction cannot unlink them
+    while the process pool is reading.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # name -> bytes, least recently used first
+        self._pins = {}                 # name -> readers
+        self._loading = {}              # name -> Event set when the download finishes
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith("tmp-"):
+                os.unlink(path)   # leftover from a crash mid-download
+                continue
+            st = os.stat(path)
+            found.append((st.st_mtime, name, st.st_size))   # mtime is refreshed on every hit
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.bytes += size
+        self._evict()
+        log.info("Original cache at %s: %d entries, %d bytes (max %d)", self.root, len(self._entries), self.bytes, self.max_bytes)
+
+    @staticmethod
+    def _name(bucket, key, etag):
+        return hashlib.sha256(f"{bucket}\0{key}\0{etag}".encode("utf-8")).hexdigest()
+
+    def _evict(self):
+        # caller holds the lock (or is the constructor)
+        for name in list(self._entries):
+            if self.bytes <= self.max_bytes:
+                break
+            if self._pins.get(name):
+                continue
+            size = self._entries.pop(name)
+            self.bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                os.unlink(os.path.join(self.root, name))
+            except OSError:
+                pass
+
+    @contextmanager
+    def get(self, bucket, key, etag, fetch):
+        """Yield a local path for the original; on a miss `fetch(fileobj)` writes it and returns its size."""
+        name = self._name(bucket, key, etag)
+        path = os.path.join(self.root, name)
+        while True:
+            with self._lock:
+                if name in self._entries:
+                    self._entries.move_to_end(name)
+                    self._pins[name] = self._pins.get(name, 0) + 1
+                    self.stats["hits"] += 1
+                    hit = True
+                    break
+                waiter = self._loading.get(name)
+                if waiter is None:
+                    self._loading[name] = threading.Event()
+                    self.stats["misses"] += 1
+                    hit = False
+                    break
+            waiter.wait()   # another task is downloading this entry; re-check once it is done
+
+        if hit:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        else:
+            self._fill(name, path, fetch)   # pins the new entry
+        try:
+            yield path
+        finally:
+            with self._lock:
+                self._pins[name] -= 1
+                if not self._pins[name]:
+                    del self._pins[name]
+                self._evict()
+
+    def _fill(self, name, path, fetch):
+        fd, tmp = tempfile.mkstemp(prefix="tmp-", dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                size = fetch(f)
+            os.replace(tmp, path)
+            with self._lock:
+                self._entries[name] = size
+                self.bytes += size
+                self._pins[name] = self._pins.get(name, 0) + 1
+                self._evict()
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(name).set()
+
+_CACHE = OriginalCache(ORIGINAL_CACHE_DIR, ORIGINAL_CACHE_MAX_BYTES) if ORIGINAL_CACHE_DIR else None
+
+def _cache_summary():
+    if _CACHE is None:
+        return ""
+    st = _CACHE.stats
+    return f" cache: hits={st['hits']} misses={st['misses']} evictions={st['evictions']} bytes={_CACHE.bytes}"
+
+def _stream_to(fileobj, body):
+    n = 0
+    for chunk in body.iter_chunks(DOWNLOAD_CHUNK_BYTES):
+        fileobj.write(chunk)
+        n += len(chunk)
+    return n
+
+@contextmanager
+def _fetch_cached(bucket, key, etag, usage):
+    def fetch(f):
+        obj = s3.get_object(Bucket=bucket, Key=key, IfMatch=etag)
+        try:
+            return _stream_to(f, obj["Body"])
+        finally:
+            obj["Body"].close()
+
+    with _CACHE.get(bucket, key, etag, fetch) as path:
+        usage["disk"] += os.path.getsize(path)
+        yield path
+
+@contextmanager
+def _fetch_original(bucket, key, usage, etag=None):
+    """Stream an original from S3; yields bytes (<= SPOOL_MAX_BYTES) or the path of a spilled temp file.
+
+    Either form can be handed to the imaging functions / process pool; a path costs no
+    pickling copy. `usage` is updated with the bytes held in memory and on disk.
+    With the local cache enabled and a known ETag, the original is served from / added to the cache.
+    """
+    t0 = time.perf_counter()
+    if _CACHE is not None and etag:
+        with _fetch_cached(bucket, key, etag, usage) as path:
+            _METRICS.observe("s3_get", time.perf_counter() - t0)
+            yield path
+        return
+
+    obj = s3.get_object(Bucket=bucket, Key=key)
+    body = obj["Body"]
+    size = int(obj.get("ContentLength") or 0)
+    path = None
+    try:
+        if size <= SPOOL_MAX_BYTES:
+            src = body.read()
+            usage["memory"] += len(src)
+            _MEM.add(len(src))
+        else:
+            fd, path = tempfile.mkstemp(prefix="original-", dir=SPOOL_DIR)
+            with os.fdopen(fd, "wb") as f:
+                _stream_to(f, body)
+            usage["disk"] += os.path.getsize(path)
+            src = path
+        _METRICS.observe("s3_get", time.perf_counter() - t0)
+        yield src
+    finally:
+        body.close()
+        if path:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        else:
+            _MEM.sub(usage["memory"])
+
+def _log_usage(image_id, usage):
+    rss, rss_children = _rss_peak_kib()
+    log.info("Memory %s: original_mem=%d original_disk=%d outputs=%d | held_now=%d held_peak=%d rss_peak=%dKiB pool_rss_peak=%dKiB",
+             image_id, usage["memory"], usage["disk"], usage["outputs"], _MEM.current, _MEM.peak, rss, rss_children)
+
+def _upload(key, body, content_type):
+    if len(body) > MULTIPART_THRESHOLD:
+        # BytesIO over an immutable bytes object shares its buffer; parts are read chunk by chunk
+        s3.upload_fileobj(io.BytesIO(body), BUCKET, key, ExtraArgs={"ContentType": content_type}, Config=_TRANSFER)
+    else:
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body, ContentType=content_type)
+
+# -------- Idempotency --------
+# Each variant records the source ETag and a version of the size's profile; a redelivered task whose
+# variants already match both is acknowledged after one read, without downloading anything.
+def _profile_version(size_name):
+    blob = json.dumps([SIZE_PROFILES.get(size_name), formats_for(size_name), UPSCALE_POLICY], sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:12]
+
+def _is_current(variant, size_name, src_etag):
+    """variant: the variants.<size> map of an item; rendered from this source ETag (if known) with today's profile."""
+    return ((not src_etag or variant.get("srcEtag", {}).get("S") == src_etag)
+            and variant.get("profileVersion", {}).get("S") == _profile_version(size_name))
+
+def _pending_sizes(image_id, sizes, src_etag):
+    """Sizes not yet recorded for this source ETag and profile version (all of them if the ETag is unknown)."""
+    sizes = list(dict.fromkeys(sizes))
+    if not src_etag:
+        return sizes
+    item = ddb.get_item(
+        TableName=DDB_META, Key={"id": {"S": image_id}}, ConsistentRead=True,
+        ProjectionExpression="#v", ExpressionAttributeNames={"#v": "variants"},
+    ).get("Item") or {}
+    done = item.get("variants", {}).get("M", {})
+    return [sz for sz in sizes if not _is_current(done.get(sz, {}).get("M", {}), sz, src_etag)]
+
+def _requested_sizes(item, fallback=None):
+    # requested_sizes is written by the uploader at init (and by ingest for items created before it was);
+    # sizes no longer in size_profiles cannot be rendered, so they do not hold back completion
+    stored = [v["S"] for v in item.get("requested_sizes", {}).get("L", []) if v["S"] in SIZE_PROFILES]
+    return stored or list(fallback or DEFAULT_SIZES)
+
+def _record_variants(image_id, infos, src_etag=None, requested=None, complete=False, uploaded_at=None):
+    """Write variants.<size> for every {size: info} in one update; returns the sizes written.
+
+    status becomes PROCESSED only once every requested size is current: in the same update when the caller
+    knows this batch completes the image (`complete`), otherwise after checking the item the update returns.
+    An identical variant recorded concurrently by another delivery fails the condition; the batch is then
+    retried size by size (without `complete`) so the others are still written.
+
+    With `uploaded_at` (epoch seconds of the S3 upload) the write that stores an image's first variant observes
+    upload_to_first_variant, and the one that completes it upload_to_all_variants.
+    """
+    if not infos:
+        return []
+    names = {"#v": "variants", "#se": "srcEtag", "#pv": "profileVersion"}
+    values = {":se": {"S": src_etag or ""}}
+    sets, conds = [], []
+    for i, (size_name, info) in enumerate(infos.items()):
+        info = dict(info, profileVersion={"S": _profile_version(size_name)})
+        if src_etag:
+            info["srcEtag"] = {"S": src_etag}
+        names[f"#s{i}"] = size_name
+        values[f":i{i}"] = {"M": info}
+        values[f":pv{i}"] = info["profileVersion"]
+        sets.append(f"#v.#s{i} = :i{i}")
+        conds.append(f"(attribute_not_exists(#v.#s{i}) OR attribute_not_exists(#v.#s{i}.#se)"
+                     f" OR #v.#s{i}.#se <> :se OR #v.#s{i}.#pv <> :pv{i})")
+    if complete:
+        # DynamoDB rejects attribute names the expressions do not use, so #st is only added here
+        names["#st"] = "status"
+        sets.append("#st = :p, completed_at = :now")
+        values.update({":p": {"S": "PROCESSED"}, ":now": {"N": str(int(time.time()))}})
+    try:
+        with _METRICS.timer("ddb_update", size=next(iter(infos)) if len(infos) == 1 else "all"):
+            resp = ddb.update_item(
+                TableName=DDB_META,
+                Key={"id": {"S": image_id}},
+                UpdateExpression="SET " + ", ".join(sets),
+                ConditionExpression=" AND ".join(conds),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues="NONE" if complete else "ALL_NEW",
+            )
+    except ddb.exceptions.ConditionalCheckFailedException:
+        if len(infos) == 1:
+            log.info("Variant %s for %s already recorded by another delivery; skipping write", next(iter(infos)), image_id)
+            return []
+        # never complete=True here: the first size written would set PROCESSED before its siblings;
+        # each single write checks the returned item instead, and the one that finds all sizes current marks it
+        return [sz for sz, info in infos.items()
+                if _record_variants(image_id, {sz: info}, src_etag, requested, False, uploaded_at)]
+    wanted = _requested_sizes({}, requested)
+    if complete:
+        first, processed = len(infos) >= len(wanted), True
+    else:
+        item = resp.get("Attributes", {})
+        variants = item.get("variants", {}).get("M", {})
+        wanted = _requested_sizes(item, requested)
+        current = [sz for sz in wanted if _is_current(variants.get(sz, {}).get("M", {}), sz, src_etag)]
+        missing = [sz for sz in wanted if sz not in current]
+        first, processed = len(current) <= len(infos), False
+        if missing:
+            log.info("%s: %d variant(s) still pending: %s", image_id, len(missing), missing)
+        elif item.get("status", {}).get("S") != "PROCESSED":
+            processed = _mark_processed(image_id)
+    if uploaded_at:
+        age = max(0.0, time.time() - uploaded_at)
+        if first:
+            _METRICS.observe("upload_to_first_variant", age, size=next(iter(infos)) if len(infos) == 1 else "all")
+        if processed:
+            _METRICS.observe("upload_to_all_variants", age, size="all")
+    return list(infos)
+
+def _mark_processed(image_id):
+    """Set PROCESSED unless it already is; True if this call set it."""
+    try:
+        ddb.update_item(
+            TableName=DDB_META,
+            Key={"id": {"S": image_id}},
+            UpdateExpression="SET #st = :p, completed_at = :now",
+            ConditionExpression="#st <> :p",
+            ExpressionAttributeNames={"#st": "status"},
+            ExpressionAttributeValues={":p": {"S": "PROCESSED"}, ":now": {"N": str(int(time.time()))}},
+        )
+        return True
+    except ddb.exceptions.ConditionalCheckFailedException:
+        return False   # another delivery completed it first
+
+def _store_variant(image_id, size_name, tw, th, outputs):
+    # outputs: [(format, bytes)]; the first format is the primary one (top-level key/bytes). Recorded by the caller.
+    formats = {}
+    for fmt, body in outputs:
+        _, ext, content_type = FORMATS[fmt]
+        dest_key = f"images/{image_id}/{size_name}.{ext}"
+        with _METRICS.timer("s3_put", size=size_name):
+            _upload(dest_key, body, content_type)
+        formats[fmt] = {"M": {"key": {"S": dest_key}, "bytes": {"N": str(len(body))}, "contentType": {"S": content_type}}}
+    primary = formats[outputs[0][0]]["M"]
+    info = {"key": primary["key"], "width": {"N": str(tw)}, "height": {"N": str(th)}, "bytes": primary["bytes"],
+            "formats": {"M": formats}}
+    return info
+
+def _copy_variant(image_id, size_name, src_info):
+    """Server-side S3 copy of an existing variant (every format) to images/{image_id}/{size_name}.*; returns its info map."""
+    formats = {}
+    for fmt, f in src_info["formats"]["M"].items():
+        _, ext, content_type = FORMATS[fmt]
+        dest_key = f"images/{image_id}/{size_name}.{ext}"
+        s3.copy_object(Bucket=BUCKET, Key=dest_key, CopySource={"Bucket": BUCKET, "Key": f["M"]["key"]["S"]},
+                       ContentType=content_type, MetadataDirective="REPLACE")
+        formats[fmt] = {"M": dict(f["M"], key={"S": dest_key})}
+    primary = next(iter(formats.values()))["M"]
+    return dict(src_info, key=primary["key"], formats={"M": formats})
+
+def _store_alias(image_id, size_name, target_name, target_info):
+    """Never-upscale: reuse `target_name`'s output for `size_name` (S3 copy, or metadata only with policy "alias")."""
+    info = _copy_variant(image_id, size_name, target_info) if UPSCALE_POLICY == "copy" else dict(target_info)
+    info["aliasOf"] = {"S": target_name}
+    return info
+
+def _outputs_bytes(outputs):
+    return sum(len(body) for _, body in outputs or [])
+
+def _format_summary(outputs):
+    return " ".join(f"{fmt}={len(body)}B" for fmt, body in outputs)
+
+def _admit(src, sizes):
+    """Reserve decode memory for rendering `sizes` from `src` (bytes or spooled path); blocks while the budget is full.
+
+    Raises ImageTooLarge for a source over MAX_IMAGE_PIXELS, before any pixel data is decoded.
+    """
+    info = header_info(src)
+    if not info:
+        return _DECODE.reserve(0)   # unreadable header: the decode fails on its own
+    w, h, mode, fmt = info
+    check_pixels(w, h)
+    upscale = UPSCALE_POLICY == "allow"
+    targets = [target_dims(sz, w, h, SIZE_PROFILES, upscale) for sz in sizes if sz in SIZE_PROFILES]
+    target = max(targets, key=lambda d: d[0] * d[1], default=None)
+    return _DECODE.reserve(decode_memory(w, h, mode, fmt, target))
+
+def _reject(image_id, bucket, key, reason, detail, **numbers):
+    """Mark an image FAILED (status + failure.reason/detail) instead of rendering it; quarantines the original
+    when QUARANTINE_PREFIX is set. `numbers` are extra numeric attributes to store (e.g. width, height)."""
+    failure = {"reason": {"S": reason}, "detail": {"S": str(detail)}, "at": {"N": str(int(time.time()))}}
+    if QUARANTINE_PREFIX:
+        dest = QUARANTINE_PREFIX + key
+        try:
+            s3.copy_object(Bucket=bucket, Key=dest, CopySource={"Bucket": bucket, "Key": key})
+            s3.delete_object(Bucket=bucket, Key=key)
+            failure["quarantineKey"] = {"S": dest}
+        except Exception as e:
+            log.warning("Could not quarantine %s to %s: %s", key, dest, e)
+    names = {"#st": "status"}
+    values = {":f": {"S": "FAILED"}, ":fail": {"M": failure}}
+    sets = ["#st = :f", "failure = :fail"]
+    for i, (attr, n) in enumerate(numbers.items()):
+        names[f"#n{i}"] = attr
+        values[f":n{i}"] = {"N": str(n)}
+        sets.append(f"#n{i} = :n{i}")
     ddb.update_item(
         TableName=DDB_META,
         Key={"id": {"S": image_id}},
-        UpdateExpression="SET #v.#s = :info, #st = :p",
-        ExpressionAttributeNames={"#v":"variants","#s":size_name,"#st":"status"},
-        ExpressionAttributeValues={
-            ":info": {"M": {"key":{"S": dest_key},"width":{"N": str(tw)},"height":{"N": str(th)},"bytes":{"N": str(len(out.getvalue()))}}},
-            ":p": {"S": "PROCESSED"}
-        }
+        UpdateExpression="SET " + ", ".join(sets),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
     )
-    log.info("Generated %s for %s -> %s", size_name, image_id, dest_key)
+    if KINESIS_STREAM_NAME:
+        _PUBLISHER.put_record(KINESIS_STREAM_NAME, image_id, {"imageId": image_id, "action": "failed", "reason": reason})
+    log.warning("Rejected %s (%s): %s%s", image_id, reason, detail,
+                f"; original moved to {failure['quarantineKey']['S']}" if "quarantineKey" in failure else "")
+
+def handle_resize_task(task):
+    image_id = task["imageId"]; src_key = task["key"]; size_name = task["size"]
+    src_etag = task.get("etag")
+    if size_name not in SIZE_PROFILES:
+        log.error("Unknown size '%s' for %s; known sizes: %s", size_name, image_id, sorted(SIZE_PROFILES))
+        return
+    if not _pending_sizes(image_id, [size_name], src_etag):
+        log.info("Variant %s for %s already up to date (etag=%s); duplicate delivery skipped", size_name, image_id, src_etag)
+        return
+    log.info("Resizing %s -> %s", image_id, size_name)
+    usage = {"memory": 0, "disk": 0, "outputs": 0}
+    requested = task.get("requested") or [size_name]
+    complete = set(requested) <= {size_name}
+    hit = None
+    try:
+        with _fetch_original(BUCKET, src_key, usage, src_etag) as src:
+            # looked up under this size's own fingerprint, so hits come from earlier per-size renders
+            digest, fingerprint, hit = _dedup_check(image_id, src, [size_name])
+            if not hit:
+                with _admit(src, [size_name]):
+                    (tw, th, outputs), prof = _cpu(profiled, render_variant, src, size_name, None,
+                                                   formats_for(size_name), SIZE_PROFILES, UPSCALE_POLICY == "allow")
+    except ImageTooLarge as e:
+        _reject(image_id, BUCKET, src_key, "too_many_pixels", e)
+        return
+    if hit:
+        _apply_dedup(image_id, [size_name], hit, src_etag, requested, complete, task.get("uploadedAt"))
+        _log_usage(image_id, usage)
+        return
+    _observe_cpu(prof)
+    usage["outputs"] = _outputs_bytes(outputs)
+    _MEM.add(usage["outputs"])
+    try:
+        info = _store_variant(image_id, size_name, tw, th, outputs)
+    finally:
+        _MEM.sub(usage["outputs"])
+    _record_variants(image_id, {size_name: info}, src_etag, requested, complete=complete,
+                     uploaded_at=task.get("uploadedAt"))
+    if digest:
+        _dedup_register(digest, fingerprint, image_id, {size_name: info}, prof["cpu"])
+    log.info("Generated %s for %s -> %s (%s)", size_name, image_id, info["key"]["S"], _format_summary(outputs))
+    _log_usage(image_id, usage)
+
+def handle_resize_all_task(task):
+    """Build the task's variants from a single download/decode of the original.
+
+    Sizes are rendered largest first; each smaller variant is cut from the
+    previous result instead of the full-resolution source. With a priority lane the
+    image's sizes are split over two tasks; `requested` still lists all of them.
+    """
+    image_id = task["imageId"]; src_key = task["key"]
+    src_etag = task.get("etag")
+    uploaded_at = task.get("uploadedAt")
+    task_sizes = task.get("sizes") or DEFAULT_SIZES
+    requested = task.get("requested") or task_sizes
+    covers_all = set(requested) <= set(task_sizes)
+    sizes = _pending_sizes(image_id, task_sizes, src_etag)
+    if not sizes:
+        log.info("Variants %s for %s already up to date (etag=%s); duplicate delivery skipped",
+                 task_sizes, image_id, src_etag)
+        return
+    if len(sizes) < len(set(task_sizes)):
+        log.info("Variants %s for %s already up to date; rendering only %s",
+                 [sz for sz in task_sizes if sz not in sizes], image_id, sizes)
+    log.info("Resizing %s -> %s (single decode)", image_id, sizes)
+    usage = {"memory": 0, "disk": 0, "outputs": 0}
+    hit = None
+    try:
+        with _fetch_original(BUCKET, src_key, usage, src_etag) as src:
+            digest, fingerprint, hit = _dedup_check(image_id, src, sizes)
+            if not hit:
+                with _admit(src, sizes):
+                    results, prof = _cpu(profiled, render_variants, src, sizes, None,
+                                         {sz: formats_for(sz) for sz in sizes}, SIZE_PROFILES, UPSCALE_POLICY)
+    except ImageTooLarge as e:
+        _reject(image_id, BUCKET, src_key, "too_many_pixels", e)
+        return
+    if hit:
+        _apply_dedup(image_id, sizes, hit, src_etag, requested, covers_all, uploaded_at)
+        _log_usage(image_id, usage)
+        return
+    _observe_cpu(prof)
+    cpu_seconds = prof["cpu"]
+    usage["outputs"] = sum(_outputs_bytes(r["outputs"]) for r in results)
+    _MEM.add(usage["outputs"])
+
+    stored = {}
+    try:
+        for i, r in enumerate(results, 1):
+            size_name = r["size"]
+            if r["error"]:
+                log.error("Variant %s failed for %s (%d/%d): %s", size_name, image_id, i, len(results), r["error"])
+                continue
+            try:
+                if r["alias_of"]:
+                    if r["alias_of"] not in stored:
+                        raise RuntimeError(f"alias target '{r['alias_of']}' was not stored")
+                    stored[size_name] = _store_alias(image_id, size_name, r["alias_of"], stored[r["alias_of"]])
+                    log.info("Aliased %s -> %s for %s (no upscale; %s) -> %s (%d/%d)", size_name, r["alias_of"],
+                             image_id, UPSCALE_POLICY, stored[size_name]["key"]["S"], i, len(results))
+                    continue
+                stored[size_name] = _store_variant(image_id, size_name, r["width"], r["height"], r["outputs"])
+                log.info("Generated %s for %s -> %s (%d/%d; %s)", size_name, image_id, stored[size_name]["key"]["S"],
+                         i, len(results), _format_summary(r["outputs"]))
+            except Exception as e:
+                log.exception("Variant %s failed for %s (%d/%d): %s", size_name, image_id, i, len(results), e)
+    finally:
+        _MEM.sub(usage["outputs"])
+    # one metadata write per task; sizes of this task not in `sizes` were already current
+    rendered = all(sz in stored for sz in dict.fromkeys(sizes))
+    _record_variants(image_id, stored, src_etag, requested, covers_all and rendered, uploaded_at)
+    if digest and rendered:
+        _dedup_register(digest, fingerprint, image_id, stored, cpu_seconds)
+    _log_usage(image_id, usage)
+
+# -------- Content-hash dedup --------
+# Index items live in the metadata table under id "digest#<sha256>#<profile fingerprint>".
+_DEDUP_STATS = {"hits": 0, "misses": 0, "cpu_saved": 0.0}
+_DEDUP_LOCK = threading.Lock()   # the stats are updated from every IO thread
+
+def _sha256(src):
+    h = hashlib.sha256()
+    if isinstance(src, str):
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b""):
+                h.update(chunk)
+    else:
+        h.update(src)
+    return h.hexdigest()
+
+def _profile_fingerprint(sizes):
+    # Anything that changes the rendered bytes must change the fingerprint.
+    spec = {sz: [SIZE_PROFILES.get(sz), formats_for(sz)] for sz in dict.fromkeys(sizes)}
+    blob = json.dumps({"sizes": spec, "upscale": UPSCALE_POLICY}, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+def _dedup_lookup(digest, fingerprint):
+    item = ddb.get_item(TableName=DDB_META, Key={"id": {"S": f"digest#{digest}#{fingerprint}"}}).get("Item")
+    if not item:
+        with _DEDUP_LOCK:
+            _DEDUP_STATS["misses"] += 1
+    return item
+
+def _dedup_check(image_id, src, sizes):
+    """(digest, fingerprint, index item or None) for an original about to render `sizes`; all None with DEDUP_MODE=off."""
+    if DEDUP_MODE == "off":
+        return None, None, None
+    digest, fingerprint = _sha256(src), _profile_fingerprint(sizes)
+    hit = _dedup_lookup(digest, fingerprint)
+    if hit and hit["imageId"]["S"] == image_id:
+        hit = None   # redelivery of the image that created the index entry
+    return digest, fingerprint, hit
+
+def _apply_dedup(image_id, sizes, hit, src_etag=None, requested=None, complete=True, uploaded_at=None):
+    src_id = hit["imageId"]["S"]
+    variants = hit["variants"]["M"]
+    infos = {}
+    for size_name in dict.fromkeys(sizes):
+        src_info = variants[size_name]["M"]
+        info = _copy_variant(image_id, size_name, src_info) if DEDUP_MODE == "copy" else dict(src_info)
+        info["dedupOf"] = {"S": src_id}
+        for k in ("srcEtag", "profileVersion"):
+            info.pop(k, None)
+        infos[size_name] = info
+    _record_variants(image_id, infos, src_etag, requested, complete, uploaded_at)
+    saved = float(hit.get("cpuSeconds", {}).get("N", 0))
+    with _DEDUP_LOCK:
+        _DEDUP_STATS["hits"] += 1
+        _DEDUP_STATS["cpu_saved"] += saved
+    log.info("Dedup hit %s -> %s (%s): %d variant(s) reused, ~%.2f CPU s saved%s",
+             image_id, src_id, DEDUP_MODE, len(infos), saved, _dedup_summary())
+
+def _dedup_register(digest, fingerprint, image_id, stored, cpu_seconds):
+    try:
+        ddb.put_item(
+            TableName=DDB_META,
+            Item={
+                "id": {"S": f"digest#{digest}#{fingerprint}"},
+                "imageId": {"S": image_id},
+                "variants": {"M": {sz: {"M": info} for sz, info in stored.items()}},
+                "cpuSeconds": {"N": f"{cpu_seconds:.3f}"},
+                "created_at": {"N": str(int(time.time()))},
+            },
+            ConditionExpression="attribute_not_exists(id)",   # first image with this content wins
+        )
+    except ddb.exceptions.ConditionalCheckFailedException:
+        pass
+    except Exception as e:
+        log.warning("Dedup index write failed for %s: %s", image_id, e)
+
+def _dedup_summary():
+    if DEDUP_MODE == "off":
+        return ""
+    with _DEDUP_LOCK:
+        st = dict(_DEDUP_STATS)
+    total = st["hits"] + st["misses"]
+    rate = (100.0 * st["hits"] / total) if total else 0.0
+    return f" dedup: hits={st['hits']} misses={st['misses']} hit_rate={rate:.1f}% cpu_saved={st['cpu_saved']:.1f}s"
+
+# -------- Live config --------
+class ConfigWatcher:
+    """Re-reads the AppConfig document every CONFIG_POLL_SECONDS and applies what changed without a restart.
+
+    Applied live: the _TUNABLES (polling, leases, concurrency, batch sizes, encoder settings) and the
+    size registry (default_sizes, size_profiles, variant_formats, upscale_policy, priority_sizes). A document that fails
+    validation is rejected as a whole and the running values are kept; so is an unreachable agent.
+    Queue URLs, tables, bucket and region only change on restart.
+    """
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+        self._current = _CFG
+        self._version = _APPCONFIG_VERSION
+
+    def start(self):
+        if CONFIG_POLL_SECONDS > 0 and _appconfig_url() and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="config", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(CONFIG_POLL_SECONDS):
+            try:
+                self.poll()
+            except Exception as e:
+                log.warning("Config poll failed: %s", e)
+
+    def poll(self):
+        raw = _load_appconfig_extension(retries=1, quiet=True)
+        if not raw:
+            return False   # agent unreachable: keep running with what we have
+        try:
+            new = _effective_config(raw)
+        except RuntimeError as e:
+            log.error("Config version %s rejected, keeping version %s: %s", _APPCONFIG_VERSION, self._version, e)
+            return False
+        changes = self.apply(new)
+        if changes:
+            log.info("Config version %s applied (was %s): %s", _APPCONFIG_VERSION, self._version, "; ".join(changes))
+        self._version = _APPCONFIG_VERSION
+        return bool(changes)
+
+    def apply(self, new):
+        global DEFAULT_SIZES, SIZE_PROFILES, UPSCALE_POLICY, VARIANT_FORMATS, PRIORITY_SIZES
+        old, changes = self._current, []
+
+        for k in _RESTART_ONLY:
+            if new[k] != old[k]:
+                log.warning("Config %s changed to %r; takes effect on restart", k, _redacted(new)[k])
+                new[k] = old[k]
+
+        wanted = dict(_TUNABLE_DEFAULTS, **new["TUNABLES"])
+        current = {name: getattr(imaging, name) if name in _IMAGING_TUNABLES else globals()[name] for name in wanted}
+        updates = {k: v for k, v in wanted.items() if current[k] != v}
+        if updates:
+            _set_tunables(updates)
+            changes += [f"{k} {current[k]} -> {v}" for k, v in updates.items()]
+            if "PUBLISH_MAX_DELAY" in updates:
+                _PUBLISHER.max_delay = PUBLISH_MAX_DELAY
+            if _COUNTERS is not None:
+                _COUNTERS.max_delay, _COUNTERS.max_keys = COUNTER_FLUSH_SECONDS, COUNTER_FLUSH_KEYS
+
+        # the size registry is swapped as a whole; handlers read these globals once per step
+        if new["SIZE_PROFILES"] != old["SIZE_PROFILES"]:
+            SIZE_PROFILES = new["SIZE_PROFILES"]
+            changes.append(f"size_profiles -> {sorted(SIZE_PROFILES)}")
+        if new["DEFAULT_SIZES"] != old["DEFAULT_SIZES"]:
+            DEFAULT_SIZES = new["DEFAULT_SIZES"]
+            changes.append(f"default_sizes -> {DEFAULT_SIZES}")
+        if new["UPSCALE_POLICY"] != old["UPSCALE_POLICY"]:
+            UPSCALE_POLICY = new["UPSCALE_POLICY"]
+            changes.append(f"upscale_policy -> {UPSCALE_POLICY}")
+        if new["VARIANT_FORMATS"] != old["VARIANT_FORMATS"]:
+            VARIANT_FORMATS = _resolve_formats(new["VARIANT_FORMATS"])
+            changes.append("variant_formats updated")
+        if new["PRIORITY_SIZES"] != old["PRIORITY_SIZES"]:
+            PRIORITY_SIZES = new["PRIORITY_SIZES"]
+            changes.append(f"priority_sizes -> {PRIORITY_SIZES}")
+
+        self._current = new
+        return changes
+
+_CONFIG_WATCHER = None
+
+# -------- Queue poller --------
+class QueuePoller:
+    """Long-polls the resize and ingest queues (and the priority lane) at the same time and hands their messages
+    out by weight.
+
+    Each queue has its own receiver thread. Received messages are leased right away and wait in a per-queue
+    buffer until get() hands them out. The window from capacity() (buffered + in flight) is split between the
+    queues by PRIORITY_WEIGHT / RESIZE_WEIGHT / INGEST_WEIGHT. A queue may borrow another's share only while that
+    queue is idle, so a busy queue can never take every slot away from the others. get() picks with smooth weighted
+    round-robin. A message that has been buffered longer than STARVATION_SECONDS goes first, but only once its queue
+    has been passed over STARVATION_SKIPS times in a row: under a backlog every buffer is old, and an age rule alone
+    would turn the weights into plain FIFO.
+    """
+
+    def __init__(self, queues, capacity):
+        self._queues = queues        # {queue_url: weight getter}
+        self._capacity = capacity
+        self._cond = threading.Condition()
+        self._buffers = {q: [] for q in queues}     # queue_url -> [(msg, received_at)]
+        self._outstanding = {q: 0 for q in queues}  # buffered + being processed (+ receive in progress)
+        self._idle = {q: False for q in queues}     # last receive came back empty
+        self._credit = {q: 0 for q in queues}
+        self._skips = {q: 0 for q in queues}        # picks in a row that went elsewhere while this queue had messages
+        self._threads = []
+        self._stop = False
+
+    def start(self):
+        for q in self._queues:
+            t = threading.Thread(target=self._run, args=(q,), name=f"poll-{q.rsplit('/', 1)[-1]}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        """Stop receiving and hand buffered (never started) messages back to their queues."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=POLL_WAIT_SECONDS + 5)
+        with self._cond:
+            leftover = {q: [m for m, _ in buf] for q, buf in self._buffers.items() if buf}
+            for buf in self._buffers.values():
+                buf.clear()
+        for qurl, msgs in leftover.items():
+            for m in msgs:
+                _LEASES.untrack(qurl, m["ReceiptHandle"])
+            for i in range(0, len(msgs), 10):
+                entries = [{"Id": str(n), "ReceiptHandle": m["ReceiptHandle"], "VisibilityTimeout": 0}
+                           for n, m in enumerate(msgs[i:i + 10])]
+                try:
+                    sqs.change_message_visibility_batch(QueueUrl=qurl, Entries=entries)
+                except Exception as e:
+                    log.warning("Could not return %d message(s) to '%s': %s", len(entries), qurl.rsplit("/", 1)[-1], e)
+            log.info("Returned %d unstarted message(s) to '%s'", len(msgs), qurl.rsplit("/", 1)[-1])
+
+    def done(self, queue_url):
+        with self._cond:
+            self._outstanding[queue_url] -= 1
+            self._cond.notify_all()
+
+    def get(self, timeout=1.0):
+        """Next (queue_url, message) to process, or None after `timeout` seconds without one."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                picked = self._pick()
+                if picked:
+                    return picked
+                left = deadline - time.monotonic()
+                if left <= 0 or self._stop:
+                    return None
+                self._cond.wait(left)
+
+    def stats(self):
+        with self._cond:
+            return {q.rsplit("/", 1)[-1]: (len(self._buffers[q]), self._outstanding[q]) for q in self._queues}
+
+    def _pick(self):
+        ready = [q for q, buf in self._buffers.items() if buf]
+        if not ready:
+            return None
+        now = time.monotonic()
+        starving = [r for r in ready
+                    if self._skips[r] >= STARVATION_SKIPS and now - self._buffers[r][0][1] >= STARVATION_SECONDS]
+        if starving:
+            q = min(starving, key=lambda r: self._buffers[r][0][1])
+        else:
+            weights = {q: self._queues[q]() for q in ready}
+            for r in ready:
+                self._credit[r] += weights[r]
+            q = max(ready, key=lambda r: self._credit[r])
+            self._credit[q] -= sum(weights.values())
+        for r in ready:
+            self._skips[r] = 0 if r == q else self._skips[r] + 1
+        m, _ = self._buffers[q].pop(0)
+        return q, m
+
+    def _room(self, q):
+        cap = max(1, self._capacity())
+        room = cap - sum(self._outstanding.values())
+        others_busy = any(self._outstanding[o] or not self._idle[o] for o in self._queues if o != q)
+        if others_busy:
+            total = sum(w() for w in self._queues.values())
+            share = max(1, cap * self._queues[q]() // total)
+            room = min(room, share - self._outstanding[q])
+        return min(room, RECEIVE_BATCH_SIZE)
+
+    def _run(self, q):
+        while True:
+            with self._cond:
+                while not self._stop and self._room(q) <= 0:
+                    self._cond.wait(1.0)
+                if self._stop:
+                    return
+                want = self._room(q)
+                self._outstanding[q] += want   # reserve the slots while the long poll is open
+            msgs = receive(q, want)
+            now = time.monotonic()
+            for m in msgs:
+                _LEASES.track(q, m)
+            with self._cond:
+                self._outstanding[q] -= want - len(msgs)
+                self._idle[q] = not msgs
+                self._buffers[q].extend((m, now) for m in msgs)
+                self._cond.notify_all()
+
+def _poller(capacity):
+    queues = {RESIZE_Q_URL: lambda: RESIZE_WEIGHT, INGEST_Q_URL: lambda: INGEST_WEIGHT}
+    if PRIORITY_Q_URL:
+        # the priority lane is drained ahead of large renders; RESIZE_WEIGHT is the share they keep meanwhile
+        queues[PRIORITY_Q_URL] = lambda: PRIORITY_WEIGHT
+    return QueuePoller(queues, capacity)
+
+# -------- View counters (WORKER_MODE=counters) --------
+# Views are read from VIEWS_QUEUE_URL (SQS) or VIEWS_STREAM_NAME (Kinesis) and summed in memory by
+# (imageId, size); see counters.py. The source position only moves past views that are stored:
+# SQS messages stay leased until the flush that includes them succeeded, and Kinesis sequence
+# numbers are checkpointed per shard in the counters table after each successful flush.
+_COUNTERS = None
+_VARIANT_PIXELS = OrderedDict()   # (imageId, size) -> width * height of the variant
+_VARIANT_PIXELS_MAX = 100000
+
+def _variant_pixels(image_id, size_name):
+    key = (image_id, size_name)
+    px = _VARIANT_PIXELS.get(key)
+    if px is not None:
+        _VARIANT_PIXELS.move_to_end(key)
+        return px
+    item = ddb.get_item(
+        TableName=DDB_META, Key={"id": {"S": image_id}},
+        ProjectionExpression="#v.#s", ExpressionAttributeNames={"#v": "variants", "#s": size_name},
+    ).get("Item") or {}
+    v = item.get("variants", {}).get("M", {}).get(size_name, {}).get("M", {})
+    if "width" not in v or "height" not in v:
+        return 0   # not rendered (yet): not cached, priced again next flush
+    px = _VARIANT_PIXELS[key] = int(v["width"]["N"]) * int(v["height"]["N"])
+    while len(_VARIANT_PIXELS) > _VARIANT_PIXELS_MAX:
+        _VARIANT_PIXELS.popitem(last=False)
+    return px
+
+def _flush_counters():
+    with _METRICS.timer("counter_flush"):
+        return _COUNTERS.flush()
+
+def _counters_sqs_loop():
+    qname = VIEWS_Q_URL.rsplit("/", 1)[-1]
+    pending = []   # receipts of messages whose views are not stored yet
+    loop = 0
+    while _RUN:
+        loop += 1
+        due_in = _COUNTERS.time_to_due()
+        wait = POLL_WAIT_SECONDS if due_in is None else int(min(POLL_WAIT_SECONDS, due_in))
+        try:
+            with _METRICS.timer("sqs_receive", queue=qname):
+                msgs = sqs.receive_message(QueueUrl=VIEWS_Q_URL, MaxNumberOfMessages=10,
+                                           WaitTimeSeconds=wait, VisibilityTimeout=VISIBILITY_TIMEOUT).get("Messages", [])
+        except Exception as e:
+            log.warning("SQS receive_message failed for '%s': %s", qname, e)
+            msgs = []
+            time.sleep(1)
+        for m in msgs:
+            events = parse_view_events(m.get("Body", ""))
+            if not events:
+                log.warning("No view events in message %s (first 200 chars): %s", m.get("MessageId"), m.get("Body", "")[:200])
+                _LEASES.release(VIEWS_Q_URL, m["ReceiptHandle"])
+                continue
+            _LEASES.track(VIEWS_Q_URL, m)
+            for ev in events:
+                _COUNTERS.add(*ev)
+            pending.append(m["ReceiptHandle"])
+        if _COUNTERS.due() and _flush_counters():
+            for receipt in pending:
+                _LEASES.release(VIEWS_Q_URL, receipt)
+            pending = []
+        _heartbeat(loop, "busy" if msgs else "idle", buffered=_COUNTERS.pending(), unflushed_msgs=len(pending),
+                   counters=_COUNTERS.stats)
+    if _flush_counters():
+        for receipt in pending:
+            _LEASES.release(VIEWS_Q_URL, receipt)
+    else:
+        log.warning("Final counter flush incomplete; %d message(s) left for redelivery", len(pending))
+
+def _checkpoint_key(shard_id):
+    return {"imageId": {"S": f"checkpoint#{VIEWS_STREAM_NAME}"}, "size": {"S": shard_id}}
+
+def _load_checkpoint(shard_id):
+    item = ddb.get_item(TableName=DDB_COUNTERS, Key=_checkpoint_key(shard_id), ConsistentRead=True).get("Item") or {}
+    return item.get("sequence", {}).get("S")
+
+def _save_checkpoints(positions):
+    for shard_id, seq in positions.items():
+        ddb.update_item(
+            TableName=DDB_COUNTERS, Key=_checkpoint_key(shard_id),
+            UpdateExpression="SET #seq = :s, updated_at = :now",
+            ExpressionAttributeNames={"#seq": "sequence"},
+            ExpressionAttributeValues={":s": {"S": seq}, ":now": {"N": str(int(time.time()))}},
+        )
+
+def _shard_iterator(shard_id, after):
+    args = {"StreamName": VIEWS_STREAM_NAME, "ShardId": shard_id}
+    if after:
+        args.update(ShardIteratorType="AFTER_SEQUENCE_NUMBER", StartingSequenceNumber=after)
+    else:
+        args["ShardIteratorType"] = "TRIM_HORIZON"
+    return kin.get_shard_iterator(**args)["ShardIterator"]
+
+def _counters_kinesis_loop():
+    iterators = {}   # shardId -> iterator of the shards being read
+    read = {}        # shardId -> last sequence number added to the aggregator
+    saved = {}       # shardId -> last checkpointed sequence number
+    closed = set()
+    listed_at = 0.0
+    loop = 0
+    while _RUN:
+        loop += 1
+        if time.monotonic() - listed_at >= 60:   # pick up new shards after a reshard
+            listed_at = time.monotonic()
+            try:
+                for shard in kin.list_shards(StreamName=VIEWS_STREAM_NAME).get("Shards", []):
+                    sid = shard["ShardId"]
+                    if sid not in iterators and sid not in closed:
+                        saved[sid] = _load_checkpoint(sid)
+                        iterators[sid] = _shard_iterator(sid, saved[sid])
+                        log.info("Reading shard %s of '%s' from %s", sid, VIEWS_STREAM_NAME, saved[sid] or "TRIM_HORIZON")
+            except Exception as e:
+                log.warning("Listing shards of '%s' failed: %s", VIEWS_STREAM_NAME, e)
+        got = 0
+        for sid, it in list(iterators.items()):
+            try:
+                resp = kin.get_records(ShardIterator=it, Limit=1000)
+            except Exception as e:
+                # expired iterator or throttling: resume after what has been read
+                log.warning("get_records failed for shard %s: %s", sid, e)
+                iterators[sid] = _shard_iterator(sid, read.get(sid) or saved.get(sid))
+                continue
+            for rec in resp.get("Records", []):
+                for ev in parse_view_events(rec["Data"]):
+                    _COUNTERS.add(*ev)
+                read[sid] = rec["SequenceNumber"]
+                got += 1
+            if resp.get("NextShardIterator"):
+                iterators[sid] = resp["NextShardIterator"]
+            else:
+                del iterators[sid]
+                closed.add(sid)
+                log.info("Shard %s of '%s' is closed and fully read", sid, VIEWS_STREAM_NAME)
+        if _COUNTERS.due() and _flush_counters():
+            _save_checkpoints({sid: seq for sid, seq in read.items() if saved.get(sid) != seq})
+            saved.update(read)
+        _heartbeat(loop, "busy" if got else "idle", shards=len(iterators), buffered=_COUNTERS.pending(),
+                   counters=_COUNTERS.stats)
+        if not got:
+            time.sleep(1)   # GetRecords allows 5 calls per second per shard
+    if _flush_counters():
+        _save_checkpoints({sid: seq for sid, seq in read.items() if saved.get(sid) != seq})
+
+def _counters_loop():
+    global _COUNTERS
+    _COUNTERS = ViewAggregator(ddb, DDB_COUNTERS, max_delay=COUNTER_FLUSH_SECONDS, max_keys=COUNTER_FLUSH_KEYS,
+                               threads=COUNTER_WRITE_THREADS, pixels_for=_variant_pixels)
+    try:
+        if VIEWS_STREAM_NAME:
+            log.info("View counters: stream=%s table=%s flush=%ss/%d keys", VIEWS_STREAM_NAME, DDB_COUNTERS,
+                     COUNTER_FLUSH_SECONDS, COUNTER_FLUSH_KEYS)
+            _counters_kinesis_loop()
+        else:
+            log.info("View counters: queue=%s table=%s flush=%ss/%d keys", VIEWS_Q_URL.rsplit("/", 1)[-1],
+                     DDB_COUNTERS, COUNTER_FLUSH_SECONDS, COUNTER_FLUSH_KEYS)
+            _counters_sqs_loop()
+    finally:
+        _COUNTERS.close()
+
+# -------- Scaling signal --------
+class _ServiceTimes:
+    """Per-queue EWMA of wall seconds and CPU-pool seconds per message, measured in _process()."""
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._avg = {}      # queue url -> [wall, cpu]
+        self.count = {}     # queue url -> messages processed
+        self._local = threading.local()
+
+    def begin(self):
+        self._local.cpu = 0.0
+
+    def add_cpu(self, seconds):
+        self._local.cpu = getattr(self._local, "cpu", 0.0) + seconds
+
+    def record(self, queue, wall):
+        cpu = getattr(self._local, "cpu", 0.0)
+        with self._lock:
+            a = self._avg.get(queue)
+            if a is None:
+                self._avg[queue] = [wall, cpu]
+            else:
+                a[0] += self.alpha * (wall - a[0])
+                a[1] += self.alpha * (cpu - a[1])
+            self.count[queue] = self.count.get(queue, 0) + 1
+
+    def seconds_per_message(self, queue):
+        """Worker-seconds one message of `queue` costs this worker (1s until one has been measured).
+
+        A message holds an IO slot for its wall time and a pool process for its CPU time; whichever
+        resource runs out first bounds the rate, so the cost is the larger of the two shares.
+        """
+        with self._lock:
+            wall, cpu = self._avg.get(queue, (1.0, 0.0))
+        if WORKER_MODE == "serial":
+            return wall
+        return max(wall / max(1, min(IO_THREADS, MAX_INFLIGHT)), cpu / max(1, CPU_PROCS))
+
+    def fanout(self, ingest_queue, resize_queue, default=1.0):
+        """Messages of `resize_queue` per ingest message seen so far (`default` before any ingest)."""
+        with self._lock:
+            n_ingest = self.count.get(ingest_queue, 0)
+            return self.count.get(resize_queue, 0) / n_ingest if n_ingest else default
+
+_SERVICE_TIMES = _ServiceTimes()
+
+def _work_queues():
+    queues = [("ingest", INGEST_Q_URL), ("resize", RESIZE_Q_URL)]
+    return queues + [("priority", PRIORITY_Q_URL)] if PRIORITY_Q_URL else queues
+
+def _queue_depths():
+    """{"ingest"|"resize"|"priority": (visible, inflight)} from SQS' approximate counters."""
+    out = {}
+    for name, qurl in _work_queues():
+        attrs = sqs.get_queue_attributes(
+            QueueUrl=qurl,
+            AttributeNames=["ApproximateNumberOfMessages","ApproximateNumberOfMessagesNotVisible"]
+        ).get("Attributes", {})
+        out[name] = (int(attrs.get("ApproximateNumberOfMessages", 0)),
+                     int(attrs.get("ApproximateNumberOfMessagesNotVisible", 0)))
+    return out
+
+def _running_workers():
+    """Running tasks of ECS_SERVICE; 1 (this worker) when the service is not configured or the call fails."""
+    if ecs is None or not ECS_SERVICE:
+        return 1
+    try:
+        kwargs = {"cluster": ECS_CLUSTER} if ECS_CLUSTER else {}
+        services = ecs.describe_services(services=[ECS_SERVICE], **kwargs).get("services", [])
+        return max(1, int(services[0]["runningCount"])) if services else 1
+    except Exception as e:
+        log.debug("DescribeServices failed: %s", e)
+        return 1
+
+def scaling_signal(depths, running=1):
+    """Backlog in worker-seconds and the worker count that drains it within SCALE_TARGET_SECONDS.
+
+    An ingest message also costs the resize messages it fans out to, at the fan-out measured so far.
+    In-flight messages count as backlog: they still hold a worker.
+    """
+    queues = dict(_work_queues())
+    cost = {name: _SERVICE_TIMES.seconds_per_message(qurl) for name, qurl in queues.items()}
+    fanout = {name: _SERVICE_TIMES.fanout(INGEST_Q_URL, qurl, 1.0 if name == "resize" else 0.0)
+              for name, qurl in queues.items() if name != "ingest"}
+    backlog = {name: sum(depths.get(name, (0, 0))) for name in queues}
+    per_ingest = cost["ingest"] + sum(fanout[name] * cost[name] for name in fanout)
+    work = backlog["ingest"] * per_ingest + sum(backlog[name] * cost[name] for name in fanout)
+    recommended = min(SCALE_MAX_WORKERS, max(SCALE_MIN_WORKERS, math.ceil(work / SCALE_TARGET_SECONDS)))
+    return {
+        "backlog": backlog,
+        "seconds_per_message": {name: round(t, 4) for name, t in cost.items()},
+        "fanout": round(sum(fanout.values()), 2),
+        "backlog_seconds": round(work, 1),
+        "backlog_seconds_per_worker": round(work / running, 1),
+        "running_workers": running,
+        "recommended_workers": recommended,
+    }
+
+class ScalingPublisher:
+    """Publishes scaling_signal() every SCALE_EVERY_SECONDS for ECS service auto scaling.
+
+    Each sample goes to the metrics endpoint as gauges and to stdout as one CloudWatch embedded-metric
+    line (SCALE_METRICS_NAMESPACE, dimension Service), so no PutMetricData call is needed. Every worker
+    publishes the same queue-wide numbers; scale on their Average.
+    """
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+        self.last = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="scaling", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(SCALE_EVERY_SECONDS or 60):
+            if SCALE_EVERY_SECONDS:
+                try:
+                    self.publish()
+                except Exception as e:
+                    log.warning("Scaling signal not published: %s", e)
+
+    def publish(self):
+        sig = scaling_signal(_queue_depths(), _running_workers())
+        for queue, n in sig["backlog"].items():
+            _METRICS.gauge("backlog_messages", n, "Visible + in-flight messages.", queue=queue)
+            _METRICS.gauge("seconds_per_message", sig["seconds_per_message"][queue],
+                           "Measured worker-seconds per message.", queue=queue)
+        _METRICS.gauge("backlog_seconds", sig["backlog_seconds"], "Worker-seconds of queued work.")
+        _METRICS.gauge("backlog_seconds_per_worker", sig["backlog_seconds_per_worker"],
+                       "Worker-seconds of queued work per running worker.")
+        _METRICS.gauge("recommended_workers", sig["recommended_workers"],
+                       f"Workers needed to drain the backlog within {SCALE_TARGET_SECONDS:g}s.")
+        print(json.dumps({
+            "Service": ECS_SERVICE or "resizer",
+            "BacklogMessages": sum(sig["backlog"].values()),
+            "BacklogSeconds": sig["backlog_seconds"],
+            "BacklogPerWorker": sig["backlog_seconds_per_worker"],
+            "RecommendedWorkers": sig["recommended_workers"],
+            "RunningWorkers": sig["running_workers"],
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": SCALE_METRICS_NAMESPACE,
+                    "Dimensions": [["Service"]],
+                    "Metrics": [{"Name": "BacklogMessages", "Unit": "Count"},
+                                {"Name": "BacklogSeconds", "Unit": "Seconds"},
+                                {"Name": "BacklogPerWorker", "Unit": "Seconds"},
+                                {"Name": "RecommendedWorkers", "Unit": "Count"},
+                                {"Name": "RunningWorkers", "Unit": "Count"}],
+                }],
+            },
+        }), flush=True)
+        log.info("Scaling: backlog=%s work=%.0fs per_worker=%.0fs recommended=%d running=%d (s/msg=%s fanout=%.2f)",
+                 sig["backlog"], sig["backlog_seconds"], sig["backlog_seconds_per_worker"], sig["recommended_workers"],
+                 sig["running_workers"], sig["seconds_per_message"], sig["fanout"])
+        self.last = sig
+        return sig
+
+_SCALING = ScalingPublisher()
 
 # -------- Main loop --------
 _RUN = True
+READY = threading.Event()   # set once main_loop() has started its pools and threads
+
 def _sigterm(*_):
     global _RUN
     _RUN = False
     log.info("Received stop signal; exiting...")
 
-signal.signal(signal.SIGTERM, _sigterm)
-signal.signal(signal.SIGINT, _sigterm)
+def stop():
+    """Ask main_loop() to finish (what SIGTERM does); in-flight messages are drained."""
+    _sigterm()
 
 def _queue_stats_every(loop_idx):
     if QUEUE_STATS_EVERY and loop_idx % QUEUE_STATS_EVERY == 0:
         try:
-            for name, qurl in (("ingest", INGEST_Q_URL), ("resize", RESIZE_Q_URL)):
-                attrs = sqs.get_queue_attributes(
-                    QueueUrl=qurl,
-                    AttributeNames=["ApproximateNumberOfMessages","ApproximateNumberOfMessagesNotVisible"]
-                ).get("Attributes", {})
-                log.info("QStats %-6s: visible=%s inflight=%s",
-                         name, attrs.get("ApproximateNumberOfMessages"), attrs.get("ApproximateNumberOfMessagesNotVisible"))
+            for name, (visible, inflight) in _queue_depths().items():
+                log.info("QStats %-6s: visible=%s inflight=%s", name, visible, inflight)
         except Exception as e:
             log.debug("QStats fetch failed: %s", e)
 
-def main_loop():
-    log.info("Worker starting; ingest=%s resize=%s wait=%ss vis=%ss",
-             INGEST_Q_URL.rsplit('/',1)[-1], RESIZE_Q_URL.rsplit('/',1)[-1],
-             POLL_WAIT_SECONDS, VISIBILITY_TIMEOUT)
-    loop = 0
-    while _RUN:
-        loop += 1
-        msgs = receive(RESIZE_Q_URL)
-        src_queue = RESIZE_Q_URL
+def _handle_message(m):
+    body = m.get("Body", "")
+    payload = json.loads(body)
+    if "Records" in payload:
+        handle_s3_ingest(payload)
+    elif payload.get("type") == "resize":
+        _METRICS.label(size=payload.get("size"))
+        handle_resize_task(payload)
+    elif payload.get("type") == "resize_all":
+        _METRICS.label(size="all")
+        handle_resize_all_task(payload)
+    else:
+        log.warning("Unknown message shape (first 200 chars): %s", body[:200])
 
-        if not msgs:
-            msgs = receive(INGEST_Q_URL)
-            src_queue = INGEST_Q_URL
+def _process(src_queue, m):
+    t0 = time.perf_counter()
+    _SERVICE_TIMES.begin()
+    with _METRICS.context(queue=src_queue.rsplit("/", 1)[-1]):
+        redeliver = False
+        try:
+            _handle_message(m)
+        except Redeliver as e:
+            redeliver = True
+            log.warning("Message %s kept for redelivery: %s", m.get("MessageId", ""), e)
+        except Exception as e:
+            log.exception("Error handling message: %s", e)
+        finally:
+            if redeliver:
+                # not deleted: visible again once its current visibility timeout runs out
+                _LEASES.untrack(src_queue, m["ReceiptHandle"])
+            else:
+                _LEASES.release(src_queue, m["ReceiptHandle"])
+            _METRICS.observe("e2e", time.perf_counter() - t0)
+            _SERVICE_TIMES.record(src_queue, time.perf_counter() - t0)
 
-        if not msgs:
-            if HEARTBEAT_EVERY and loop % HEARTBEAT_EVERY == 0:
-                log.info("Heartbeat: idle (loop=%d)", loop)
-            _queue_stats_every(loop)
-            continue
+def _heartbeat(loop, state, **extra):
+    if HEARTBEAT_EVERY and loop % HEARTBEAT_EVERY == 0:
+        details = " ".join(f"{k}={v}" for k, v in extra.items())
+        log.info("Heartbeat: %s (loop=%d%s)%s%s%s", state, loop, " " + details if details else "",
+                 _cache_summary(), _dedup_summary(), _METRICS.summary())
 
-        for m in msgs:
-            payload = None
+def _serial_loop():
+    poller = _poller(lambda: max(2, RECEIVE_BATCH_SIZE))
+    poller.start()
+    loop = 0
+    try:
+        while _RUN:
+            loop += 1
+            item = poller.get(timeout=1.0)
+            _heartbeat(loop, "busy" if item else "idle")
+            if item is None:
+                _queue_stats_every(loop)
+                continue
+            src_queue, m = item
             try:
-                body = m.get("Body", "")
-                payload = json.loads(body)
-                if "Records" in payload:
-                    handle_s3_ingest(payload)
-                elif payload.get("type") == "resize":
-                    handle_resize_task(payload)
-                else:
-                    log.warning("Unknown message shape (first 200 chars): %s", body[:200])
-            except Exception as e:
-                log.exception("Error handling message: %s", e)
+                _process(src_queue, m)
             finally:
-                delete(src_queue, m["ReceiptHandle"])
+                poller.done(src_queue)
+    finally:
+        poller.stop()
+
+# -------- Concurrent engine --------
+class _Throughput:
+    """EWMA of wall-clock seconds per message, used to size the in-flight window."""
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.avg = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.avg = seconds if self.avg is None else (self.alpha * seconds + (1 - self.alpha) * self.avg)
+
+    def capacity(self):
+        # Messages queued behind busy threads must still finish inside the visibility window:
+        # a slot can run `rounds` messages back to back within VISIBILITY_TIMEOUT * VISIBILITY_SAFETY.
+        avg = self.avg
+        if not avg:
+            return max(1, min(MAX_INFLIGHT, IO_THREADS))
+        rounds = max(1, int(VISIBILITY_TIMEOUT * VISIBILITY_SAFETY // avg))
+        return max(1, min(MAX_INFLIGHT, IO_THREADS * rounds))
+
+_THROUGHPUT = _Throughput()
+
+def _timed_process(src_queue, m):
+    t0 = time.monotonic()
+    try:
+        _process(src_queue, m)
+    finally:
+        _THROUGHPUT.record(time.monotonic() - t0)
+
+def _start_cpu_pool():
+    global _CPU_POOL
+    # fork (not spawn): children inherit the state init() set up. Workers are forked
+    # eagerly here, before any other thread exists, so no locks are inherited mid-acquire.
+    _CPU_POOL = ProcessPoolExecutor(max_workers=CPU_PROCS, mp_context=multiprocessing.get_context("fork"))
+    _CPU_POOL.submit(int).result()
+
+def _concurrent_loop():
+    io_size = IO_THREADS
+    io_pool = ThreadPoolExecutor(max_workers=io_size, thread_name_prefix="io")
+    retired = []
+    inflight = set()
+    # the poller keeps buffered + in-flight messages within the window, split between the queues by weight
+    poller = _poller(_THROUGHPUT.capacity)
+    poller.start()
+    loop = 0
+    try:
+        while _RUN:
+            loop += 1
+            inflight = {f for f in inflight if not f.done()}
+
+            if IO_THREADS != io_size:
+                # live IO_THREADS change: the old pool finishes what it already has
+                log.info("Resizing IO pool %d -> %d threads", io_size, IO_THREADS)
+                io_pool.shutdown(wait=False)
+                retired.append(io_pool)
+                io_pool, io_size = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io"), IO_THREADS
+
+            # dispatch only to a free IO thread: what is waiting stays in the poller's buffers, where the queue
+            # weights (priority lane first) decide the order, instead of in the pool's FIFO
+            if len(inflight) >= io_size:
+                wait(inflight, timeout=1.0, return_when=FIRST_COMPLETED)
+                _heartbeat(loop, "busy", inflight=len(inflight), queues=poller.stats(), decode=_DECODE.summary())
+                continue
+
+            item = poller.get(timeout=1.0)
+            _heartbeat(loop, "busy" if item else "idle", inflight=len(inflight), queues=poller.stats(),
+                       decode=_DECODE.summary())
+            if item is None:
+                _queue_stats_every(loop)
+                continue
+
+            src_queue, m = item
+            fut = io_pool.submit(_timed_process, src_queue, m)
+            fut.add_done_callback(lambda _, q=src_queue: poller.done(q))
+            inflight.add(fut)
+    finally:
+        poller.stop()
+        log.info("Draining %d in-flight message(s)...", sum(1 for f in inflight if not f.done()))
+        for pool in retired + [io_pool]:
+            pool.shutdown(wait=True)
+
+def main_loop():
+    if _CFG is None:
+        init()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _sigterm)
+        signal.signal(signal.SIGINT, _sigterm)
+    if WORKER_MODE == "counters":
+        log.info("Worker starting; mode=counters wait=%ss vis=%ss", POLL_WAIT_SECONDS, VISIBILITY_TIMEOUT)
+    else:
+        log.info("Worker starting; ingest=%s resize=%s priority=%s wait=%ss vis=%ss mode=%s",
+                 INGEST_Q_URL.rsplit('/',1)[-1], RESIZE_Q_URL.rsplit('/',1)[-1],
+                 PRIORITY_Q_URL.rsplit('/',1)[-1] + f" {PRIORITY_SIZES}" if PRIORITY_Q_URL else "-",
+                 POLL_WAIT_SECONDS, VISIBILITY_TIMEOUT, WORKER_MODE)
+    if WORKER_MODE not in ("serial", "counters"):
+        _start_cpu_pool()   # before any other thread is started
+    _LEASES.start()
+    _CONFIG_WATCHER.start()
+    if WORKER_MODE != "counters":
+        _SCALING.start()
+    if METRICS_PORT:
+        try:
+            log.info("Metrics endpoint on :%d/metrics", _METRICS.serve(METRICS_PORT))
+        except OSError as e:
+            log.warning("Metrics endpoint not started on port %d: %s", METRICS_PORT, e)
+    READY.set()
+    try:
+        if WORKER_MODE == "counters":
+            _counters_loop()
+        elif WORKER_MODE == "serial":
+            _serial_loop()
+        else:
+            log.info("Concurrent engine: io_threads=%d cpu_procs=%d max_inflight=%d", IO_THREADS, CPU_PROCS, MAX_INFLIGHT)
+            _concurrent_loop()
+    finally:
+        # Runs after SIGTERM/SIGINT ends the loop: push out buffered events before deleting the rest.
+        _CONFIG_WATCHER.stop()
+        _SCALING.stop()
+        _METRICS.close()
+        _PUBLISHER.close()
+        _LEASES.stop()
+        if _CPU_POOL is not None:
+            _CPU_POOL.shutdown(wait=True)
 
 if __name__ == "__main__":
     try:
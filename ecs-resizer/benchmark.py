@@ -0,0 +1,220 @@
+# Offline throughput benchmark for the decode/resize/encode path (no AWS, no network).
+#
+# Usage:
+#   python benchmark.py                              # synthetic corpus, print a table
+#   python benchmark.py --out run.json               # also save the results
+#   python benchmark.py --out new.json --compare run.json
+#   python benchmark.py --procs 4 --repeat 3 photo1.jpg photo2.png
+#   FAST_RESIZE=0 SIZES=thumb,medium python benchmark.py ...
+#
+# The synthetic corpus covers several resolutions and aspect ratios in RGB, RGBA, CMYK and palette (P) modes,
+# saved as JPEG, PNG, WebP, TIFF and GIF where the mode allows it. Each original is rendered two ways:
+#   per_size  one render_variant() per size (RESIZE_FANOUT=per_size: a decode per size)
+#   batched   one render_variants() for all sizes (RESIZE_FANOUT=batched: one decode, cascaded resizes)
+# and the decode / resize / encode seconds come from imaging.profiled(), the same timings the worker exports.
+# Every (original, fanout) runs in a fresh spawned process, so its peak RSS is that run's own high-water mark.
+# Sizes the batched path aliases (upscale_policy "copy": no render, an S3 copy of the larger one in the worker)
+# are counted with the bytes of the variant they copy and listed under "aliased".
+# Size profiles come from SIZE_PROFILES (JSON, as in the worker) and output formats from BENCH_FORMATS
+# (a VARIANT_FORMATS-style list, default JPEG at JPEG_QUALITY).
+import os, io, sys, json, time, resource, argparse, platform, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, features
+
+import imaging
+from quality_check import synthetic_image
+
+SIZES = [s.strip() for s in os.getenv("SIZES", "thumb,medium,large").split(",") if s.strip()]
+PROFILES = imaging.parse_size_profiles(json.loads(os.getenv("SIZE_PROFILES", "null")) or imaging.DEFAULT_SIZE_PROFILES)
+FORMATS, _SKIPPED = imaging.normalize_formats(json.loads(os.getenv("BENCH_FORMATS", "null")) or imaging.DEFAULT_FORMATS)
+
+# (width, height) before BENCH_SCALE; landscape, portrait, square, panorama and a small web image
+RESOLUTIONS = [(4000, 3000), (3000, 4000), (2048, 2048), (6000, 2000), (1200, 800)]
+# mode -> container formats that can hold it
+MODE_FORMATS = {
+    "RGB":  ["JPEG", "PNG", "WEBP"],
+    "RGBA": ["PNG", "WEBP"],
+    "CMYK": ["JPEG", "TIFF"],
+    "P":    ["PNG", "GIF"],
+}
+_SAVE_OPTS = {"JPEG": {"quality": 92}, "WEBP": {"quality": 90}, "PNG": {"compress_level": 1}}
+
+
+def _encodable(fmt):
+    Image.init()
+    return fmt in Image.SAVE and (fmt != "WEBP" or features.check("webp"))
+
+def synthetic_corpus(scale=1.0):
+    """[(name, encoded_bytes)] covering RESOLUTIONS x MODE_FORMATS."""
+    corpus = []
+    for i, (w, h) in enumerate(RESOLUTIONS):
+        w, h = max(16, int(w * scale)), max(16, int(h * scale))
+        rgb = synthetic_image(w, h, i)
+        for mode, fmts in MODE_FORMATS.items():
+            if mode == "RGBA":
+                im = rgb.copy()
+                im.putalpha(rgb.convert("L"))
+            elif mode == "P":
+                im = rgb.quantize(256)
+            else:
+                im = rgb.convert(mode)
+            for fmt in fmts:
+                if not _encodable(fmt):
+                    continue
+                out = io.BytesIO()
+                im.save(out, format=fmt, **_SAVE_OPTS.get(fmt, {}))
+                corpus.append((f"{w}x{h} {mode} {fmt}", out.getvalue()))
+    return corpus
+
+def _add_stages(total, prof):
+    for stage, _, seconds in prof["stages"]:
+        total[stage] = total.get(stage, 0.0) + seconds
+
+FANOUTS = ("per_size", "batched")
+
+def bench_one(name, data, repeat=1, fanouts=FANOUTS):
+    """Render one original `repeat` times per fanout; returns a result dict (JSON-serializable).
+
+    peak_rss_kib is the high-water mark of the calling process, so it only describes this run when the
+    process rendered nothing else (see run()).
+    """
+    with Image.open(io.BytesIO(data)) as im:
+        w, h, mode, fmt = im.width, im.height, im.mode, im.format
+    res = {"name": name, "width": w, "height": h, "mode": mode, "format": fmt, "bytes": len(data)}
+    formats_by_size = {sz: FORMATS for sz in SIZES}
+    for fanout in fanouts:
+        cpu = wall = 0.0
+        stages, outputs, aliased = {}, {}, []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            if fanout == "per_size":
+                for sz in SIZES:
+                    (_, _, outs), prof = imaging.profiled(imaging.render_variant, data, sz, None, FORMATS, PROFILES, False)
+                    cpu += prof["cpu"]
+                    _add_stages(stages, prof)
+                    outputs[sz] = {f: len(b) for f, b in outs}
+            else:
+                results, prof = imaging.profiled(imaging.render_variants, data, SIZES, None, formats_by_size,
+                                                 PROFILES, "copy")
+                cpu += prof["cpu"]
+                _add_stages(stages, prof)
+                for r in results:
+                    if r["error"]:
+                        raise RuntimeError(f"{name} {r['size']}: {r['error']}")
+                    if r["alias_of"]:
+                        # stored as a copy of the larger variant: same bytes, no render
+                        outputs[r["size"]] = dict(outputs[r["alias_of"]])
+                        aliased.append(r["size"])
+                    else:
+                        outputs[r["size"]] = {f: len(b) for f, b in r["outputs"]}
+            wall += time.perf_counter() - t0
+        res[fanout] = {
+            "cpu_s": cpu / repeat,
+            "wall_s": wall / repeat,
+            "stages_s": {k: v / repeat for k, v in sorted(stages.items())},
+            "output_bytes": outputs,
+            "aliased": sorted(set(aliased)),
+            # ru_maxrss is KiB on Linux
+            "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+    return res
+
+def _bench_star(args):
+    return bench_one(*args)
+
+def run(corpus, repeat=1, procs=1):
+    # One spawned process per (original, fanout): a forked or reused process would carry the corpus and
+    # earlier runs in its RSS high-water mark. Process start-up is included in wall_s, not in the per-run times.
+    jobs = [(name, data, repeat, (fanout,)) for name, data in corpus for fanout in FANOUTS]
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=procs, mp_context=multiprocessing.get_context("spawn"),
+                             max_tasks_per_child=1) as pool:
+        parts = list(pool.map(_bench_star, jobs))
+    wall = time.perf_counter() - t0
+
+    results = {}
+    for part in parts:
+        results.setdefault(part["name"], {}).update(part)
+    results = list(results.values())
+    summary = {"images": len(results), "procs": procs, "wall_s": wall,
+               "peak_rss_kib": max(r[f]["peak_rss_kib"] for r in results for f in FANOUTS)}
+    for fanout in FANOUTS:
+        cpu = sum(r[fanout]["cpu_s"] for r in results)
+        stages = {}
+        for r in results:
+            for k, v in r[fanout]["stages_s"].items():
+                stages[k] = stages.get(k, 0.0) + v
+        summary[fanout] = {
+            "cpu_s": cpu,
+            # one core turns CPU seconds into images at this rate
+            "images_per_s_per_core": len(results) / cpu if cpu else 0.0,
+            "stages_s": stages,
+            "output_bytes": sum(sum(f.values()) for r in results for f in r[fanout]["output_bytes"].values()),
+            "aliased": sum(len(r[fanout]["aliased"]) for r in results),
+            "peak_rss_kib": max(r[fanout]["peak_rss_kib"] for r in results),
+        }
+    summary["aggregate_images_per_s"] = len(results) * repeat * 2 / wall if wall else 0.0   # both fanouts
+    return results, summary
+
+def _meta(repeat, procs):
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(), "pillow": Image.__version__, "machine": platform.machine(),
+        "cpus": os.cpu_count(), "procs": procs, "repeat": repeat,
+        "sizes": SIZES, "profiles": {k: PROFILES[k] for k in SIZES if k in PROFILES}, "formats": FORMATS,
+        "imaging": imaging.settings(),
+    }
+
+def _print_table(results, summary):
+    print(f"{'original':<28} {'bytes':>9} {'per_size cpu':>13} {'batched cpu':>12} {'decode':>8} {'resize':>8} {'encode':>8}")
+    for r in results:
+        b = r["batched"]["stages_s"]
+        print(f"{r['name']:<28} {r['bytes']:>9} {r['per_size']['cpu_s']:>12.3f}s {r['batched']['cpu_s']:>11.3f}s "
+              f"{b.get('decode', 0):>7.3f}s {b.get('resize', 0):>7.3f}s {b.get('encode', 0):>7.3f}s")
+    for fanout in ("per_size", "batched"):
+        s = summary[fanout]
+        stages = " ".join(f"{k}={v:.2f}s" for k, v in sorted(s["stages_s"].items()))
+        print(f"{fanout:<9} images/s/core={s['images_per_s_per_core']:.2f} cpu={s['cpu_s']:.2f}s "
+              f"output={s['output_bytes']}B aliased={s['aliased']} peak rss={s['peak_rss_kib']}KiB {stages}")
+    print(f"wall={summary['wall_s']:.2f}s procs={summary['procs']}")
+
+def _compare(summary, baseline):
+    print("vs baseline:")
+    for fanout in ("per_size", "batched"):
+        new, old = summary[fanout], baseline.get("summary", {}).get(fanout)
+        if not old:
+            continue
+        for key in ("images_per_s_per_core", "cpu_s", "output_bytes", "peak_rss_kib"):
+            a, b = old.get(key), new.get(key)
+            if a:
+                print(f"  {fanout:<9} {key:<22} {a:>12.2f} -> {b:>12.2f} ({(b - a) / a * 100:+.1f}%)")
+
+def main(argv):
+    ap = argparse.ArgumentParser(description="Offline decode/resize/encode benchmark.")
+    ap.add_argument("originals", nargs="*", help="image files to use instead of the synthetic corpus")
+    ap.add_argument("--out", help="write results as JSON to this file")
+    ap.add_argument("--compare", help="JSON from an earlier run to compare the summary against")
+    ap.add_argument("--repeat", type=int, default=int(os.getenv("BENCH_REPEAT", "1")))
+    ap.add_argument("--procs", type=int, default=1, help="run originals in this many processes")
+    ap.add_argument("--scale", type=float, default=float(os.getenv("BENCH_SCALE", "1.0")),
+                    help="scale the synthetic resolutions (e.g. 0.25 for a quick run)")
+    args = ap.parse_args(argv)
+
+    if _SKIPPED:
+        print(f"formats not supported by this Pillow build, skipped: {_SKIPPED}", file=sys.stderr)
+    corpus = [(p, open(p, "rb").read()) for p in args.originals] or synthetic_corpus(args.scale)
+    results, summary = run(corpus, max(1, args.repeat), max(1, args.procs))
+    _print_table(results, summary)
+
+    report = {"meta": _meta(args.repeat, args.procs), "summary": summary, "results": results}
+    if args.compare:
+        with open(args.compare) as f:
+            _compare(summary, json.load(f))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"results written to {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
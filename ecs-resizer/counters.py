@@ -0,0 +1,165 @@
+# View counters: aggregate view events in memory and write them to the counters table as batched increments.
+#
+# The counters table is keyed by (imageId, size) and holds `views` and `pixelsViewed`, which the Lambda@Edge
+# function adds to every image response. One UpdateItem ADD per (imageId, size) per flush replaces one write
+# per view, so a hot image costs one write per flush interval however often it is viewed.
+import json, time, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("counters")
+
+
+def _from_uri(uri):
+    # "/images/<id>/<size>.<ext>" -> (id, size); originals and anything else -> None
+    parts = uri.split("?", 1)[0].strip("/").split("/")
+    if len(parts) >= 3 and parts[0] == "images":
+        size = parts[2].split(".", 1)[0]
+        if size and not size.startswith("original"):
+            return parts[1], size
+    return None
+
+
+def parse_view_events(data):
+    """[(imageId, size, views, pixels_per_view or None)] from one SQS body or Kinesis record.
+
+    Accepts a JSON event {"imageId", "size", "views"?, "pixels"?} or {"uri": "/images/<id>/<size>.<ext>", ...},
+    a JSON list of those, or CloudFront real-time log lines (tab-separated; the first /images/ path is used).
+    Anything else is skipped.
+    """
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", "replace")
+    try:
+        doc = json.loads(data)
+    except ValueError:
+        doc = None
+    out = []
+    if isinstance(doc, (dict, list)):
+        for ev in doc if isinstance(doc, list) else [doc]:
+            if not isinstance(ev, dict):
+                continue
+            key = (ev.get("imageId"), ev.get("size")) if ev.get("imageId") and ev.get("size") else _from_uri(str(ev.get("uri", "")))
+            if not key:
+                continue
+            try:
+                views = int(ev.get("views", 1))
+                pixels = int(ev["pixels"]) if ev.get("pixels") is not None else None
+            except (TypeError, ValueError):
+                continue
+            if views > 0:
+                out.append((str(key[0]), str(key[1]), views, pixels))
+        return out
+    for line in data.splitlines():
+        for field in line.split("\t"):
+            if field.startswith("/images/"):
+                key = _from_uri(field)
+                if key:
+                    out.append((key[0], key[1], 1, None))
+                break
+    return out
+
+
+class ViewAggregator:
+    """Sums views and pixels per (imageId, size) and flushes them as UpdateItem ADD increments.
+
+    add() is cheap and thread-safe. due() turns true once the oldest unflushed view is `max_delay` seconds old
+    or `max_keys` distinct keys are buffered. flush() writes every key with `threads` parallel UpdateItem calls;
+    keys that still fail after `max_attempts` are merged back and flush() returns False, so the caller does not
+    advance its checkpoint past views that are not stored yet.
+
+    Views without a pixel count are priced at flush time with `pixels_for(image_id, size)` (pixels per view).
+    """
+
+    def __init__(self, ddb, table, max_delay=10.0, max_keys=1000, threads=8, max_attempts=4, pixels_for=None):
+        self._ddb = ddb
+        self.table = table
+        self.max_delay = max_delay
+        self.max_keys = max_keys
+        self.max_attempts = max(1, max_attempts)
+        self._pixels_for = pixels_for
+        self._pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="counters")
+        self._lock = threading.Lock()
+        self._counts = {}   # (imageId, size) -> [views, pixels, views without a pixel count]
+        self._since = None
+        self.stats = {"views": 0, "writes": 0, "failed": 0, "flushes": 0}
+
+    def add(self, image_id, size, views=1, pixels=None):
+        with self._lock:
+            c = self._counts.get((image_id, size))
+            if c is None:
+                c = self._counts[(image_id, size)] = [0, 0, 0]
+            c[0] += views
+            if pixels is None:
+                c[2] += views
+            else:
+                c[1] += pixels * views
+            if self._since is None:
+                self._since = time.monotonic()
+            self.stats["views"] += views
+
+    def pending(self):
+        with self._lock:
+            return len(self._counts)
+
+    def time_to_due(self):
+        """Seconds until due() (0 if it is already); None while nothing is buffered."""
+        with self._lock:
+            if self._since is None:
+                return None
+            if len(self._counts) >= self.max_keys:
+                return 0.0
+            return max(0.0, self._since + self.max_delay - time.monotonic())
+
+    def due(self):
+        return self.time_to_due() == 0.0
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts, self._since = self._counts, {}, None
+        if not counts:
+            return True
+        t0 = time.perf_counter()
+        futures = {key: self._pool.submit(self._write, key, c) for key, c in counts.items()}
+        failed = {key: counts[key] for key, f in futures.items() if not f.result()}
+        self.stats["flushes"] += 1
+        self.stats["writes"] += len(counts) - len(failed)
+        if failed:
+            self.stats["failed"] += len(failed)
+            with self._lock:
+                for key, (views, pixels, unpriced) in failed.items():
+                    c = self._counts.setdefault(key, [0, 0, 0])
+                    c[0] += views; c[1] += pixels; c[2] += unpriced
+                if self._since is None:
+                    self._since = time.monotonic()
+            log.warning("Counter flush: %d of %d key(s) not written; kept for the next flush", len(failed), len(counts))
+            return False
+        log.info("Counter flush: %d key(s), %d view(s) in %.2fs", len(counts), sum(c[0] for c in counts.values()),
+                 time.perf_counter() - t0)
+        return True
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def _write(self, key, counts):
+        image_id, size = key
+        views, pixels, unpriced = counts
+        if unpriced and self._pixels_for is not None:
+            try:
+                pixels += self._pixels_for(image_id, size) * unpriced
+            except Exception as e:
+                log.debug("No pixel count for %s/%s: %s", image_id, size, e)
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self._ddb.update_item(
+                    TableName=self.table,
+                    Key={"imageId": {"S": image_id}, "size": {"S": size}},
+                    UpdateExpression="ADD #v :v, pixelsViewed :p SET updated_at = :now",
+                    ExpressionAttributeNames={"#v": "views"},
+                    ExpressionAttributeValues={":v": {"N": str(views)}, ":p": {"N": str(pixels)},
+                                               ":now": {"N": str(int(time.time()))}},
+                )
+                return True
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    log.warning("Counter update for %s/%s failed after %d attempt(s): %s", image_id, size, attempt, e)
+                    return False
+                time.sleep(min(1.0, 0.05 * (2 ** (attempt - 1))))
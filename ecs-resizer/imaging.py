@@ -0,0 +1,310 @@
+# Pure image operations for the resizer (no AWS clients, no config loading), so they can run in
+# the worker's process pool and in offline tools such as quality_check.py.
+import os, io, time, threading
+from contextlib import contextmanager
+from PIL import Image, features
+
+# Fast path: JPEG DCT-domain scaling (draft) + integer reduce() before the final LANCZOS pass.
+FAST_RESIZE  = os.getenv("FAST_RESIZE", "1").lower() not in ("0", "false", "no", "off")
+REDUCING_GAP = float(os.getenv("REDUCING_GAP", "3.0"))   # keep >= this many times the target before the final filter
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "90"))
+# Decompression-bomb limit: sources with more pixels are refused before any pixel data is decoded.
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "100000000"))
+Image.MAX_IMAGE_PIXELS = None   # enforced by _open() instead, so header reads still see the real size
+
+# format name -> (Pillow format, file extension, Content-Type)
+FORMATS = {
+    "jpeg": ("JPEG", "jpg",  "image/jpeg"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "avif": ("AVIF", "avif", "image/avif"),
+    "png":  ("PNG",  "png",  "image/png"),
+}
+# encoder options accepted per format (anything else in a profile is ignored)
+_ENCODER_OPTIONS = {
+    "jpeg": ("quality", "progressive", "optimize", "subsampling"),
+    "webp": ("quality", "method", "lossless"),
+    "avif": ("quality", "speed", "subsampling"),
+    "png":  ("optimize", "compress_level"),
+}
+DEFAULT_FORMATS = [{"format": "jpeg", "quality": JPEG_QUALITY}]
+
+def format_supported(fmt):
+    if fmt not in FORMATS:
+        return False
+    Image.init()
+    if FORMATS[fmt][0] not in Image.SAVE:
+        return False
+    # WebP/AVIF encoders depend on how Pillow was built
+    return features.check(fmt) if fmt in ("webp", "avif") else True
+
+def normalize_formats(specs):
+    """Validate a list of format profiles; returns (usable, skipped_names).
+
+    Each profile is a dict like {"format": "webp", "quality": 80} or just a format name.
+    """
+    usable, skipped = [], []
+    for spec in specs or []:
+        spec = {"format": spec} if isinstance(spec, str) else dict(spec)
+        fmt = str(spec.get("format", "")).lower().replace("jpg", "jpeg")
+        if not format_supported(fmt) or any(u["format"] == fmt for u in usable):
+            skipped.append(fmt)
+            continue
+        opts = {k: spec[k] for k in _ENCODER_OPTIONS[fmt] if k in spec}
+        usable.append(dict(opts, format=fmt))
+    return usable, skipped
+
+class ImageTooLarge(Image.DecompressionBombError):
+    """The source has more than MAX_IMAGE_PIXELS pixels."""
+
+def check_pixels(w, h):
+    if MAX_IMAGE_PIXELS and w * h > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(f"{w}x{h} = {w * h} pixels exceeds MAX_IMAGE_PIXELS={MAX_IMAGE_PIXELS}")
+
+def _open(src):
+    # src: encoded bytes, or a path to a spooled original on local disk; only the header is read here
+    im = Image.open(src if isinstance(src, str) else io.BytesIO(src))
+    check_pixels(*im.size)
+    return im
+
+# size name -> {"width", "height", "fit"}; fit: width | height | box (fit inside width x height)
+DEFAULT_SIZE_PROFILES = {
+    "thumb":  {"width": 150,  "height": None, "fit": "width"},
+    "medium": {"width": 800,  "height": None, "fit": "width"},
+    "large":  {"width": 1600, "height": None, "fit": "width"},
+}
+FIT_MODES = ("width", "height", "box")
+# allow = scale small originals up; copy = render at native size once and S3-copy it for the larger
+# sizes; alias = render once and point the larger sizes' metadata at that object
+UPSCALE_POLICIES = ("allow", "copy", "alias")
+
+def parse_size_profiles(spec):
+    """Normalize {"name": 150 | {"width": .., "height": .., "fit": ..}} into DEFAULT_SIZE_PROFILES' shape.
+
+    Raises ValueError on an invalid entry.
+    """
+    out = {}
+    for name, p in (spec or {}).items():
+        if isinstance(p, (int, float)):
+            p = {"width": p}
+        if not isinstance(p, dict):
+            raise ValueError(f"Size '{name}': expected a width or an object, got {p!r}")
+        w, h = p.get("width"), p.get("height")
+        w = int(w) if w else None
+        h = int(h) if h else None
+        fit = p.get("fit") or ("box" if w and h else "height" if h else "width")
+        if fit not in FIT_MODES:
+            raise ValueError(f"Size '{name}': fit must be one of {FIT_MODES}, got {fit!r}")
+        if (fit in ("width", "box") and not w) or (fit in ("height", "box") and not h):
+            raise ValueError(f"Size '{name}': fit={fit} needs {'width and height' if fit == 'box' else fit}")
+        out[str(name)] = {"width": w, "height": h, "fit": fit}
+    return out
+
+def target_dims(size_name, src_w, src_h, profiles=None, upscale=True):
+    """Output (width, height) for `size_name`; with upscale=False never larger than the source."""
+    p = (profiles or DEFAULT_SIZE_PROFILES).get(size_name)
+    if p is None:
+        raise ValueError(f"Unknown size '{size_name}'")
+    if p["fit"] == "width":
+        scale = p["width"] / float(src_w)
+    elif p["fit"] == "height":
+        scale = p["height"] / float(src_h)
+    else:
+        scale = min(p["width"] / float(src_w), p["height"] / float(src_h))
+    if not upscale:
+        scale = min(scale, 1.0)
+    scale = max(1e-9, scale)
+    return max(1, int(round(src_w * scale))), max(1, int(round(src_h * scale)))
+
+def decode(data, target=None, fast=None):
+    """Decode `data` (encoded bytes or a file path) to RGB; returns (image, (header_w, header_h)).
+
+    With the fast path and a `target` size, JPEGs are DCT-scaled while decoding, by the largest
+    power of two that still leaves at least target * REDUCING_GAP pixels.
+    """
+    fast = FAST_RESIZE if fast is None else fast
+    im = _open(data)
+    size = im.size
+    if fast and target and REDUCING_GAP:
+        im.draft("RGB", (int(target[0] * REDUCING_GAP), int(target[1] * REDUCING_GAP)))
+    return im.convert("RGB"), size
+
+def resize(im, dims, fast=None):
+    fast = FAST_RESIZE if fast is None else fast
+    return im.resize(dims, Image.LANCZOS, reducing_gap=REDUCING_GAP if fast and REDUCING_GAP else None)
+
+def encode(im, spec=None):
+    spec = spec or DEFAULT_FORMATS[0]
+    opts = {k: v for k, v in spec.items() if k != "format"}
+    out = io.BytesIO()
+    im.save(out, format=FORMATS[spec["format"]][0], **opts)
+    return out.getvalue()
+
+def encode_all(im, formats=None):
+    return [(spec["format"], encode(im, spec)) for spec in (formats or DEFAULT_FORMATS)]
+
+def header_info(data):
+    """(width, height, mode, format) from the leading bytes of an image (or a file path), or None if the
+    header is incomplete/unknown. MAX_IMAGE_PIXELS is not applied here."""
+    try:
+        with Image.open(data if isinstance(data, str) else io.BytesIO(data)) as im:
+            return im.width, im.height, im.mode, im.format
+    except Exception:
+        return None
+
+def header_size(data):
+    """(width, height) from the leading bytes of an image, or None if the header is incomplete/unknown."""
+    info = header_info(data)
+    return info[:2] if info else None
+
+def _bytes_per_pixel(mode):
+    # Pillow keeps single-band 8-bit images at 1 byte per pixel, 16-bit at 2, everything else in 32-bit pixels
+    if mode in ("1", "L", "P"):
+        return 1
+    if mode.startswith("I;16"):
+        return 2
+    return 4
+
+def decode_memory(w, h, mode, fmt=None, target=None, fast=None):
+    """Estimated peak bytes to decode a w x h `mode` image and render `target` (the largest output) from it.
+
+    Counts the decoded pixels (DCT-scaled for JPEG on the fast path, as decode() does), the RGB copy when the
+    source is in another mode, and the largest output, which render_variants() holds while cutting the rest.
+    """
+    fast = FAST_RESIZE if fast is None else fast
+    scale = 1
+    if fast and target and REDUCING_GAP and fmt == "JPEG":
+        # draft() picks the largest power-of-two reduction (up to 1/8) that still leaves target * REDUCING_GAP
+        while (scale < 8 and w / (scale * 2) >= target[0] * REDUCING_GAP
+               and h / (scale * 2) >= target[1] * REDUCING_GAP):
+            scale *= 2
+    dw, dh = -(-w // scale), -(-h // scale)
+    total = dw * dh * _bytes_per_pixel(mode)
+    if mode != "RGB":
+        total += dw * dh * 4
+    if target:
+        total += target[0] * target[1] * 4
+    return total
+
+# -------- stage timings (collected by profiled()) --------
+_STAGES = threading.local()
+
+@contextmanager
+def _stage(name, size=None):
+    rec = getattr(_STAGES, "rec", None)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if rec is not None:
+            rec["stages"].append((name, size, time.perf_counter() - t0))
+
+def _source_pixels(w, h):
+    rec = getattr(_STAGES, "rec", None)
+    if rec is not None:
+        rec["pixels"] = w * h
+
+def profiled(fn, *args):
+    """Run fn(*args); returns (result, {"cpu": seconds, "pixels": source w*h, "stages": [(stage, size, seconds)]}).
+
+    Stages are the wall time of decode / resize / encode inside render_variant(s).
+    """
+    rec = _STAGES.rec = {"cpu": 0.0, "pixels": 0, "stages": []}
+    t0 = time.process_time()
+    try:
+        res = fn(*args)
+    finally:
+        rec["cpu"] = time.process_time() - t0
+        _STAGES.rec = None
+    return res, rec
+
+def render_variant(data, size_name, fast=None, formats=None, profiles=None, upscale=True):
+    """Returns (width, height, [(format, encoded_bytes), ...])."""
+    w, h = _open(data).size
+    _source_pixels(w, h)
+    tw, th = target_dims(size_name, w, h, profiles, upscale)
+    with _stage("decode", size_name):
+        im, _ = decode(data, (tw, th), fast)
+    with _stage("resize", size_name):
+        im = resize(im, (tw, th), fast)
+    with _stage("encode", size_name):
+        outputs = encode_all(im, formats)
+    return tw, th, outputs
+
+def render_variants(data, sizes, fast=None, formats_by_size=None, profiles=None, upscale_policy="allow"):
+    """Decode once and render `sizes` largest first, cascading each smaller size from the previous one.
+
+    Returns one dict per size in render order:
+      {"size", "width", "height", "outputs": [(format, encoded_bytes), ...], "error", "alias_of"}
+    Unless upscale_policy is "allow", sizes that would only upscale are capped at the source size,
+    and a size whose output would be identical to an earlier one is not rendered again: it comes
+    back with `alias_of` set and no outputs.
+    """
+    formats_by_size = formats_by_size or {}
+    upscale = upscale_policy == "allow"
+    w, h = _open(data).size
+    _source_pixels(w, h)
+
+    results, plan = [], []
+    for sz in dict.fromkeys(sizes):
+        try:
+            plan.append((sz, target_dims(sz, w, h, profiles, upscale)))
+        except ValueError as e:
+            results.append({"size": sz, "width": 0, "height": 0, "outputs": None, "error": str(e), "alias_of": None})
+    plan.sort(key=lambda p: p[1][0] * p[1][1], reverse=True)
+    if not plan:
+        return results
+
+    with _stage("decode", "all"):
+        im, _ = decode(data, plan[0][1], fast)
+    del data
+
+    rendered = {}   # (dims, formats) -> size name
+    prev = None
+    for size_name, (tw, th) in plan:
+        fmts = formats_by_size.get(size_name)
+        same = rendered.get(((tw, th), repr(fmts)))
+        if same and not upscale:
+            results.append({"size": size_name, "width": tw, "height": th, "outputs": None, "error": None, "alias_of": same})
+            continue
+        # Downscale from the previous variant only; upscaled renders go back to the original.
+        src = prev if prev is not None and tw <= prev.size[0] <= w else im
+        try:
+            with _stage("resize", size_name):
+                im_resized = resize(src, (tw, th), fast) if (tw, th) != src.size else src
+            with _stage("encode", size_name):
+                outputs = encode_all(im_resized, fmts)
+            results.append({"size": size_name, "width": tw, "height": th, "outputs": outputs,
+                            "error": None, "alias_of": None})
+            rendered[((tw, th), repr(fmts))] = size_name
+            prev = im_resized
+        except Exception as e:
+            results.append({"size": size_name, "width": tw, "height": th, "outputs": None, "error": repr(e), "alias_of": None})
+    return results
+
+def configure(fast_resize=None, reducing_gap=None, jpeg_quality=None, max_image_pixels=None):
+    """Change the resize/encoder settings of this process; None leaves a setting as it is."""
+    global FAST_RESIZE, REDUCING_GAP, JPEG_QUALITY, MAX_IMAGE_PIXELS
+    if fast_resize is not None:
+        FAST_RESIZE = bool(fast_resize)
+    if reducing_gap is not None:
+        REDUCING_GAP = float(reducing_gap)
+    if jpeg_quality is not None:
+        JPEG_QUALITY = int(jpeg_quality)
+        DEFAULT_FORMATS[0]["quality"] = JPEG_QUALITY
+    if max_image_pixels is not None:
+        MAX_IMAGE_PIXELS = int(max_image_pixels)
+
+def settings():
+    return {"fast_resize": FAST_RESIZE, "reducing_gap": REDUCING_GAP, "jpeg_quality": JPEG_QUALITY,
+            "max_image_pixels": MAX_IMAGE_PIXELS}
+
+def with_settings(opts, fn, *args):
+    """Apply `opts` (see configure) in this process, then run fn(*args); lets a pool worker follow live changes."""
+    configure(**opts)
+    return fn(*args)
+
+def cpu_timed(fn, *args):
+    """Run fn(*args) and return (result, CPU seconds spent in this process)."""
+    t0 = time.process_time()
+    res = fn(*args)
+    return res, time.process_time() - t0
@@ -0,0 +1,182 @@
+# In-process latency histograms (and a few gauges) for the resizer, exposed in Prometheus text format.
+#
+# Every observation is (stage, seconds) plus the labels queue / size / mp (source megapixels, bucketed).
+# Labels not given explicitly come from the per-thread message context set with context()/label(), so
+# helpers deep in a handler do not need the size or megapixels passed down to them.
+import time, logging, threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger("metrics")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LABELS = ("stage", "queue", "size", "mp")
+_MP_BOUNDS = ((1, "<1"), (4, "1-4"), (12, "4-12"), (24, "12-24"), (50, "24-50"))
+
+
+def mp_bucket(pixels):
+    """Megapixel band of a source image ("" when unknown)."""
+    if not pixels:
+        return ""
+    mp = pixels / 1e6
+    for bound, name in _MP_BOUNDS:
+        if mp < bound:
+            return name
+    return "50+"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # last slot: +Inf
+        self.total = 0.0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += seconds
+
+
+def _quantile(counts, q):
+    # upper bound of the bucket holding the q-th observation (good enough to spot the slow stage)
+    n = sum(counts)
+    if not n:
+        return 0.0
+    seen = 0
+    for i, c in enumerate(counts):
+        seen += c
+        if seen >= q * n:
+            return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+    return float("inf")
+
+
+class StageMetrics:
+    """Histogram registry keyed by (stage, queue, size, mp)."""
+
+    def __init__(self, prefix="resizer"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._hists = {}
+        self._gauges = {}  # name -> [help, {sorted label items: value}]
+        self._last = {}    # stage -> (counts, total) at the previous summary()
+        self._local = threading.local()
+        self._server = None
+
+    # -------- recording --------
+    @contextmanager
+    def context(self, **labels):
+        """Labels applied to every observation made on this thread until the block exits."""
+        prev = getattr(self._local, "labels", None)
+        self._local.labels = dict(prev or {}, **labels)
+        try:
+            yield self._local.labels
+        finally:
+            self._local.labels = prev
+
+    def label(self, **labels):
+        ctx = getattr(self._local, "labels", None)
+        if ctx is not None:
+            ctx.update(labels)
+
+    def observe(self, stage, seconds, **labels):
+        lab = dict(getattr(self._local, "labels", None) or {}, **labels)
+        key = (stage,) + tuple(str(lab.get(k) or "") for k in LABELS[1:])
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = Histogram()
+            h.observe(seconds)
+
+    def gauge(self, name, value, help="", **labels):
+        """Set `<prefix>_<name>{labels}` to `value` (last write wins)."""
+        with self._lock:
+            fam = self._gauges.setdefault(name, [help, {}])
+            fam[1][tuple(sorted(labels.items()))] = value
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0, **labels)
+
+    # -------- reporting --------
+    def render(self):
+        """Prometheus text exposition (the stage histogram family, then the gauges)."""
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {name} Wall-clock seconds per worker stage.", f"# TYPE {name} histogram"]
+        with self._lock:
+            items = sorted((k, list(h.counts), h.total) for k, h in self._hists.items())
+            gauges = sorted((g, fam[0], sorted(fam[1].items())) for g, fam in self._gauges.items())
+        for key, counts, total in items:
+            lab = ",".join(f'{k}="{v}"' for k, v in zip(LABELS, key) if v)
+            cum = 0
+            for bound, c in zip(BUCKETS + ("+Inf",), counts):
+                cum += c
+                lines.append(f'{name}_bucket{{{lab},le="{bound}"}} {cum}')
+            lines.append(f"{name}_sum{{{lab}}} {total:.6f}")
+            lines.append(f"{name}_count{{{lab}}} {cum}")
+        for g, help, series in gauges:
+            lines += [f"# HELP {self.prefix}_{g} {help}", f"# TYPE {self.prefix}_{g} gauge"]
+            for labels, value in series:
+                lab = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{self.prefix}_{g}{{{lab}}} {value:g}" if lab else f"{self.prefix}_{g} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, cumulative=False):
+        """Per-stage count, p50, p95 and mean since the previous call, e.g. for a heartbeat log line.
+
+        With cumulative=True: since startup, and the interval of the next regular call is left alone.
+        """
+        per_stage = {}
+        with self._lock:
+            for key, h in self._hists.items():
+                counts, total = per_stage.setdefault(key[0], ([0] * len(h.counts), [0.0]))
+                for i, c in enumerate(h.counts):
+                    counts[i] += c
+                total[0] += h.total
+        parts = []
+        for stage in sorted(per_stage):
+            counts, total = per_stage[stage]
+            prev_counts, prev_total = ([0] * len(counts), 0.0)
+            if not cumulative:
+                prev_counts, prev_total = self._last.get(stage, (prev_counts, prev_total))
+                self._last[stage] = (list(counts), total[0])
+            window = [c - p for c, p in zip(counts, prev_counts)]
+            n = sum(window)
+            if n:
+                parts.append(f"{stage}(n={n} p50<={_quantile(window, 0.5):g}s p95<={_quantile(window, 0.95):g}s "
+                             f"avg={(total[0] - prev_total) / n:.3f}s)")
+        return " stages: " + " ".join(parts) if parts else ""
+
+    # -------- HTTP endpoint --------
+    def serve(self, port, host="0.0.0.0"):
+        """Serve GET /metrics on a daemon thread; returns the bound port."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
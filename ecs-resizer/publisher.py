@@ -0,0 +1,181 @@
+# Buffered, batched event publisher for SQS and Kinesis.
+#
+# Shared by ecs-resizer/ and lambda-uploader/ (each deployable ships its own copy);
+# keep ecs-resizer/publisher.py and lambda-uploader/publisher.py identical.
+import json, time, logging, threading
+from concurrent.futures import Future
+
+log = logging.getLogger("publisher")
+
+SQS_MAX_ENTRIES     = 10
+SQS_MAX_BYTES       = 256 * 1024
+KINESIS_MAX_RECORDS = 500
+KINESIS_MAX_BYTES   = 5 * 1024 * 1024
+
+
+class PublishError(Exception):
+    pass
+
+
+class EventPublisher:
+    """Buffers SQS messages and Kinesis records and sends them with send_message_batch / put_records.
+
+    A buffer is flushed when it reaches the service batch limit (entries or bytes), once its
+    oldest entry is `max_delay` seconds old (background thread, started lazily on the first
+    event when `background=True`), or on an explicit flush()/close(). Only the entries that
+    failed in a partial-failure response are retried, up to `max_attempts` sends in total.
+
+    send_message()/put_record() return a Future resolved with the MessageId/SequenceNumber, so
+    callers that must not lose an event (e.g. before deleting the message that produced it) can
+    wait on it while others fire and forget.
+    """
+
+    def __init__(self, sqs=None, kinesis=None, max_delay=0.05, max_attempts=4, background=True):
+        self._sqs = sqs
+        self._kin = kinesis
+        self.max_delay = max_delay
+        self.max_attempts = max(1, max_attempts)
+        self._cond = threading.Condition()
+        self._buffers = {}   # (kind, target) -> {"entries": [...], "bytes": int, "since": monotonic}
+        self._closed = False
+        self._background = background
+        self._thread = None
+        self.stats = {"sent": 0, "failed": 0, "calls": 0, "retries": 0}
+
+    # -------- public API --------
+    def send_message(self, queue_url, body, **extra):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        entry = dict(extra, MessageBody=body)
+        return self._add("sqs", queue_url, entry, len(body.encode("utf-8")))
+
+    def put_record(self, stream, partition_key, data):
+        if not isinstance(data, (str, bytes)):
+            data = json.dumps(data)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        entry = {"PartitionKey": str(partition_key), "Data": data}
+        return self._add("kinesis", stream, entry, len(data) + len(entry["PartitionKey"]))
+
+    def flush(self):
+        with self._cond:
+            keys = list(self._buffers)
+        for key in keys:
+            self._flush_key(key)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    # -------- buffering --------
+    def _limits(self, kind):
+        return (SQS_MAX_ENTRIES, SQS_MAX_BYTES) if kind == "sqs" else (KINESIS_MAX_RECORDS, KINESIS_MAX_BYTES)
+
+    def _add(self, kind, target, entry, nbytes):
+        fut = Future()
+        max_n, max_b = self._limits(kind)
+        ready = []
+        with self._cond:
+            if self._background and self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="publisher", daemon=True)
+                self._thread.start()
+            key = (kind, target)
+            buf = self._buffers.get(key)
+            if buf and buf["bytes"] + nbytes > max_b:
+                ready.append(self._buffers.pop(key))
+                buf = None
+            if buf is None:
+                buf = self._buffers[key] = {"entries": [], "bytes": 0, "since": time.monotonic()}
+            buf["entries"].append((entry, fut))
+            buf["bytes"] += nbytes
+            if len(buf["entries"]) >= max_n:
+                ready.append(self._buffers.pop(key))
+            else:
+                self._cond.notify_all()
+        for b in ready:
+            self._send(kind, target, b["entries"])
+        return fut
+
+    def _flush_key(self, key):
+        with self._cond:
+            buf = self._buffers.pop(key, None)
+        if buf:
+            self._send(key[0], key[1], buf["entries"])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = [k for k, b in self._buffers.items() if now - b["since"] >= self.max_delay]
+                if not due:
+                    oldest = min((b["since"] for b in self._buffers.values()), default=None)
+                    self._cond.wait(None if oldest is None else max(0.0, oldest + self.max_delay - now))
+                    continue
+            for key in due:
+                try:
+                    self._flush_key(key)
+                except Exception as e:
+                    log.warning("Publisher flush failed for %s: %s", key, e)
+
+    # -------- sending --------
+    def _send(self, kind, target, entries):
+        pending = list(entries)
+        attempt = 0
+        while pending:
+            attempt += 1
+            try:
+                failed = self._send_sqs(target, pending) if kind == "sqs" else self._send_kinesis(target, pending)
+            except Exception as e:
+                failed = [(entry, fut, str(e), True) for entry, fut in pending]
+            retryable = [(entry, fut) for entry, fut, _, can_retry in failed if can_retry]
+            for entry, fut, err, can_retry in failed:
+                if not can_retry or attempt >= self.max_attempts:
+                    self.stats["failed"] += 1
+                    log.warning("Publish to %s '%s' failed after %d attempt(s): %s", kind, target, attempt, err)
+                    fut.set_exception(PublishError(err))
+            if attempt >= self.max_attempts or not retryable:
+                return
+            self.stats["retries"] += len(retryable)
+            pending = retryable
+            time.sleep(min(1.0, 0.05 * (2 ** (attempt - 1))))
+
+    def _send_sqs(self, queue_url, pending):
+        self.stats["calls"] += 1
+        resp = self._sqs.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[dict(entry, Id=str(i)) for i, (entry, _) in enumerate(pending)],
+        )
+        ok = {s["Id"]: s for s in resp.get("Successful", [])}
+        bad = {f["Id"]: f for f in resp.get("Failed", [])}
+        failed = []
+        for i, (entry, fut) in enumerate(pending):
+            if str(i) in ok:
+                self.stats["sent"] += 1
+                fut.set_result(ok[str(i)].get("MessageId"))
+            else:
+                f = bad.get(str(i), {})
+                failed.append((entry, fut, f.get("Message") or f.get("Code") or "not acknowledged",
+                               not f.get("SenderFault", False)))
+        return failed
+
+    def _send_kinesis(self, stream, pending):
+        self.stats["calls"] += 1
+        resp = self._kin.put_records(StreamName=stream, Records=[entry for entry, _ in pending])
+        records = resp.get("Records", [])
+        failed = []
+        for i, (entry, fut) in enumerate(pending):
+            rec = records[i] if i < len(records) else None
+            if rec is None:
+                failed.append((entry, fut, "no result returned", True))
+            elif rec.get("ErrorCode"):
+                failed.append((entry, fut, f"{rec['ErrorCode']}: {rec.get('ErrorMessage', '')}", True))
+            else:
+                self.stats["sent"] += 1
+                fut.set_result(rec.get("SequenceNumber"))
+        return failed
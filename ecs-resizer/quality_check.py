@@ -0,0 +1,72 @@
+# Compare the fast resize path (JPEG draft + reducing_gap) with the full-resolution LANCZOS path.
+#
+# Usage:
+#   python quality_check.py                       # synthetic originals
+#   python quality_check.py photo1.jpg photo2.jpg # your own originals
+#   MIN_PSNR=38 python quality_check.py ...
+#
+# For every original and size it reports the CPU time of both paths and the PSNR of the fast
+# output against the current output; exits 1 if any variant falls below MIN_PSNR (dB).
+import os, io, sys, math, time
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+import imaging
+
+MIN_PSNR = float(os.getenv("MIN_PSNR", "35"))
+SIZES    = [s.strip() for s in os.getenv("SIZES", "thumb,medium,large").split(",") if s.strip()]
+
+def synthetic_image(w, h, seed=0):
+    # Smooth gradients + sensor-like noise + hard edges, roughly what a photo stresses in a resampler.
+    base = Image.linear_gradient("L").resize((w, h))
+    noise = Image.effect_noise((w, h), 24 + seed)
+    im = Image.merge("RGB", (base, noise, base.transpose(Image.FLIP_LEFT_RIGHT)))
+    d = ImageDraw.Draw(im)
+    for i in range(12):
+        x, y = (i * 7919 + seed) % w, (i * 104729 + seed) % h
+        d.ellipse((x, y, x + w // 8, y + h // 8), outline=(255, 255 - i * 20, i * 20), width=max(2, w // 400))
+        d.line((0, y, w, (y * 3) % h), fill=(i * 20, 0, 255), width=max(1, w // 1000))
+    return im
+
+def synthetic_jpeg(w, h, seed=0):
+    out = io.BytesIO()
+    synthetic_image(w, h, seed).save(out, format="JPEG", quality=92)
+    return out.getvalue()
+
+def psnr(a_bytes, b_bytes):
+    a = Image.open(io.BytesIO(a_bytes)).convert("RGB")
+    b = Image.open(io.BytesIO(b_bytes)).convert("RGB")
+    if a.size != b.size:
+        b = b.resize(a.size, Image.LANCZOS)
+    mse = sum(v ** 2 for v in ImageStat.Stat(ImageChops.difference(a, b)).rms) / 3.0
+    return float("inf") if mse == 0 else 10 * math.log10(255.0 ** 2 / mse)
+
+def timed(fn, *args):
+    t0 = time.process_time()
+    res = fn(*args)
+    return res, time.process_time() - t0
+
+def main(paths):
+    if paths:
+        originals = [(p, open(p, "rb").read()) for p in paths]
+    else:
+        originals = [(f"synthetic {w}x{h}", synthetic_jpeg(w, h, i))
+                     for i, (w, h) in enumerate([(6000, 4000), (4000, 3000), (3000, 4000), (1200, 800)])]
+
+    worst = float("inf")
+    total_slow = total_fast = 0.0
+    print(f"{'original':<24} {'size':<8} {'slow cpu':>9} {'fast cpu':>9} {'psnr dB':>8}")
+    for name, data in originals:
+        for size_name in SIZES:
+            (_, _, slow), t_slow = timed(imaging.render_variant, data, size_name, False)
+            (_, _, fast), t_fast = timed(imaging.render_variant, data, size_name, True)
+            q = psnr(slow[0][1], fast[0][1])
+            worst = min(worst, q)
+            total_slow += t_slow; total_fast += t_fast
+            print(f"{name:<24} {size_name:<8} {t_slow:>8.3f}s {t_fast:>8.3f}s {q:>8.2f}")
+
+    print(f"total cpu: slow={total_slow:.3f}s fast={total_fast:.3f}s "
+          f"({(1 - total_fast / total_slow) * 100 if total_slow else 0:.0f}% less); worst PSNR={worst:.2f} dB (min {MIN_PSNR})")
+    return 0 if worst >= MIN_PSNR else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
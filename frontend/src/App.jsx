@@ -21,6 +21,22 @@ export default function App() {
     return res.json()
   }
 
+  // Poll the status endpoint until every requested size exists. The browser revalidates with the ETag,
+  // so unchanged polls are answered with 304s instead of CloudFront 404s.
+  async function waitForVariants(imageId) {
+    for (;;) {
+      const res = await fetch(`${CONFIG.API_BASE}/images/${imageId}/status`)
+      if (!res.ok) throw new Error(`Status failed: ${res.status}`)
+      const image = await res.json()
+
+      if (image.status === 'FAILED') throw new Error(`Processing failed: ${image.failure?.reason || 'unknown'}`)
+      setStatus(`Processing... ${image.requestedSizes.length - image.pending.length}/${image.requestedSizes.length} sizes ready`)
+      if (image.status === 'PROCESSED') return image
+
+      await new Promise(r => setTimeout(r, 2000))
+    }
+  }
+
   async function uploadToS3(presigned, file) {
     setStatus('Uploading to S3...')
 
@@ -44,17 +60,19 @@ export default function App() {
 
       const preferredSizes = (e.target.elements.sizes.value || 'thumb,medium,large')
         .split(',').map(s => s.trim()).filter(Boolean)
-      const { imageId, upload, sizes } = await initUpload(preferredSizes)
+      const { imageId, upload } = await initUpload(preferredSizes)
 
       setImageId(imageId)
 
       await uploadToS3(upload, file)
 
-      setStatus('Uploaded! Variants will appear after processing.')
+      setStatus('Uploaded! Waiting for variants...')
 
+      const image = await waitForVariants(imageId)
       const cf = CONFIG.CLOUDFRONT_DOMAIN.replace(/^https?:\/\//, '')
-      const urls = sizes.map(s => `https://${cf}/images/${imageId}/${s}.jpg`)
+      const urls = image.requestedSizes.map(s => `https://${cf}/${image.variants[s].key}`)
 
+      setStatus('Processed!')
       setLinks(urls)
     } catch (err) {
       console.error(err)
@@ -81,7 +99,7 @@ export default function App() {
       {imageId && <p><b>imageId:</b> {imageId}</p>}
       {!!links.length && (
         <div>
-          <h3>CloudFront Links (may 404 until processed):</h3>
+          <h3>CloudFront Links:</h3>
           <ul>
             {links.map(u => <li key={u}><a href={u} target="_blank">{u}</a></li>)}
           </ul>
@@ -23,8 +23,12 @@ module "appconfig_data" {
     ddb_table_metadata  = var.table_name
     ingest_queue_url    = module.queues.ingest_queue_url
     resize_queue_url    = module.queues.resize_queue_url
+    priority_queue_url  = module.queues.priority_queue_url
+    priority_sizes      = ["thumb"]
     region              = var.aws_region
     default_sizes       = ["thumb", "medium", "large"]
+    size_profiles       = var.size_profiles
+    upscale_policy      = "copy"
     kinesis_stream_name = ""
   })
 }
@@ -47,4 +51,6 @@ module "ecs" {
   ingest_queue_url = module.queues.ingest_queue_url
   resize_queue_arn = module.queues.resize_queue_arn
   resize_queue_url = module.queues.resize_queue_url
+
+  priority_queue_arn = module.queues.priority_queue_arn
 }
@@ -41,3 +41,7 @@ variable "appconfig_application_id" {
 variable "appconfig_environment_id" {
   type = string
 }
+
+variable "size_profiles" {
+  type = any
+}
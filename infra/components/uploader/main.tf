@@ -30,7 +30,11 @@ module "appconfig_data" {
   appconfig_application_id = module.appconfig.application_id
   appconfig_environment_id = module.appconfig.environment_id
   profile_name             = local.profile_name
-  config_json = jsonencode({
+  config_json              = jsonencode(local.uploader_config)
+}
+
+locals {
+  uploader_config = {
     bucket_name         = module.bucket.name
     ddb_table_metadata  = module.table.name
     kinesis_stream_name = ""
@@ -38,7 +42,8 @@ module "appconfig_data" {
     url_expiry_seconds  = local.url_expiry
     max_size_mb         = local.max_size_mb
     default_sizes       = local.default_sizes
-  })
+    size_profiles       = var.size_profiles
+  }
 }
 
 resource "aws_iam_policy" "ddb_write" {
@@ -46,7 +51,7 @@ resource "aws_iam_policy" "ddb_write" {
   policy = jsonencode({
     Version = "2012-10-17",
     Statement = [
-      { Effect = "Allow", Action = ["dynamodb:PutItem", "dynamodb:UpdateItem", "dynamodb:GetItem"], Resource = module.table.arn }
+      { Effect = "Allow", Action = ["dynamodb:PutItem", "dynamodb:BatchWriteItem", "dynamodb:UpdateItem", "dynamodb:GetItem", "dynamodb:BatchGetItem"], Resource = module.table.arn }
     ]
   })
 }
@@ -64,6 +69,8 @@ module "lambda" {
     APPCONFIG_ENVIRONMENT = module.appconfig.environment_name
     APPCONFIG_PROFILE     = module.appconfig_data.profile_name
     REGION                = var.aws_region
+    # served on a cold start while the AppConfig document is fetched in the background
+    CONFIG_DEFAULT_JSON = jsonencode(local.uploader_config)
   }
 }
 
@@ -73,11 +80,15 @@ resource "aws_iam_role_policy_attachment" "lambda_ddb" {
 }
 
 module "api" {
-  source         = "../../modules/apigw_http_lambda"
-  name_prefix    = var.name_prefix
-  lambda_arn     = module.lambda.function_arn
-  allowed_origin = var.allowed_origin
-  route_key      = "POST /images/init-upload"
+  source           = "../../modules/apigw_http_lambda"
+  name_prefix      = var.name_prefix
+  lambda_arn       = module.lambda.function_arn
+  allowed_origin   = var.allowed_origin
+  route_key        = "POST /images/init-upload"
+  extra_route_keys = [
+    "GET /images/status",
+    "GET /images/{id}/status",
+  ]
 }
 
 # Allow the uploader Lambda to sign presigned POSTs that PUT to your bucket
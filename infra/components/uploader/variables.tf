@@ -14,3 +14,7 @@ variable "lambda_zip" {
   type    = string
   default = "./artifacts/lambda-uploader.zip"
 }
+
+variable "size_profiles" {
+  type = any
+}
@@ -3,6 +3,7 @@ module "uploader" {
   name_prefix    = var.name_prefix
   aws_region     = var.aws_region
   allowed_origin = var.allowed_origin
+  size_profiles  = var.size_profiles
 }
 
 module "resizer" {
@@ -15,6 +16,7 @@ module "resizer" {
   table_name                 = module.uploader.ddb_table_name
   table_arn                  = module.uploader.ddb_table_arn
   worker_image               = var.worker_image
+  size_profiles              = var.size_profiles
   appconfig_application_name = module.uploader.appconfig_application_name
   appconfig_application_id   = module.uploader.appconfig_application_id
   appconfig_environment_id   = module.uploader.appconfig_environment_id
@@ -10,6 +10,12 @@ variable "route_key" {
   default = "POST /images/init-upload"
 }
 
+# More routes served by the same Lambda, e.g. ["GET /images/status"]
+variable "extra_route_keys" {
+  type    = list(string)
+  default = []
+}
+
 variable "allowed_origin" {
   type    = string
   default = "*"
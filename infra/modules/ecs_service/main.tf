@@ -31,11 +31,12 @@ resource "aws_iam_policy" "task" {
     Statement = [
       { Effect = "Allow", Action = [
         "sqs:ReceiveMessage", "sqs:DeleteMessage", "sqs:GetQueueAttributes", "sqs:ChangeMessageVisibility", "sqs:SendMessage"
-      ], Resource = [var.ingest_queue_arn, var.resize_queue_arn] },
-      { Effect = "Allow", Action = ["s3:GetObject", "s3:HeadObject", "s3:PutObject"], Resource = "${var.bucket_arn}/*" },
-      { Effect = "Allow", Action = ["dynamodb:UpdateItem", "dynamodb:GetItem"], Resource = var.table_arn },
+      ], Resource = compact([var.ingest_queue_arn, var.resize_queue_arn, var.priority_queue_arn]) },
+      { Effect = "Allow", Action = ["s3:GetObject", "s3:HeadObject", "s3:PutObject", "s3:DeleteObject"], Resource = "${var.bucket_arn}/*" },
+      { Effect = "Allow", Action = ["dynamodb:UpdateItem", "dynamodb:GetItem", "dynamodb:PutItem"], Resource = var.table_arn },
       { Effect = "Allow", Action = ["appconfig:StartConfigurationSession", "appconfig:GetLatestConfiguration"], Resource = "*" },
-      { Effect = "Allow", Action = ["logs:CreateLogStream", "logs:PutLogEvents"], Resource = "*" }
+      { Effect = "Allow", Action = ["logs:CreateLogStream", "logs:PutLogEvents"], Resource = "*" },
+      { Effect = "Allow", Action = ["ecs:DescribeServices"], Resource = "*" }
     ]
   })
 }
@@ -94,7 +95,12 @@ resource "aws_ecs_task_definition" "this" {
         { name = "APPCONFIG_APPLICATION", value = var.appconfig_app },
         { name = "APPCONFIG_ENVIRONMENT", value = var.appconfig_env },
         { name = "APPCONFIG_PROFILE", value = var.appconfig_profile },
-        { name = "AWS_REGION", value = var.region }
+        { name = "AWS_REGION", value = var.region },
+        { name = "ECS_CLUSTER", value = "${var.name_prefix}-cluster" },
+        { name = "ECS_SERVICE", value = "${var.name_prefix}-svc" },
+        { name = "SCALE_TARGET_SECONDS", value = tostring(var.scale_target_seconds) },
+        { name = "SCALE_MIN_WORKERS", value = tostring(var.min_workers) },
+        { name = "SCALE_MAX_WORKERS", value = tostring(var.max_workers) }
       ]
       dependsOn = [{ containerName = "appconfig", condition = "START" }]
       logConfiguration = {
@@ -122,4 +128,43 @@ resource "aws_ecs_service" "this" {
   }
   deployment_minimum_healthy_percent = 0
   deployment_maximum_percent         = 200
+
+  # the task count is owned by the scaling policy below
+  lifecycle {
+    ignore_changes = [desired_count]
+  }
+}
+
+# Scale on the worker's own backlog signal: BacklogPerWorker is the queued work (worker-seconds, from the measured
+# time per message) divided by the running tasks; keeping it at scale_target_seconds drains any backlog in that time.
+resource "aws_appautoscaling_target" "this" {
+  service_namespace  = "ecs"
+  resource_id        = "service/${aws_ecs_cluster.this.name}/${aws_ecs_service.this.name}"
+  scalable_dimension = "ecs:service:DesiredCount"
+  min_capacity       = var.min_workers
+  max_capacity       = var.max_workers
+}
+
+resource "aws_appautoscaling_policy" "backlog" {
+  name               = "${var.name_prefix}-backlog-per-worker"
+  policy_type        = "TargetTrackingScaling"
+  service_namespace  = aws_appautoscaling_target.this.service_namespace
+  resource_id        = aws_appautoscaling_target.this.resource_id
+  scalable_dimension = aws_appautoscaling_target.this.scalable_dimension
+
+  target_tracking_scaling_policy_configuration {
+    target_value       = var.scale_target_seconds
+    scale_out_cooldown = 60
+    scale_in_cooldown  = 300
+
+    customized_metric_specification {
+      namespace   = "ImagePipeline/Resizer"
+      metric_name = "BacklogPerWorker"
+      statistic   = "Average"
+      dimensions {
+        name  = "Service"
+        value = aws_ecs_service.this.name
+      }
+    }
+  }
 }
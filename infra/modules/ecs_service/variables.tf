@@ -53,3 +53,24 @@ variable "resize_queue_arn" {
 variable "resize_queue_url" {
   type = string
 }
+
+variable "priority_queue_arn" {
+  type    = string
+  default = ""
+}
+
+variable "min_workers" {
+  type    = number
+  default = 1
+}
+
+variable "max_workers" {
+  type    = number
+  default = 10
+}
+
+# Target drain time of the backlog, in seconds (the BacklogPerWorker target)
+variable "scale_target_seconds" {
+  type    = number
+  default = 120
+}
@@ -18,6 +18,13 @@ resource "aws_sqs_queue" "resize" {
   receive_wait_time_seconds  = 20
 }
 
+# Priority lane: small first-paint sizes (priority_sizes), drained ahead of the resize queue
+resource "aws_sqs_queue" "priority" {
+  name                       = "${var.name_prefix}-resizer-priority"
+  visibility_timeout_seconds = 180
+  receive_wait_time_seconds  = 20
+}
+
 resource "aws_sqs_queue_policy" "ingest" {
   queue_url = aws_sqs_queue.ingest.id
   policy = jsonencode({
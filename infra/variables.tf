@@ -26,6 +26,17 @@ variable "allowed_origin" {
   default = "http://localhost:5173"
 }
 
+# Size registry shared by the uploader (name validation) and the resizer (rendering).
+# fit: width | height | box (inside width x height)
+variable "size_profiles" {
+  type = any
+  default = {
+    thumb  = { width = 150, fit = "width" }
+    medium = { width = 800, fit = "width" }
+    large  = { width = 1600, fit = "width" }
+  }
+}
+
 variable "worker_image" {
   type = string
 }
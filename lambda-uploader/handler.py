@@ -1,11 +1,32 @@
-import os, json, uuid, time
+import os, re, json, uuid, time, hashlib, threading
+_T0 = time.perf_counter()
 import boto3
 import urllib.request
 
+from collections import OrderedDict
+from publisher import EventPublisher
+
 _CONFIG = None
+_CONFIG_AT = 0.0        # wall-clock time the current config was loaded
 _S3 = None
 _DDB = None
 _KIN = None
+_PUB = None
+_PUB_REGION = None
+_CLIENTS = {}           # (service, region) -> boto3 client, built on first use
+_REFRESH_LOCK = threading.Lock()
+_REFRESHING = False
+_STATUS_CACHE = OrderedDict()   # imageId -> (expires_at, status view or None); lives as long as the warm container
+
+CONFIG_TTL_SECONDS = float(os.getenv("CONFIG_TTL_SECONDS", "60"))
+CONFIG_SNAPSHOT_PATH = os.getenv("CONFIG_SNAPSHOT_PATH", "/tmp/uploader-config.json")
+CONFIG_DEFAULT_JSON = os.getenv("CONFIG_DEFAULT_JSON", "")   # config document set at deploy time (same keys as AppConfig)
+APPCONFIG_TIMEOUT_SECONDS = float(os.getenv("APPCONFIG_TIMEOUT_SECONDS", "1.5"))
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "ImagePipeline/Uploader")
+STATUS_CACHE_SECONDS = float(os.getenv("STATUS_CACHE_SECONDS", "2"))          # images still being processed
+STATUS_FINAL_CACHE_SECONDS = float(os.getenv("STATUS_FINAL_CACHE_SECONDS", "60"))  # PROCESSED / FAILED
+STATUS_CACHE_MAX = int(os.getenv("STATUS_CACHE_MAX", "5000"))
+MAX_STATUS_IDS = int(os.getenv("MAX_STATUS_IDS", "100"))
 
 # ---------------- AppConfig (Lambda Extension) ----------------
 def load_appconfig_extension():
@@ -25,7 +46,7 @@ def load_appconfig_extension():
     url = f"http://localhost:2772/applications/{app}/environments/{env}/configurations/{profile}"
 
     try:
-        with urllib.request.urlopen(url, timeout=1.5) as r:
+        with urllib.request.urlopen(url, timeout=APPCONFIG_TIMEOUT_SECONDS) as r:
             return json.loads(r.read().decode("utf-8"))
     except Exception as e:
         print("Error getting AppConfig parameters: ", e)
@@ -39,7 +60,7 @@ def load_ssm_config():
     if not path:
         return {}
 
-    ssm = boto3.client("ssm", region_name=region)
+    ssm = _client("ssm", region)
     params = {}
     next_token = None
 
@@ -66,8 +87,11 @@ def load_ssm_config():
     }
     mapped["URL_EXPIRY_SECONDS"] = int(params.get("url_expiry_seconds", os.getenv("URL_EXPIRY_SECONDS", "900")))
     mapped["MAX_SIZE_MB"] = int(params.get("max_size_mb", os.getenv("MAX_SIZE_MB", "25")))
+    mapped["MAX_BATCH_UPLOADS"] = int(params.get("max_batch_uploads", os.getenv("MAX_BATCH_UPLOADS", "50")))
     default_sizes = params.get("default_sizes", os.getenv("DEFAULT_SIZES", "thumb,medium,large"))
     mapped["DEFAULT_SIZES"] = [s.strip() for s in default_sizes.split(",") if s.strip()]
+    if params.get("size_profiles"):
+        mapped["SIZE_PROFILES"] = json.loads(params["size_profiles"])
 
     return mapped
 
@@ -90,8 +114,15 @@ def normalize(cfg):
         sizes = [s.strip() for s in sizes.split(",") if s.strip()]
 
     out["DEFAULT_SIZES"] = sizes if isinstance(sizes, list) else ["thumb","medium","large"]
+
+    # Size registry shared with the resizer (same `size_profiles` AppConfig key); only the names matter here.
+    profiles = cfg.get("size_profiles") or cfg.get("SIZE_PROFILES") or os.getenv("SIZE_PROFILES") or {}
+    if isinstance(profiles, str):
+        profiles = json.loads(profiles)
+    out["SIZE_NAMES"] = sorted(profiles) if profiles else ["large", "medium", "thumb"]
     out["URL_EXPIRY_SECONDS"] = to_int(cfg.get("url_expiry_seconds") or cfg.get("URL_EXPIRY_SECONDS") or 900, 900)
     out["MAX_SIZE_MB"] = to_int(cfg.get("max_size_mb") or cfg.get("MAX_SIZE_MB") or 25, 25)
+    out["MAX_BATCH_UPLOADS"] = to_int(cfg.get("max_batch_uploads") or cfg.get("MAX_BATCH_UPLOADS") or 50, 50)
 
     # Env overrides always win
     env_overrides = {
@@ -101,6 +132,7 @@ def normalize(cfg):
         "REGION": os.getenv("REGION"),
         "URL_EXPIRY_SECONDS": os.getenv("URL_EXPIRY_SECONDS"),
         "MAX_SIZE_MB": os.getenv("MAX_SIZE_MB"),
+        "MAX_BATCH_UPLOADS": os.getenv("MAX_BATCH_UPLOADS"),
         "DEFAULT_SIZES": os.getenv("DEFAULT_SIZES"),
     }
 
@@ -116,45 +148,207 @@ def normalize(cfg):
     if missing:
         raise RuntimeError(f"Missing required config: {missing}. Provide via AppConfig (preferred) or environment variables.")
 
+    unknown = [s for s in out["DEFAULT_SIZES"] if s not in out["SIZE_NAMES"]]
+    if unknown:
+        raise RuntimeError(f"default_sizes {unknown} are not defined in size_profiles {out['SIZE_NAMES']}.")
+
     return out
 
-def load_config():
+def load_config(timings=None):
     # Order: AppConfig(Extension) -> SSM by path (optional) -> ENV defaults
+    timings = {} if timings is None else timings
     cfg = {}
+    t = time.perf_counter()
     appcfg = load_appconfig_extension()
+    timings["appconfig_ms"] = _ms_since(t)
 
     print("AppConfig JSON: ", appcfg)
 
     if appcfg:
         cfg.update(appcfg)
+        timings["source"] = "appconfig"
 
     if not cfg:
+        t = time.perf_counter()
         ssm_cfg = load_ssm_config()
+        timings["ssm_ms"] = _ms_since(t)
         if ssm_cfg:
             cfg.update(ssm_cfg)
+            timings["source"] = "ssm"
 
+    timings.setdefault("source", "env")
     return normalize(cfg)
 
-def clients(region):
-    s3 = boto3.client("s3", region_name=region)
-    ddb = boto3.client("dynamodb", region_name=region)
-    kin = boto3.client("kinesis", region_name=region)
+def _ms_since(t):
+    return round((time.perf_counter() - t) * 1000, 1)
+
+def _client(service, region):
+    """boto3 client, created on first use and reused for the life of the container."""
+    key = (service, region)
+    c = _CLIENTS.get(key)
+    if c is None:
+        c = _CLIENTS[key] = boto3.client(service, region_name=region)
+    return c
+
+def use_clients(region, **by_service):
+    """Register ready-made clients, e.g. use_clients("us-east-1", s3=..., dynamodb=...) with local stand-ins."""
+    for service, c in by_service.items():
+        _CLIENTS[(service, region)] = c
+
+def clients(region, with_kinesis=True):
+    s3 = _client("s3", region)
+    ddb = _client("dynamodb", region)
+    kin = _client("kinesis", region) if with_kinesis else None
 
     return s3, ddb, kin
 
-def lambda_handler(event, context):
-    global _CONFIG, _S3, _DDB, _KIN
+# ---------------- Config snapshot & background refresh ----------------
+_SNAPSHOT_KEYS = ("BUCKET_NAME", "DDB_TABLE_METADATA", "REGION", "DEFAULT_SIZES", "SIZE_NAMES",
+                  "URL_EXPIRY_SECONDS", "MAX_SIZE_MB", "MAX_BATCH_UPLOADS")
+
+def _read_snapshot():
+    """Last-known-good config written by a previous load; ({}, 0) if there is none."""
+    try:
+        with open(CONFIG_SNAPSHOT_PATH) as f:
+            snap = json.load(f)
+        cfg = snap["config"]
+        if not all(cfg.get(k) for k in _SNAPSHOT_KEYS):
+            return {}, 0.0
+        return cfg, float(snap.get("loaded_at", 0))
+    except Exception:
+        return {}, 0.0
+
+def _default_config():
+    """CONFIG_DEFAULT_JSON as a normalized config; {} if it is unset or incomplete."""
+    if not CONFIG_DEFAULT_JSON:
+        return {}
+    try:
+        cfg = normalize(json.loads(CONFIG_DEFAULT_JSON))
+    except Exception as e:
+        print("Ignoring CONFIG_DEFAULT_JSON: ", e)
+        return {}
+    return cfg if all(cfg.get(k) for k in _SNAPSHOT_KEYS) else {}
+
+def _write_snapshot(cfg, loaded_at):
+    tmp = f"{CONFIG_SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump({"loaded_at": loaded_at, "config": cfg}, f)
+        os.replace(tmp, CONFIG_SNAPSHOT_PATH)
+    except Exception as e:
+        print("Could not write config snapshot: ", e)
 
-    if _CONFIG is None:
-        _CONFIG = load_config()
-        _S3, _DDB, _KIN = clients(_CONFIG["REGION"])
+def _refresh_config():
+    """Reload config and swap it in; on any failure keep serving the current one."""
+    global _CONFIG, _CONFIG_AT, _REFRESHING
+    try:
+        cfg = load_config()
+        _CONFIG, _CONFIG_AT = cfg, time.time()
+        _write_snapshot(cfg, _CONFIG_AT)
+    except Exception as e:
+        print("Config refresh failed, keeping last-known-good config: ", e)
+    finally:
+        with _REFRESH_LOCK:
+            _REFRESHING = False
+
+def _maybe_refresh():
+    # The thread only runs while an invocation is active (the container is frozen in between), so a
+    # refresh started near the end of one invocation completes during the next one.
+    global _REFRESHING
+    if time.time() - _CONFIG_AT < CONFIG_TTL_SECONDS:
+        return
+    with _REFRESH_LOCK:
+        if _REFRESHING:
+            return
+        _REFRESHING = True
+    threading.Thread(target=_refresh_config, name="config-refresh", daemon=True).start()
+
+def _init_config():
+    """Init config without waiting on AppConfig where possible, refreshed in the background.
+
+    The /tmp snapshot only exists when this execution environment has loaded config before
+    (e.g. after a runtime restart); a new environment starts from CONFIG_DEFAULT_JSON, and
+    only without either does the first request block on AppConfig/SSM.
+    """
+    global _CONFIG, _CONFIG_AT
+    timings = {}
+    t = time.perf_counter()
+    snap, loaded_at = _read_snapshot()
+    default = {} if snap else _default_config()
+    if snap:
+        _CONFIG, _CONFIG_AT = snap, loaded_at
+        timings["source"] = "snapshot"
+        timings["snapshot_age_s"] = round(time.time() - loaded_at, 1)
+    elif default:
+        _CONFIG, _CONFIG_AT = default, 0.0   # stale on purpose: the first request starts a refresh
+        timings["source"] = "default"
+    else:
+        _CONFIG, _CONFIG_AT = load_config(timings), time.time()
+        _write_snapshot(_CONFIG, _CONFIG_AT)
+    timings["config_ms"] = _ms_since(t)
+    return timings
+
+def _emit_init_timings(timings):
+    # CloudWatch embedded metric format: one log line, turned into metrics without any API call.
+    metrics = [k for k, v in timings.items() if k.endswith("_ms") and isinstance(v, (int, float))]
+    print(json.dumps(dict(timings, _aws={
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [{
+            "Namespace": METRICS_NAMESPACE,
+            "Dimensions": [["source"]],
+            "Metrics": [{"Name": m, "Unit": "Milliseconds"} for m in metrics],
+        }],
+    })))
+
+def _error(status, message, **extra):
+    return {
+        "statusCode": status,
+        "headers": {"content-type": "application/json"},
+        "body": json.dumps(dict(extra, error=message))
+    }
 
-    BUCKET = _CONFIG["BUCKET_NAME"]
-    TABLE  = _CONFIG["DDB_TABLE_METADATA"]
-    STREAM = _CONFIG.get("KINESIS_STREAM_NAME", "")
-    URL_EXPIRY = int(_CONFIG["URL_EXPIRY_SECONDS"])
-    MAX_SIZE_MB = int(_CONFIG["MAX_SIZE_MB"])
-    DEFAULT_SIZES = _CONFIG["DEFAULT_SIZES"]
+def lambda_handler(event, context):
+    try:
+        return _handle(event, context)
+    finally:
+        # Buffered events go out before the invocation ends (the container may be frozen after).
+        if _PUB is not None:
+            _PUB.flush()
+
+def _handle(event, context):
+    global _S3, _DDB, _KIN, _PUB, _PUB_REGION
+
+    cold = _CONFIG is None
+    if cold:
+        timings = _init_config()
+    _maybe_refresh()
+    cfg = _CONFIG
+
+    region = cfg["REGION"]
+    t = time.perf_counter()
+    # Kinesis is only touched when a stream is configured
+    _S3, _DDB, _KIN = clients(region, with_kinesis=bool(cfg.get("KINESIS_STREAM_NAME")))
+    if _KIN is not None and _PUB_REGION != region:
+        if _PUB is not None:
+            _PUB.flush()
+        # No background thread: the Lambda container is frozen between invocations.
+        _PUB = EventPublisher(kinesis=_KIN, background=False)
+        _PUB_REGION = region
+
+    if cold:
+        timings["clients_ms"] = _ms_since(t)
+        timings["import_ms"] = _IMPORT_MS
+        _emit_init_timings(timings)
+
+    if _is_status_request(event):
+        return _status(event, cfg["DDB_TABLE_METADATA"])
+
+    BUCKET = cfg["BUCKET_NAME"]
+    TABLE  = cfg["DDB_TABLE_METADATA"]
+    STREAM = cfg.get("KINESIS_STREAM_NAME", "")
+    URL_EXPIRY = int(cfg["URL_EXPIRY_SECONDS"])
+    MAX_SIZE_MB = int(cfg["MAX_SIZE_MB"])
+    DEFAULT_SIZES = cfg["DEFAULT_SIZES"]
 
     # optional client sizes override
     try:
@@ -170,54 +364,223 @@ def lambda_handler(event, context):
     override_sizes = body.get("sizes") if isinstance(body, dict) else None
 
     if isinstance(override_sizes, list) and 0 < len(override_sizes) <= 10:
-        candidate = [str(s).strip() for s in override_sizes if s.strip()]
+        candidate = [str(s).strip() for s in override_sizes if str(s).strip()]
+        unknown = [s for s in candidate if s not in cfg["SIZE_NAMES"]]
+        if unknown:
+            return _error(400, f"Unknown sizes: {unknown}", allowed=cfg["SIZE_NAMES"])
         if candidate:
-            DEFAULT_SIZES = candidate
+            DEFAULT_SIZES = list(dict.fromkeys(candidate))
+
+    count = body.get("count") if isinstance(body, dict) else None
+    if count is not None:
+        max_batch = int(cfg["MAX_BATCH_UPLOADS"])
+        if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= max_batch:
+            return _error(400, f"count must be an integer between 1 and {max_batch}")
+
+    image_ids = [uuid.uuid4().hex[:26] for _ in range(count or 1)]
+    uploads = [
+        {"imageId": image_id, "upload": _presign(BUCKET, image_id, URL_EXPIRY, MAX_SIZE_MB)}
+        for image_id in image_ids
+    ]
+
+    now = int(time.time())
+    items = [{
+        "id": {"S": image_id},
+        "status": {"S": "PENDING"},
+        "created_at": {"N": str(now)},
+        "variants": {"M": {}},
+        # the worker renders exactly these and sets PROCESSED once all of them exist
+        "requested_sizes": {"L": [{"S": sz} for sz in DEFAULT_SIZES]}
+    } for image_id in image_ids]
+
+    if len(items) == 1:
+        _DDB.put_item(TableName=TABLE, Item=items[0])
+    else:
+        _batch_put(TABLE, items)
+
+    if STREAM:
+        # buffered; sent in one put_records call when the invocation ends, failed records are retried
+        for image_id in image_ids:
+            _PUB.put_record(STREAM, image_id, {"imageId": image_id, "action": "init"})
+
+    if count is None:
+        payload = dict(uploads[0], bucket=BUCKET, sizes=DEFAULT_SIZES)
+    else:
+        payload = {"bucket": BUCKET, "sizes": DEFAULT_SIZES, "uploads": uploads}
+
+    return {
+        "statusCode": 200,
+        "headers": {"content-type": "application/json"},
+        "body": json.dumps(payload)
+    }
 
-    image_id = uuid.uuid4().hex[:26]
+def _presign(bucket, image_id, expiry, max_size_mb):
     key = f"images/{image_id}/original.jpg"
 
     conditions = [
-        ["content-length-range", 1, MAX_SIZE_MB * 1024 * 1024],
+        ["content-length-range", 1, max_size_mb * 1024 * 1024],
         {"key": key}
     ]
 
     fields = {"key": key}
 
-    presigned = _S3.generate_presigned_post(
-        Bucket=BUCKET,
+    return _S3.generate_presigned_post(
+        Bucket=bucket,
         Key=key,
         Fields=fields,
         Conditions=conditions,
-        ExpiresIn=URL_EXPIRY
-    )
-
-    now = int(time.time())
-    
-    _DDB.put_item(
-        TableName=TABLE,
-        Item={
-            "id": {"S": image_id},
-            "status": {"S": "PENDING"},
-            "created_at": {"N": str(now)},
-            "variants": {"M": {}}
-        }
+        ExpiresIn=expiry
     )
 
-    if STREAM:
-        try:
-            _KIN.put_record(StreamName=STREAM, PartitionKey=image_id,
-                            Data=json.dumps({"imageId": image_id, "action": "init"}))
-        except Exception:
-            pass
+def _batch_put(table, items, max_attempts=6):
+    """BatchWriteItem in chunks of 25, retrying UnprocessedItems with exponential backoff."""
+    for i in range(0, len(items), 25):
+        requests = [{"PutRequest": {"Item": item}} for item in items[i:i + 25]]
+        attempt = 0
+        while requests:
+            attempt += 1
+            resp = _DDB.batch_write_item(RequestItems={table: requests})
+            requests = resp.get("UnprocessedItems", {}).get(table, [])
+            if requests and attempt >= max_attempts:
+                raise RuntimeError(f"{len(requests)} PENDING record(s) still unprocessed after {attempt} attempts")
+            if requests:
+                time.sleep(min(1.0, 0.05 * (2 ** (attempt - 1))))
+
+# ---------------- Image status (GET) ----------------
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_FINAL = ("PROCESSED", "FAILED")
+_STATUS_PROJECTION = {
+    "ProjectionExpression": "id, #st, created_at, completed_at, requested_sizes, variants, failure",
+    "ExpressionAttributeNames": {"#st": "status"},
+}
+
+def _is_status_request(event):
+    http = (event.get("requestContext") or {}).get("http") or {}
+    return (http.get("method") or event.get("httpMethod")) == "GET"
+
+def _status(event, table):
+    """GET /images/{id}/status -> one image; GET /images/status?ids=a,b,... -> {"images": [...], "missing": [...]}.
+
+    Reads go through a short-TTL cache in the container; one id is a GetItem, several are BatchGetItem.
+    The response carries an ETag of its body, and a matching If-None-Match gets an empty 304.
+    """
+    single = ((event.get("pathParameters") or {}).get("id") or "").strip()
+    if single:
+        ids = [single]
+    else:
+        raw = (event.get("queryStringParameters") or {}).get("ids") or ""
+        ids = list(dict.fromkeys(i.strip() for i in raw.split(",") if i.strip()))
+    if not ids:
+        return _error(400, "Pass an image id in the path or ?ids=a,b,...")
+    if len(ids) > MAX_STATUS_IDS:
+        return _error(400, f"At most {MAX_STATUS_IDS} ids per request")
+    bad = [i for i in ids if not _ID_RE.match(i)]
+    if bad:
+        return _error(400, f"Invalid image ids: {bad[:10]}")
+
+    found = _cached_status(table, ids)
+    if single:
+        if found.get(single) is None:
+            return _error(404, "Unknown imageId", imageId=single)
+        payload = found[single]
+    else:
+        payload = {"images": [found[i] for i in ids if found.get(i)],
+                   "missing": [i for i in ids if not found.get(i)]}
+
+    body = json.dumps(payload, sort_keys=True)
+    etag = '"' + hashlib.sha1(body.encode("utf-8")).hexdigest()[:24] + '"'
+    views = [v for v in found.values() if v]
+    final = views and len(views) == len(ids) and all(v["status"] in _FINAL for v in views)
+    headers = {"etag": etag,
+               "cache-control": f"private, max-age={int(STATUS_FINAL_CACHE_SECONDS if final else STATUS_CACHE_SECONDS)}"}
+
+    sent = {k.lower(): v for k, v in (event.get("headers") or {}).items()}.get("if-none-match", "")
+    tags = [t.strip().removeprefix("W/") for t in sent.split(",")]
+    if etag in tags or "*" in tags:
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    return {"statusCode": 200, "headers": dict(headers, **{"content-type": "application/json"}), "body": body}
+
+def _cached_status(table, ids):
+    """imageId -> status view (None if there is no such image); only expired or unseen ids are read from DynamoDB."""
+    now = time.time()
+    out, todo = {}, []
+    for image_id in ids:
+        hit = _STATUS_CACHE.get(image_id)
+        if hit and hit[0] > now:
+            out[image_id] = hit[1]
+        else:
+            todo.append(image_id)
+    if not todo:
+        return out
+
+    if len(todo) == 1:
+        item = _DDB.get_item(TableName=table, Key={"id": {"S": todo[0]}}, **_STATUS_PROJECTION).get("Item")
+        items = [item] if item else []
+    else:
+        items = _batch_get(table, todo)
+    fetched = {i["id"]["S"]: _status_view(i) for i in items}
+
+    for image_id in todo:
+        view = fetched.get(image_id)
+        ttl = STATUS_FINAL_CACHE_SECONDS if view and view["status"] in _FINAL else STATUS_CACHE_SECONDS
+        _STATUS_CACHE[image_id] = (now + ttl, view)
+        _STATUS_CACHE.move_to_end(image_id)
+        out[image_id] = view
+    while len(_STATUS_CACHE) > STATUS_CACHE_MAX:
+        _STATUS_CACHE.popitem(last=False)
+    return out
 
-    return {
-        "statusCode": 200,
-        "headers": {"content-type": "application/json"},
-        "body": json.dumps({
-            "imageId": image_id,
-            "bucket": BUCKET,
-            "upload": presigned,
-            "sizes": DEFAULT_SIZES
-        })
+def _batch_get(table, ids, max_attempts=6):
+    """BatchGetItem in chunks of 100, retrying UnprocessedKeys with exponential backoff."""
+    items = []
+    for i in range(0, len(ids), 100):
+        request = dict(_STATUS_PROJECTION, Keys=[{"id": {"S": image_id}} for image_id in ids[i:i + 100]])
+        attempt = 0
+        while request:
+            attempt += 1
+            resp = _DDB.batch_get_item(RequestItems={table: request})
+            items.extend(resp.get("Responses", {}).get(table, []))
+            request = resp.get("UnprocessedKeys", {}).get(table)
+            if request and attempt >= max_attempts:
+                raise RuntimeError(f"{len(request['Keys'])} status read(s) still unprocessed after {attempt} attempts")
+            if request:
+                time.sleep(min(1.0, 0.05 * (2 ** (attempt - 1))))
+    return items
+
+def _plain(value):
+    """DynamoDB attribute value -> plain JSON value."""
+    (t, v), = value.items()
+    if t == "N":
+        return int(v) if v.lstrip("-").isdigit() else float(v)
+    if t == "M":
+        return {k: _plain(x) for k, x in v.items()}
+    if t == "L":
+        return [_plain(x) for x in v]
+    if t == "NULL":
+        return None
+    return v   # S, BOOL, SS
+
+def _status_view(item):
+    variants = {}
+    for size, v in _plain(item.get("variants", {"M": {}})).items():
+        view = {k: v[k] for k in ("key", "width", "height", "bytes", "aliasOf") if k in v}
+        if v.get("formats"):
+            view["formats"] = {fmt: f.get("key") for fmt, f in v["formats"].items()}
+        variants[size] = view
+    requested = _plain(item["requested_sizes"]) if "requested_sizes" in item else []
+    out = {
+        "imageId": item["id"]["S"],
+        "status": item.get("status", {}).get("S", "PENDING"),
+        "requestedSizes": requested,
+        "variants": variants,
+        "pending": [s for s in requested if s not in variants],
+        "createdAt": _plain(item["created_at"]) if "created_at" in item else None,
     }
+    if "completed_at" in item:
+        out["completedAt"] = _plain(item["completed_at"])
+    if "failure" in item:
+        failure = _plain(item["failure"])
+        out["failure"] = {k: failure[k] for k in ("reason", "detail") if k in failure}
+    return out
+
+_IMPORT_MS = _ms_since(_T0)
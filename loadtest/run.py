@@ -0,0 +1,312 @@
+# Load test: the uploader's lambda_handler and the resizer's main_loop against in-process AWS stand-ins.
+#
+# Usage (from the repository root):
+#   python loadtest/run.py                                   # 2 uploads/s for 30 s, 2000x1500 originals
+#   python loadtest/run.py --rate 10 --duration 120 --cpu-procs 4 --io-threads 16 --out run.json
+#   RESIZE_FANOUT=per_size FAST_RESIZE=0 python loadtest/run.py ...
+#
+# Every upload is one init request to lambda_handler followed by a PUT of a synthetic JPEG to the returned key; the
+# stand-in bucket then sends the ObjectCreated event to the ingest queue, as the real bucket notification does.
+# The worker runs in this process exactly as in the container (poller, process pool, leases, publisher, metrics),
+# so its ENV tunables apply unchanged. The report gives sustained throughput, queue depth and oldest-message age,
+# upload -> first variant, upload -> each size and upload -> PROCESSED latency percentiles, and the worker's
+# per-stage summary. Small sizes go through the priority lane unless --no-priority-lane is given.
+import os, sys, json, time, random, argparse, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "ecs-resizer"), os.path.join(ROOT, "lambda-uploader"), os.path.dirname(__file__)]
+
+BUCKET = "loadtest-images"
+TABLE = "loadtest-metadata"
+STREAM = "loadtest-events"
+INGEST_Q = "https://sqs.local/000000000000/loadtest-ingest"
+RESIZE_Q = "https://sqs.local/000000000000/loadtest-resize"
+PRIORITY_Q = "https://sqs.local/000000000000/loadtest-priority"
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"n": len(values), "p50": pick(0.5), "p90": pick(0.9), "p95": pick(0.95), "p99": pick(0.99),
+            "max": values[-1], "avg": sum(values) / len(values)}
+
+
+class Tracker:
+    """Upload, first-variant, per-size and PROCESSED times per image, fed by the DynamoDB stand-in's write hook.
+
+    An image whose status turns PROCESSED while a requested size is still missing is counted as premature.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = {}   # imageId -> {"sizes", "uploaded", "first", "at": {size: time}, "done"}
+        self.all_done = threading.Event()
+        self._expected = None
+
+    def start(self, image_id, sizes):
+        with self._lock:
+            self.images[image_id] = {"sizes": set(sizes), "uploaded": None, "first": None, "at": {}, "done": None,
+                                     "premature": False}
+
+    def uploaded(self, image_id):
+        with self._lock:
+            self.images[image_id]["uploaded"] = time.monotonic()
+
+    def on_write(self, table, item):
+        if table != TABLE:
+            return
+        now = time.monotonic()
+        with self._lock:
+            rec = self.images.get(item["id"]["S"])
+            if rec is None or rec["done"] is not None:
+                return
+            variants = set(item.get("variants", {}).get("M", {}))
+            if rec["first"] is None and variants:
+                rec["first"] = now
+            for sz in variants:
+                rec["at"].setdefault(sz, now)
+            if item.get("status", {}).get("S") == "PROCESSED":
+                rec["done"] = now
+                rec["premature"] = not rec["sizes"] <= variants
+                self._check()
+
+    def expect(self, n):
+        with self._lock:
+            self._expected = n
+            self._check()
+
+    def _check(self):
+        if self._expected is not None and sum(1 for r in self.images.values() if r["done"]) >= self._expected:
+            self.all_done.set()
+
+    def snapshot(self):
+        with self._lock:
+            return [dict(r, at=dict(r["at"])) for r in self.images.values()]
+
+
+class QueueSampler(threading.Thread):
+    """Once a second: visible / in-flight count and oldest-message age of every work queue."""
+
+    def __init__(self, sqs, queues, interval=1.0):
+        super().__init__(name="queue-sampler", daemon=True)
+        self.sqs = sqs
+        self.queues = queues   # {name: url}
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        t0 = time.monotonic()
+        while not self._done.wait(self.interval):
+            self.samples.append(dict(
+                {name: self.sqs.stats(url) for name, url in self.queues.items()},
+                t=round(time.monotonic() - t0, 1),
+            ))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def _originals(n, width, height):
+    from quality_check import synthetic_jpeg
+    return [synthetic_jpeg(width, height, seed) for seed in range(n)]
+
+
+def _upload(handler, s3, tracker, originals, unique, sizes):
+    """One client: init request, then the PUT. Returns the handler latency in seconds (None on an error)."""
+    t = time.perf_counter()
+    body = {"sizes": sizes} if sizes else {}
+    resp = handler.lambda_handler({"body": json.dumps(body)}, None)
+    latency = time.perf_counter() - t
+    if resp["statusCode"] != 200:
+        print(f"init failed: {resp}", file=sys.stderr)
+        return None
+    payload = json.loads(resp["body"])
+    image_id, key = payload["imageId"], payload["upload"]["fields"]["key"]
+    tracker.start(image_id, payload["sizes"])
+    data = random.choice(originals)
+    if unique:
+        # bytes after the JPEG EOI marker are ignored by decoders but give every upload its own digest
+        data += os.urandom(16)
+    s3.put_object(Bucket=BUCKET, Key=key, Body=data, ContentType="image/jpeg")
+    tracker.uploaded(image_id)
+    return latency
+
+
+def _generate(args, handler, s3, tracker, originals):
+    """Open-loop arrivals at --rate for --duration; returns (uploads, handler latencies)."""
+    latencies, futures = [], []
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()] if args.sizes else None
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        t0 = time.monotonic()
+        n = 0
+        while True:
+            due = t0 + n / args.rate
+            if due - t0 >= args.duration:
+                break
+            time.sleep(max(0.0, due - time.monotonic()))
+            futures.append(pool.submit(_upload, handler, s3, tracker, originals, not args.duplicates, sizes))
+            n += 1
+        for f in futures:
+            try:
+                lat = f.result()
+            except Exception as e:
+                print(f"upload failed: {e}", file=sys.stderr)
+                continue
+            if lat is not None:
+                latencies.append(lat)
+    return len(latencies), latencies
+
+
+def _report(args, tracker, sampler, handler_lat, gen_window, app, services, wall):
+    images = tracker.snapshot()
+    done = [r for r in images if r["done"] is not None and r["uploaded"] is not None]
+    t0, t_end = gen_window
+    # sustained: completions while uploads were still arriving, after a warm-up of 10% of the run
+    warm = t0 + 0.1 * (t_end - t0)
+    steady = [r for r in done if warm <= r["done"] <= t_end]
+    last = max((r["done"] for r in done), default=t0)
+    sizes_done = sum(len(r["sizes"]) for r in done)
+
+    def lag(queue):
+        depth = [s[queue]["visible"] + s[queue]["inflight"] for s in sampler.samples]
+        age = [s[queue]["oldest_age"] for s in sampler.samples]
+        return {"max_depth": max(depth, default=0), "avg_depth": sum(depth) / len(depth) if depth else 0,
+                "max_oldest_age_s": max(age, default=0.0),
+                "final_depth": depth[-1] if depth else 0}
+
+    summary = {
+        "offered_rate": args.rate,
+        "uploads": len(images),
+        "completed": len(done),
+        "incomplete": len(images) - len(done),
+        "premature_processed": sum(1 for r in done if r["premature"]),
+        "wall_s": wall,
+        "sustained_images_per_s": len(steady) / (t_end - warm) if t_end > warm else 0.0,
+        "overall_images_per_s": len(done) / (last - t0) if last > t0 else 0.0,
+        "overall_variants_per_s": sizes_done / (last - t0) if last > t0 else 0.0,
+        "upload_to_first_variant_s": _percentiles([r["first"] - r["uploaded"] for r in done if r["first"]]),
+        "upload_to_processed_s": _percentiles([r["done"] - r["uploaded"] for r in done]),
+        "upload_to_size_s": {sz: _percentiles([r["at"][sz] - r["uploaded"] for r in done if sz in r["at"]])
+                             for sz in sorted({sz for r in done for sz in r["sizes"]})},
+        "uploader_invocation_s": _percentiles(handler_lat),
+        "queues": {name: lag(name) for name in sampler.queues},
+        "calls": {name: dict(svc.calls) for name, svc in services.items()},
+    }
+
+    print(f"offered {args.rate:g}/s for {args.duration:g}s: {summary['uploads']} uploads, {summary['completed']} completed, "
+          f"{summary['incomplete']} incomplete")
+    print(f"throughput: sustained={summary['sustained_images_per_s']:.2f} images/s "
+          f"overall={summary['overall_images_per_s']:.2f} images/s ({summary['overall_variants_per_s']:.2f} variants/s)")
+    if summary["premature_processed"]:
+        print(f"{summary['premature_processed']} image(s) were PROCESSED before all requested sizes existed")
+    latencies = [(name, summary[name]) for name in ("upload_to_first_variant_s", "upload_to_processed_s")]
+    latencies += [(f"  upload_to_{sz}_s", p) for sz, p in summary["upload_to_size_s"].items()]
+    for name, p in latencies + [("uploader_invocation_s", summary["uploader_invocation_s"])]:
+        if p:
+            print(f"{name:<28} n={p['n']:<5} p50={p['p50']:.3f}s p90={p['p90']:.3f}s p95={p['p95']:.3f}s "
+                  f"p99={p['p99']:.3f}s max={p['max']:.3f}s")
+    for q, s in summary["queues"].items():
+        print(f"queue {q:<8} max_depth={s['max_depth']} avg_depth={s['avg_depth']:.1f} "
+              f"max_oldest_age={s['max_oldest_age_s']:.1f}s final_depth={s['final_depth']}")
+    stages = app._METRICS.summary(cumulative=True).strip()
+    if stages:
+        print(f"worker {stages}")
+
+    if args.out:
+        report = {
+            "args": vars(args),
+            "worker": {k: getattr(app, k) for k in ("WORKER_MODE", "RESIZE_FANOUT", "CPU_PROCS", "IO_THREADS",
+                                                     "MAX_INFLIGHT", "RECEIVE_BATCH_SIZE", "DEDUP_MODE",
+                                                     "PRIORITY_SIZES", "PRIORITY_WEIGHT", "RESIZE_WEIGHT")},
+            "summary": summary,
+            "queue_samples": sampler.samples,
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True, default=str)
+        print(f"results written to {args.out}")
+    return summary
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description="Load test of the uploader and resizer against in-process AWS stand-ins.")
+    ap.add_argument("--rate", type=float, default=2.0, help="uploads per second")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds of uploads")
+    ap.add_argument("--drain-timeout", type=float, default=60.0, help="seconds to wait for the backlog afterwards")
+    ap.add_argument("--width", type=int, default=2000)
+    ap.add_argument("--height", type=int, default=1500)
+    ap.add_argument("--originals", type=int, default=4, help="distinct synthetic originals to pick from")
+    ap.add_argument("--duplicates", action="store_true", help="re-upload identical bytes (exercises the dedup index)")
+    ap.add_argument("--sizes", help="comma-separated sizes requested per upload (default: the configured ones)")
+    ap.add_argument("--clients", type=int, default=16, help="concurrent upload clients")
+    ap.add_argument("--latency-ms", type=float, default=5.0, help="per-call latency of the AWS stand-ins")
+    ap.add_argument("--cpu-procs", type=int, help="CPU_PROCS for the worker")
+    ap.add_argument("--io-threads", type=int, help="IO_THREADS for the worker")
+    ap.add_argument("--no-priority-lane", action="store_true", help="send every size to the resize queue")
+    ap.add_argument("--out", help="write the report as JSON to this file")
+    args = ap.parse_args(argv)
+
+    # Everything the worker and the uploader read at import or at init
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    for k, v in {
+        "BUCKET_NAME": BUCKET, "DDB_TABLE_METADATA": TABLE, "KINESIS_STREAM_NAME": STREAM,
+        "INGEST_QUEUE_URL": INGEST_Q, "RESIZE_QUEUE_URL": RESIZE_Q, "REGION": "us-east-1",
+        "CONFIG_SNAPSHOT_PATH": os.path.join(tmp, "uploader-config.json"),
+        "METRICS_PORT": "0", "LOG_LEVEL": "WARNING", "CONFIG_POLL_SECONDS": "0",
+    }.items():
+        os.environ.setdefault(k, v)
+    if args.cpu_procs:
+        os.environ["CPU_PROCS"] = str(args.cpu_procs)
+    if args.io_threads:
+        os.environ["IO_THREADS"] = str(args.io_threads)
+    if not args.no_priority_lane:
+        os.environ.setdefault("PRIORITY_QUEUE_URL", PRIORITY_Q)
+
+    import app, handler
+    from standins import S3, SQS, DynamoDB, Kinesis
+
+    sqs = SQS(latency_ms=args.latency_ms)
+    s3 = S3(sqs=sqs, latency_ms=args.latency_ms)
+    ddb = DynamoDB(latency_ms=args.latency_ms)
+    kin = Kinesis(latency_ms=args.latency_ms)
+    s3.notify(BUCKET, "images/", INGEST_Q)
+    tracker = Tracker()
+    ddb.on_write(tracker.on_write)
+
+    originals = _originals(max(1, args.originals), args.width, args.height)
+
+    app.init(cfg={}, clients={"sqs": sqs, "s3": s3, "dynamodb": ddb, "kinesis": kin})
+    worker = threading.Thread(target=app.main_loop, name="worker")
+    worker.start()
+    if not app.READY.wait(60):
+        print("worker did not start", file=sys.stderr)
+        return 1
+    handler.use_clients(os.environ["REGION"], s3=s3, dynamodb=ddb, kinesis=kin)
+
+    queues = {"ingest": INGEST_Q, "resize": RESIZE_Q}
+    if app.PRIORITY_Q_URL:
+        queues["priority"] = app.PRIORITY_Q_URL
+    sampler = QueueSampler(sqs, queues)
+    sampler.start()
+    t_start = time.monotonic()
+    try:
+        uploads, handler_lat = _generate(args, handler, s3, tracker, originals)
+        t_end = time.monotonic()
+        tracker.expect(uploads)
+        if not tracker.all_done.wait(args.drain_timeout):
+            print(f"drain timeout after {args.drain_timeout:g}s; reporting what completed", file=sys.stderr)
+    finally:
+        app.stop()
+        worker.join()
+        sampler.stop()
+    services = {"s3": s3, "sqs": sqs, "dynamodb": ddb, "kinesis": kin}
+    summary = _report(args, tracker, sampler, handler_lat, (t_start, t_end), app, services, time.monotonic() - t_start)
+    return 0 if summary["incomplete"] == 0 and not summary["premature_processed"] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,563 @@
+# In-process stand-ins for the S3, SQS, DynamoDB and Kinesis calls the uploader and the resizer make.
+#
+# They implement only what this repo uses, with the same request/response shapes as boto3 and the same
+# semantics where it matters for a load test: SQS visibility timeouts and long polling, S3 event
+# notifications to a queue, ranged/conditional GETs, DynamoDB update/condition expressions. Every call can
+# be given a latency so that throughput numbers include realistic round trips.
+import io, json, time, uuid, random, hashlib, threading, copy, re
+from collections import deque
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+
+def _error(code, message, op):
+    return ClientError({"Error": {"Code": code, "Message": message}}, op)
+
+
+class _Service:
+    def __init__(self, latency_ms=0.0, jitter=0.2):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+
+    def _call(self, op):
+        with self._calls_lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0 * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+# -------- S3 --------
+class _Body:
+    def __init__(self, data):
+        self._f = io.BytesIO(data)
+
+    def read(self, n=-1):
+        return self._f.read(n if n and n > 0 else -1)
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self._f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class S3(_Service):
+    """Objects in memory; ObjectCreated events go to the queues registered with notify()."""
+
+    def __init__(self, sqs=None, **kw):
+        super().__init__(**kw)
+        self._lock = threading.Lock()
+        self._objects = {}      # (bucket, key) -> {"data", "etag", "type"}
+        self._notify = []       # (bucket, prefix, queue_url)
+        self._sqs = sqs
+
+    def notify(self, bucket, prefix, queue_url):
+        self._notify.append((bucket, prefix, queue_url))
+
+    def _store(self, bucket, key, data, content_type, event):
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        with self._lock:
+            self._objects[(bucket, key)] = {"data": data, "etag": etag, "type": content_type}
+        for b, prefix, qurl in self._notify:
+            if b == bucket and key.startswith(prefix):
+                rec = {"eventSource": "aws:s3", "eventName": f"ObjectCreated:{event}",
+                       "eventTime": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) + ".%03dZ" % (time.time() % 1 * 1000),
+                       "s3": {"bucket": {"name": bucket}, "object": {"key": key, "size": len(data), "eTag": etag.strip('"')}}}
+                self._sqs.send_message(QueueUrl=qurl, MessageBody=json.dumps({"Records": [rec]}))
+        return etag
+
+    def _get(self, bucket, key, op):
+        with self._lock:
+            obj = self._objects.get((bucket, key))
+        if obj is None:
+            raise _error("NoSuchKey", f"{key} does not exist", op)
+        return obj
+
+    def put_object(self, Bucket, Key, Body=b"", ContentType="binary/octet-stream", **_):
+        self._call("PutObject")
+        data = Body if isinstance(Body, bytes) else Body.read()
+        return {"ETag": self._store(Bucket, Key, data, ContentType, "Put")}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None, **_):
+        self._call("UploadFileobj")
+        self._store(Bucket, Key, Fileobj.read(), (ExtraArgs or {}).get("ContentType", "binary/octet-stream"),
+                    "CompleteMultipartUpload")
+
+    def copy_object(self, Bucket, Key, CopySource, ContentType=None, **_):
+        self._call("CopyObject")
+        src = self._get(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        return {"CopyObjectResult": {"ETag": self._store(Bucket, Key, src["data"], ContentType or src["type"], "Copy")}}
+
+    def delete_object(self, Bucket, Key, **_):
+        self._call("DeleteObject")
+        with self._lock:
+            self._objects.pop((Bucket, Key), None)
+        return {}
+
+    def head_object(self, Bucket, Key, **_):
+        self._call("HeadObject")
+        obj = self._get(Bucket, Key, "HeadObject")
+        return {"ContentLength": len(obj["data"]), "ETag": obj["etag"], "ContentType": obj["type"]}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, **_):
+        self._call("GetObject")
+        obj = self._get(Bucket, Key, "GetObject")
+        if IfMatch and IfMatch != obj["etag"]:
+            raise _error("PreconditionFailed", "At least one of the pre-conditions you specified did not hold", "GetObject")
+        data, total = obj["data"], len(obj["data"])
+        resp = {"ETag": obj["etag"], "ContentType": obj["type"]}
+        if Range:
+            start, end = Range.split("=", 1)[1].split("-")
+            start, end = int(start), min(int(end or total - 1), total - 1)
+            data = data[start:end + 1]
+            resp["ContentRange"] = f"bytes {start}-{start + len(data) - 1}/{total}"
+        resp.update(Body=_Body(data), ContentLength=len(data))
+        return resp
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600):
+        # no network call in boto3 either
+        return {"url": f"https://{Bucket}.s3.local/", "fields": dict(Fields or {}, key=Key)}
+
+    def count(self, bucket, prefix=""):
+        with self._lock:
+            return sum(1 for b, k in self._objects if b == bucket and k.startswith(prefix))
+
+
+# -------- SQS --------
+class SQS(_Service):
+    """Standard queues with visibility timeouts and long polling; queue URLs are created on first use."""
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self._cond = threading.Condition()
+        self._queues = {}
+
+    def _q(self, url):
+        q = self._queues.get(url)
+        if q is None:
+            q = self._queues[url] = {"visible": deque(), "inflight": {}}
+        return q
+
+    def _expire(self, q, now):
+        for receipt, (msg, until) in list(q["inflight"].items()):
+            if until <= now:
+                del q["inflight"][receipt]
+                q["visible"].appendleft(msg)
+
+    def _send(self, url, body):
+        msg = {"MessageId": str(uuid.uuid4()), "Body": body, "sent": time.time(), "receives": 0}
+        with self._cond:
+            self._q(url)["visible"].append(msg)
+            self._cond.notify_all()
+        return msg["MessageId"]
+
+    def send_message(self, QueueUrl, MessageBody, **_):
+        self._call("SendMessage")
+        return {"MessageId": self._send(QueueUrl, MessageBody)}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self._call("SendMessageBatch")
+        return {"Successful": [{"Id": e["Id"], "MessageId": self._send(QueueUrl, e["MessageBody"])} for e in Entries],
+                "Failed": []}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=30, **_):
+        self._call("ReceiveMessage")
+        deadline = time.monotonic() + WaitTimeSeconds
+        out = []
+        with self._cond:
+            q = self._q(QueueUrl)
+            while True:
+                self._expire(q, time.monotonic())
+                while q["visible"] and len(out) < MaxNumberOfMessages:
+                    msg = q["visible"].popleft()
+                    msg["receives"] += 1
+                    receipt = uuid.uuid4().hex
+                    q["inflight"][receipt] = (msg, time.monotonic() + VisibilityTimeout)
+                    out.append({"MessageId": msg["MessageId"], "ReceiptHandle": receipt, "Body": msg["Body"],
+                                "Attributes": {"SentTimestamp": str(int(msg["sent"] * 1000)),
+                                               "ApproximateReceiveCount": str(msg["receives"])}})
+                left = deadline - time.monotonic()
+                if out or left <= 0:
+                    return {"Messages": out} if out else {}
+                self._cond.wait(min(left, 0.5))   # also wakes up to re-check visibility timeouts
+
+    def _delete(self, url, receipt):
+        with self._cond:
+            self._q(url)["inflight"].pop(receipt, None)
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self._call("DeleteMessage")
+        self._delete(QueueUrl, ReceiptHandle)
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self._call("DeleteMessageBatch")
+        for e in Entries:
+            self._delete(QueueUrl, e["ReceiptHandle"])
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+    def _change(self, url, receipt, timeout):
+        with self._cond:
+            q = self._q(url)
+            if receipt not in q["inflight"]:
+                return False
+            msg, _ = q["inflight"][receipt]
+            if timeout <= 0:
+                del q["inflight"][receipt]
+                q["visible"].appendleft(msg)
+                self._cond.notify_all()
+            else:
+                q["inflight"][receipt] = (msg, time.monotonic() + timeout)
+            return True
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self._call("ChangeMessageVisibility")
+        if not self._change(QueueUrl, ReceiptHandle, VisibilityTimeout):
+            raise _error("ReceiptHandleIsInvalid", "receipt handle has expired", "ChangeMessageVisibility")
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self._call("ChangeMessageVisibilityBatch")
+        ok, failed = [], []
+        for e in Entries:
+            if self._change(QueueUrl, e["ReceiptHandle"], e["VisibilityTimeout"]):
+                ok.append({"Id": e["Id"]})
+            else:
+                failed.append({"Id": e["Id"], "Code": "ReceiptHandleIsInvalid", "SenderFault": True})
+        return {"Successful": ok, "Failed": failed}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+        self._call("GetQueueAttributes")
+        s = self.stats(QueueUrl)
+        return {"Attributes": {"ApproximateNumberOfMessages": str(s["visible"]),
+                               "ApproximateNumberOfMessagesNotVisible": str(s["inflight"])}}
+
+    def stats(self, url):
+        """{"visible", "inflight", "oldest_age"}: oldest_age is the age in seconds of the oldest unfinished message."""
+        now = time.time()
+        with self._cond:
+            q = self._q(url)
+            self._expire(q, time.monotonic())
+            sent = [m["sent"] for m in q["visible"]] + [m["sent"] for m, _ in q["inflight"].values()]
+            return {"visible": len(q["visible"]), "inflight": len(q["inflight"]),
+                    "oldest_age": now - min(sent) if sent else 0.0}
+
+
+# -------- DynamoDB --------
+_TOKEN = re.compile(r"\s*(<>|<=|>=|[=<>(),]|[#:]?[A-Za-z_][\w.#:]*|\S)")
+
+
+class _Expr:
+    """Minimal DynamoDB expression support: SET (incl. if_not_exists and +/-), ADD, REMOVE, and conditions with
+    attribute_exists / attribute_not_exists / comparisons / AND / OR / NOT / parentheses."""
+
+    def __init__(self, names, values):
+        self.names = names or {}
+        self.values = values or {}
+
+    def path(self, text):
+        return [self.names.get(p, p) for p in text.split(".")]
+
+    @staticmethod
+    def lookup(item, path):
+        cur = {"M": item}
+        for p in path:
+            if "M" not in cur or p not in cur["M"]:
+                return None
+            cur = cur["M"][p]
+        return cur
+
+    @staticmethod
+    def _parent(item, path, op):
+        cur = item
+        for p in path[:-1]:
+            nxt = cur.get(p)
+            if nxt is None or "M" not in nxt:
+                raise _error("ValidationException", "The document path provided in the update expression is invalid for update", op)
+            cur = nxt["M"]
+        return cur
+
+    def operand(self, item, tok):
+        if tok.startswith(":"):
+            return self.values[tok]
+        return self.lookup(item, self.path(tok))
+
+    # conditions
+    def check(self, item, text):
+        self._toks = [t for t in _TOKEN.findall(text) if t.strip()]
+        self._i = 0
+        return self._or(item)
+
+    def _peek(self):
+        return self._toks[self._i] if self._i < len(self._toks) else None
+
+    def _next(self):
+        tok = self._peek()
+        self._i += 1
+        return tok
+
+    def _or(self, item):
+        res = self._and(item)
+        while self._peek() and self._peek().upper() == "OR":
+            self._next()
+            res = self._and(item) or res
+        return res
+
+    def _and(self, item):
+        res = self._not(item)
+        while self._peek() and self._peek().upper() == "AND":
+            self._next()
+            res = self._not(item) and res
+        return res
+
+    def _not(self, item):
+        if self._peek() and self._peek().upper() == "NOT":
+            self._next()
+            return not self._not(item)
+        return self._cmp(item)
+
+    def _cmp(self, item):
+        tok = self._next()
+        if tok == "(":
+            res = self._or(item)
+            self._next()   # ")"
+            return res
+        if tok in ("attribute_exists", "attribute_not_exists"):
+            self._next()
+            path = self._next()
+            self._next()
+            exists = self.lookup(item, self.path(path)) is not None
+            return exists if tok == "attribute_exists" else not exists
+        op = self._next()
+        right = self.operand(item, self._next())
+        return _compare(self.operand(item, tok), op, right)
+
+    # updates
+    def update(self, item, text, op):
+        clauses = re.split(r"\b(SET|ADD|REMOVE|DELETE)\b", text, flags=re.I)
+        for i in range(1, len(clauses), 2):
+            kind, body = clauses[i].upper(), clauses[i + 1]
+            for part in _split_top(body):
+                if kind == "SET":
+                    lhs, rhs = part.split("=", 1)
+                    self._set(item, self.path(lhs.strip()), self._value(item, rhs.strip()), op)
+                elif kind == "ADD":
+                    path_text, val = part.split()
+                    self._add(item, self.path(path_text), self.values[val], op)
+                elif kind == "REMOVE":
+                    path = self.path(part.strip())
+                    self._parent(item, path, op).pop(path[-1], None)
+                else:
+                    raise _error("ValidationException", f"{kind} is not supported by the stand-in", op)
+
+    def _value(self, item, rhs):
+        m = re.match(r"if_not_exists\(\s*([^,\s]+)\s*,\s*(\S+)\s*\)$", rhs)
+        if m:
+            cur = self.lookup(item, self.path(m.group(1)))
+            return cur if cur is not None else self.values[m.group(2)]
+        m = re.match(r"(\S+)\s*([+-])\s*(\S+)$", rhs)
+        if m:
+            a, b = self.operand(item, m.group(1)), self.operand(item, m.group(3))
+            n = Decimal(a["N"]) + (Decimal(b["N"]) if m.group(2) == "+" else -Decimal(b["N"]))
+            return {"N": str(n)}
+        return copy.deepcopy(self.operand(item, rhs))
+
+    def _set(self, item, path, value, op):
+        self._parent(item, path, op)[path[-1]] = value
+
+    def _add(self, item, path, value, op):
+        parent = self._parent(item, path, op)
+        cur = parent.get(path[-1])
+        if "N" in value:
+            parent[path[-1]] = {"N": str(Decimal(cur["N"] if cur else "0") + Decimal(value["N"]))}
+        else:
+            kind = next(iter(value))
+            merged = list(dict.fromkeys((cur or {}).get(kind, []) + value[kind]))
+            parent[path[-1]] = {kind: merged}
+
+
+def _split_top(text):
+    parts, depth, cur = [], 0, ""
+    for ch in text:
+        if ch == "," and depth == 0:
+            parts.append(cur.strip())
+            cur = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        cur += ch
+    if cur.strip():
+        parts.append(cur.strip())
+    return parts
+
+
+def _scalar(v):
+    if v is None:
+        return None
+    if "N" in v:
+        return Decimal(v["N"])
+    return next(iter(v.values()))
+
+
+def _compare(a, op, b):
+    # like DynamoDB, a comparison involving a missing attribute is false
+    a, b = _scalar(a), _scalar(b)
+    if a is None or b is None:
+        return False
+    if op == "=":
+        return a == b
+    if op == "<>":
+        return a != b
+    return {"<": a < b, "<=": a <= b, ">": a > b, ">=": a >= b}[op]
+
+
+class DynamoDB(_Service):
+    """Tables keyed by their key attributes; on_write() callbacks see every item after a successful write."""
+
+    class exceptions:
+        ConditionalCheckFailedException = type("ConditionalCheckFailedException", (ClientError,), {})
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self._lock = threading.RLock()
+        self._tables = {}
+        self._listeners = []
+
+    def on_write(self, fn):
+        self._listeners.append(fn)
+
+    def _t(self, name):
+        return self._tables.setdefault(name, {})
+
+    @staticmethod
+    def _k(key):
+        return json.dumps(key, sort_keys=True)
+
+    def _condition(self, item, cond, names, values, op):
+        if cond and not _Expr(names, values).check(item or {}, cond):
+            raise self.exceptions.ConditionalCheckFailedException(
+                {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}}, op)
+
+    def _written(self, table, item):
+        for fn in self._listeners:
+            fn(table, copy.deepcopy(item))
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **_):
+        self._call("PutItem")
+        key = {k: v for k, v in Item.items() if k == "id"} or Item
+        with self._lock:
+            t = self._t(TableName)
+            self._condition(t.get(self._k(key)), ConditionExpression, ExpressionAttributeNames,
+                            ExpressionAttributeValues, "PutItem")
+            t[self._k(key)] = copy.deepcopy(Item)
+        self._written(TableName, Item)
+        return {}
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **_):
+        self._call("GetItem")
+        with self._lock:
+            item = copy.deepcopy(self._t(TableName).get(self._k(Key)))
+        if item is None:
+            return {}
+        return {"Item": self._project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    @staticmethod
+    def _project(item, projection, names):
+        if not projection:
+            return item
+        wanted = {(names or {}).get(p.strip().split(".")[0], p.strip().split(".")[0]) for p in projection.split(",")}
+        return {k: v for k, v in item.items() if k in wanted}
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues="NONE", **_):
+        self._call("UpdateItem")
+        expr = _Expr(ExpressionAttributeNames, ExpressionAttributeValues)
+        with self._lock:
+            t = self._t(TableName)
+            old = t.get(self._k(Key))
+            self._condition(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, "UpdateItem")
+            item = copy.deepcopy(old) if old else copy.deepcopy(Key)
+            expr.update(item, UpdateExpression, "UpdateItem")
+            t[self._k(Key)] = item
+        self._written(TableName, item)
+        return {"Attributes": copy.deepcopy(item)} if ReturnValues in ("ALL_NEW", "UPDATED_NEW") else {}
+
+    def batch_write_item(self, RequestItems, **_):
+        self._call("BatchWriteItem")
+        for table, requests in RequestItems.items():
+            for r in requests:
+                if "PutRequest" in r:
+                    self.put_item(TableName=table, Item=r["PutRequest"]["Item"])
+                else:
+                    with self._lock:
+                        self._t(table).pop(self._k(r["DeleteRequest"]["Key"]), None)
+        return {"UnprocessedItems": {}}
+
+    def batch_get_item(self, RequestItems, **_):
+        self._call("BatchGetItem")
+        out = {}
+        for table, req in RequestItems.items():
+            with self._lock:
+                items = [copy.deepcopy(self._t(table).get(self._k(k))) for k in req["Keys"]]
+            out[table] = [self._project(i, req.get("ProjectionExpression"), req.get("ExpressionAttributeNames"))
+                          for i in items if i is not None]
+        return {"Responses": out, "UnprocessedKeys": {}}
+
+    def items(self, table):
+        with self._lock:
+            return [copy.deepcopy(i) for i in self._t(table).values()]
+
+
+# -------- Kinesis --------
+class Kinesis(_Service):
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self._lock = threading.Lock()
+        self.records = {}   # stream -> [(partition_key, data, sequence_number)]
+        self._seq = 0
+
+    def _put(self, stream, key, data):
+        with self._lock:
+            self._seq += 1
+            self.records.setdefault(stream, []).append((key, data, str(self._seq)))
+            return {"ShardId": "shardId-000000000000", "SequenceNumber": str(self._seq)}
+
+    def put_record(self, StreamName, Data, PartitionKey, **_):
+        self._call("PutRecord")
+        return self._put(StreamName, PartitionKey, Data)
+
+    def put_records(self, StreamName, Records, **_):
+        self._call("PutRecords")
+        return {"FailedRecordCount": 0, "Records": [self._put(StreamName, r["PartitionKey"], r["Data"]) for r in Records]}
+
+    # one shard per stream; iterators are "<stream>|<index of the next record>"
+    def list_shards(self, StreamName, **_):
+        self._call("ListShards")
+        return {"Shards": [{"ShardId": "shardId-000000000000"}]}
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType, StartingSequenceNumber=None, **_):
+        self._call("GetShardIterator")
+        with self._lock:
+            recs = self.records.get(StreamName, [])
+            if ShardIteratorType == "TRIM_HORIZON":
+                pos = 0
+            elif ShardIteratorType == "LATEST":
+                pos = len(recs)
+            else:
+                pos = next((i + 1 for i, r in enumerate(recs) if r[2] == StartingSequenceNumber), len(recs))
+        return {"ShardIterator": f"{StreamName}|{pos}"}
+
+    def get_records(self, ShardIterator, Limit=1000, **_):
+        self._call("GetRecords")
+        stream, pos = ShardIterator.rsplit("|", 1)
+        with self._lock:
+            batch = self.records.get(stream, [])[int(pos):int(pos) + Limit]
+        return {"Records": [{"SequenceNumber": seq, "PartitionKey": key, "Data": data} for key, data, seq in batch],
+                "NextShardIterator": f"{stream}|{int(pos) + len(batch)}", "MillisBehindLatest": 0}